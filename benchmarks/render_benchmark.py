@@ -0,0 +1,75 @@
+""" Сравнение построения сообщений рейсов до и после кэширования: `python -m benchmarks.render_benchmark -n 2000` """
+import argparse
+import time
+from datetime import datetime
+from statistics import median, quantiles
+from unittest.mock import patch
+
+from bot import formatters, templates
+from bot.api.schemas import FlightSchema
+from tests.samples import flight_payload
+
+
+# formatters as they were before the rendering was memoized, the baseline `get_message` rendered every call with them
+def baseline_ftime(time: datetime | None, placeholder='...') -> str:
+    if time is None:
+        return placeholder
+    return time.strftime('%H:%M')
+
+
+def baseline_ftimezone(time: datetime | None, placeholder='...'):
+    if time is None:
+        return placeholder
+
+    tz = time.strftime('%z')
+    hours, minutes = map(int, [tz[:3], tz[3:]])
+    result = 'UTC'
+    if hours != 0 or minutes != 0:
+        result += f' {hours:+}'
+    if minutes != 0:
+        result += f':{minutes:0>2}'
+    return result
+
+
+def baseline_fdate(date: datetime | None, placeholder='...') -> str:
+    if date is None:
+        return placeholder
+    return date.strftime('%d.%m.%Y')
+
+
+def measure(name: str, render, n: int) -> float:
+    timings = []
+    for i in range(n):
+        start = time.perf_counter()
+        render(i)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    p95 = quantiles(timings, n=20)[-1]
+    print(f'  {name:<24} median {median(timings):8.4f} ms   p95 {p95:8.4f} ms')
+    return median(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=2000)
+    parser.add_argument('--flights', type=int, default=50, help='distinct flights rendered in turn')
+    args = parser.parse_args()
+
+    flights = [FlightSchema.model_validate(flight_payload(id=1000 + i)) for i in range(args.flights)]
+
+    def flight_template(i: int) -> templates.FlightTemplate:
+        flight = flights[i % len(flights)]
+        return templates.get_flight_template(flight)(flight)
+
+    print('flight message:')
+    with patch.multiple(formatters, ftime=baseline_ftime, ftimezone=baseline_ftimezone, fdate=baseline_fdate):
+        baseline = measure('get_message (baseline)', lambda i: flight_template(i).render_message(), args.n)
+    uncached = measure('render_message', lambda i: flight_template(i).render_message(), args.n)
+    cached = measure('get_message (cached)', lambda i: flight_template(i).get_message(), args.n)
+    print(f'  speedup vs baseline: {baseline / uncached:.1f}x uncached, {baseline / cached:.0f}x cached')
+    measure('build_keyboard', lambda i: flight_template(i).build_keyboard(), args.n)
+    measure('get_keyboard (cached)', lambda i: flight_template(i).get_keyboard(), args.n)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+""" Сравнение задержек хранилищ: `python -m benchmarks.storage_benchmark --backend sqlite mongo` """
+import argparse
+import asyncio
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from statistics import median, quantiles
+
+from bot.database.base import BaseSearchQueryStorage, BaseFavoriteStorage
+
+
+QUERY = dict(direction='departure', destination='LED', company='SU', number=None, page=0, limit=5,
+             date_start=datetime(2024, 12, 20, tzinfo=timezone.utc), date_end=datetime(2024, 12, 21, tzinfo=timezone.utc))
+
+
+def storages(backend: str, tmp_dir: str) -> tuple[BaseSearchQueryStorage, BaseFavoriteStorage]:
+    if backend == 'sqlite':
+        from bot.database.sqlite import SqliteDatabase, SqliteSearchQueryStorage, SqliteFavoriteStorage
+
+        database = SqliteDatabase(path=Path(tmp_dir) / 'benchmark.sqlite3')
+        return (SqliteSearchQueryStorage(query_type='flight', database=database),
+                SqliteFavoriteStorage(favorite_type='flight', database=database))
+
+    from bot.database.storage import SearchQueryStorage, FavoriteStorage
+
+    return SearchQueryStorage(query_type='flight'), FavoriteStorage(favorite_type='flight')
+
+
+async def measure(name: str, coro_factory, n: int) -> None:
+    timings = []
+    for i in range(n):
+        start = time.perf_counter()
+        await coro_factory(i)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    p95 = quantiles(timings, n=20)[-1]
+    print(f'  {name:<24} median {median(timings):8.3f} ms   p95 {p95:8.3f} ms')
+
+
+async def run(backend: str, n: int, batch: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        query_storage, favorite_storage = storages(backend, tmp_dir)
+        # a chat id far from real ones so the benchmark doesn't touch user data
+        chat_id = -10 ** 12
+        update = QUERY | {'_updated_at': datetime.now(tz=timezone.utc)}
+
+        print(f'{backend}:')
+        await measure('upsert (1 op)', lambda i: query_storage.upsert_many([((chat_id, i), update)]), n)
+        await measure(f'upsert ({batch} ops batch)',
+                      lambda i: query_storage.upsert_many([((chat_id, i * batch + j), update) for j in range(batch)]),
+                      n)
+        await measure('find_one', lambda i: query_storage.find_one(chat_id=chat_id, message_id=i), n)
+        await measure('add_favorite_one', lambda i: favorite_storage.add_favorite_one(chat_id, i, dict(sked_local=i)), n)
+        await measure('is_favorite', lambda i: favorite_storage.is_favorite(chat_id, i), n)
+        await measure('remove_favorite_one', lambda i: favorite_storage.remove_favorite_one(chat_id, i), n)
+
+        if backend == 'sqlite':
+            await query_storage.database.close()
+        else:
+            query_storage.collection.delete_many({'chat_id': chat_id})
+            favorite_storage.collection.delete_many({'user_id': chat_id})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', nargs='+', default=['sqlite'], choices=['sqlite', 'mongo'])
+    parser.add_argument('-n', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=50)
+    args = parser.parse_args()
+
+    for backend in args.backend:
+        asyncio.run(run(backend, n=args.n, batch=args.batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import logging
+import os
+import time
+from array import array
+from pathlib import Path
+
+from .metrics import metrics
+from .settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class CountMinSketch:
+    """ Оценка частот в фиксированной памяти, оценка никогда не меньше настоящей частоты """
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self._rows = [array('I', bytes(4 * width)) for _ in range(depth)]
+
+    def _indexes(self, key: str) -> list[int]:
+        # double hashing: all rows are addressed by two halves of one digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key: str, count: int = 1) -> int:
+        estimate = None
+        for row, index in zip(self._rows, self._indexes(key)):
+            row[index] += count
+            estimate = row[index] if estimate is None else min(estimate, row[index])
+        return estimate
+
+    def estimate(self, key: str) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+
+class HeavyHitters:
+    """ Top-K ключей по оценкам скетча, минимальный кандидат на вытеснение берется из кучи """
+    def __init__(self, k: int = 50, width: int = 2048, depth: int = 4):
+        self.k = k
+        self.sketch = CountMinSketch(width=width, depth=depth)
+        self.counts: dict[str, int] = {}
+        self._heap: list[tuple[int, str]] = []
+
+    def add(self, key: str, count: int = 1) -> None:
+        estimate = self.sketch.add(key, count)
+        if key in self.counts or len(self.counts) < self.k:
+            self._push(key, estimate)
+        elif estimate > self._min()[0]:
+            _, evicted = heapq.heappop(self._heap)
+            del self.counts[evicted]
+            self._push(key, estimate)
+
+    def _push(self, key: str, estimate: int) -> None:
+        self.counts[key] = estimate
+        heapq.heappush(self._heap, (estimate, key))
+        if len(self._heap) > 4 * self.k:
+            # entries of keys whose count has grown since are stale, drop them all at once
+            self._heap = [(count, key) for key, count in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _min(self) -> tuple[int, str]:
+        while self._heap[0][0] != self.counts.get(self._heap[0][1]):
+            heapq.heappop(self._heap)
+        return self._heap[0]
+
+
+class WindowedTopK:
+    """ Частые ключи за последние `windows` окон по `window` секунд """
+    def __init__(self, k: int = 50, window: float = 300, windows: int = 12, width: int = 2048, depth: int = 4):
+        self.k = k
+        self.window = window
+        self.windows = windows
+        self.width = width
+        self.depth = depth
+        self._buckets: list[tuple[int, HeavyHitters]] = []
+
+    def _current(self) -> HeavyHitters:
+        epoch = int(time.time() // self.window)
+        if not self._buckets or self._buckets[-1][0] != epoch:
+            self._buckets.append((epoch, HeavyHitters(k=self.k, width=self.width, depth=self.depth)))
+            self._buckets = [(e, b) for e, b in self._buckets if e > epoch - self.windows]
+        return self._buckets[-1][1]
+
+    def add(self, key: str, count: int = 1) -> None:
+        self._current().add(key, count)
+
+    def top(self, n: int | None = None) -> list[tuple[str, int]]:
+        self._current()
+        candidates = {key for _, bucket in self._buckets for key in bucket.counts}
+        counts = {key: sum(bucket.sketch.estimate(key) for _, bucket in self._buckets) for key in candidates}
+        return sorted(counts.items(), key=lambda item: item[1], reverse=True)[:n or self.k]
+
+
+class Analytics:
+    """ Частые поисковые запросы, рейсы и направления в ограниченной памяти """
+    dimensions = ('queries', 'flights', 'destinations')
+
+    def __init__(self, path: Path | None = None, k: int = 50, window: float = 300, windows: int = 12,
+                 interval: float = 300):
+        self.path = path
+        self.interval = interval
+        self.queries = WindowedTopK(k=k, window=window, windows=windows)
+        self.flights = WindowedTopK(k=k, window=window, windows=windows)
+        self.destinations = WindowedTopK(k=k, window=window, windows=windows)
+        self._task: asyncio.Task | None = None
+
+    def record_flight(self, flight_id: int) -> None:
+        self.flights.add(str(flight_id))
+
+    def record_destinations(self, destination: str | None) -> None:
+        for code in (destination or '').split(','):
+            if code:
+                self.destinations.add(code)
+
+    def top(self, n: int | None = None) -> dict[str, list[tuple[str, int]]]:
+        return {dimension: getattr(self, dimension).top(n) for dimension in self.dimensions}
+
+    def snapshot(self) -> dict:
+        return dict(created_at=time.time(), **self.top())
+
+    def restore(self, snapshot: dict) -> None:
+        """ Частоты из снимка попадают в текущее окно, так прогрев работает сразу после перезапуска """
+        for dimension in self.dimensions:
+            for key, count in snapshot.get(dimension, []):
+                getattr(self, dimension).add(key, count)
+
+    def save(self, snapshot: dict) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(snapshot, ensure_ascii=False))
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            self.restore(json.loads(self.path.read_text()))
+        except (ValueError, TypeError):
+            logger.warning(msg=f'Broken analytics snapshot {self.path}', exc_info=True)
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.load)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.save, self.snapshot())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                with metrics.timer('analytics.save'):
+                    # the snapshot is taken in the loop, so counters don't change while they are read
+                    await asyncio.to_thread(self.save, self.snapshot())
+            except Exception:
+                logger.exception(msg='Failed to save analytics snapshot')
+
+
+analytics = Analytics(
+    path=settings.ANALYTICS_PATH,
+    k=settings.ANALYTICS_TOP_K,
+    window=settings.ANALYTICS_WINDOW,
+    windows=settings.ANALYTICS_WINDOWS,
+    interval=settings.ANALYTICS_SNAPSHOT_INTERVAL,
+)
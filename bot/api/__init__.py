@@ -1,10 +1,13 @@
-from .api import SvologEndpoint, FlightEndpoint
+from .api import SvologEndpoint, FlightEndpoint, TruncatedResponse, flight_endpoint, is_unavailable
 from . import schemas, quieries
 
 
 __all__ = (
     SvologEndpoint,
     FlightEndpoint,
+    TruncatedResponse,
+    flight_endpoint,
+    is_unavailable,
     schemas,
     quieries,
 )
@@ -1,20 +1,41 @@
+import logging
 from abc import ABCMeta, abstractmethod
-from asyncio import to_thread
+from asyncio import Semaphore, gather, to_thread
+from collections import Counter
+from datetime import date, datetime
 from enum import StrEnum
 from functools import cached_property
-from typing import Sequence, Any
+from typing import Callable, ClassVar, Sequence, Any
 from urllib.parse import urljoin
 
-from requests import Session
+from requests import ConnectionError, HTTPError, Session, Timeout
 
 from . import schemas, quieries
+from ..settings import settings
 
 
+logger = logging.getLogger(__name__)
+
 class URL(StrEnum):
     BASE_URL = 'https://svolog.ru/api/v1/'
     FLIGHTS_URL = urljoin(BASE_URL, 'flights/')
 
 
+class TruncatedResponse(Exception):
+    """ Запрос отдает не все найденные рейсы """
+    def __init__(self, total: int, fetched: int):
+        super().__init__(f'{fetched} of {total} items fetched')
+        self.total = total
+        self.fetched = fetched
+
+
+def is_unavailable(error: BaseException) -> bool:
+    """ Ошибка означает, что API недоступен, а не что запрос неверный """
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+    return isinstance(error, HTTPError) and error.response is not None and error.response.status_code >= 500
+
+
 class SvologEndpoint(metaclass=ABCMeta):
     @abstractmethod
     def get_one_by_id(self, id: Any) -> schemas.BaseSchema:
@@ -28,20 +49,40 @@ class SvologEndpoint(metaclass=ABCMeta):
     def get_many_by_id(self, ids: list[Any]) -> list[schemas.BaseSchema]:
         ...
 
+    @abstractmethod
+    def count(self, query: quieries.BaseQuery) -> schemas.BaseSchema:
+        ...
+
 
 class FlightEndpoint:
+    # called with raw flight payloads of every response, e.g. to keep local indexes current
+    listeners: ClassVar[list[Callable[[list[dict]], None]]] = []
+
+    def __init__(self, timeout: float | None = None):
+        # without a timeout a hanging upstream blocks the worker thread and is never seen as unavailable
+        self.timeout = timeout
+
     @cached_property
     def session(self):
         return Session()
 
+    def _notify(self, items: list[dict]) -> None:
+        for listener in self.listeners:
+            try:
+                listener(items)
+            except Exception:
+                logger.exception(msg=f'Listener {listener} failed')
+
     async def get_one_by_id(self, id: str, **kw) -> schemas.FlightSchema:
         response = await to_thread(
             self.session.get,
-            urljoin(URL.FLIGHTS_URL, str(id))
+            urljoin(URL.FLIGHTS_URL, str(id)),
+            timeout=self.timeout,
         )
         response.raise_for_status()
 
         flight = await to_thread(response.json)
+        self._notify([flight])
         flight = schemas.FlightSchema.model_validate(flight)
         return flight
 
@@ -49,22 +90,89 @@ class FlightEndpoint:
         response = await to_thread(
             self.session.get,
             URL.FLIGHTS_URL,
-            params=query.model_dump(exclude_none=True)
+            params=query.model_dump(exclude_none=True),
+            timeout=self.timeout,
         )
         response.raise_for_status()
 
         data = await to_thread(response.json)
+        self._notify(data.get('items') or [])
         data = schemas.PagedFlightResponse.model_validate(data)
         return data
 
+    async def count(self, query: quieries.FlightsQuery, **kw) -> schemas.FlightCountResponse:
+        response = await to_thread(
+            self.session.get,
+            URL.FLIGHTS_URL,
+            params=query.model_copy(update=dict(page=0, limit=1)).model_dump(exclude_none=True),
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+        # only the total and the id are read, flight payloads are not validated
+        data = await to_thread(response.json)
+        items = data.get('items') or []
+        total = data.get('total') or 0
+        return schemas.FlightCountResponse(total=total, id=items[0]['id'] if total == 1 and items else None)
+
+    async def get_raw_items(self, query: quieries.FlightsQuery, max_pages: int = 10, concurrency: int = 4,
+                            strict: bool = False, **kw) -> list[dict]:
+        """ Рейсы со всех страниц запроса без разбора схемы.
+        Если страниц больше `max_pages` или рейсов меньше `total`, со `strict` поднимается TruncatedResponse,
+        иначе отдается то, что получено """
+        semaphore = Semaphore(concurrency)
+
+        async def fetch_page(page: int) -> dict:
+            async with semaphore:
+                response = await to_thread(
+                    self.session.get,
+                    URL.FLIGHTS_URL,
+                    params=query.model_copy(update=dict(page=page, limit=100)).model_dump(exclude_none=True),
+                    timeout=self.timeout,
+                )
+                response.raise_for_status()
+                return await to_thread(response.json)
+
+        # the first page tells how many pages there are, the rest are fetched at once
+        first = await fetch_page(0)
+        total, total_pages = first.get('total') or 0, first.get('total_pages') or 0
+        if strict and total_pages > max_pages:
+            # nothing more is fetched, the response wouldn't be used anyway
+            raise TruncatedResponse(total=total, fetched=max_pages * 100)
+        pages = [first, *await gather(*map(fetch_page, range(1, min(total_pages, max_pages))))]
+
+        items = [item for data in pages for item in data.get('items') or []]
+        self._notify(items)
+        # pages shift if flights are added or removed while they are fetched
+        if len({item.get('id') for item in items}) != total:
+            truncated = TruncatedResponse(total=total, fetched=len(items))
+            if strict:
+                raise truncated
+            logger.warning(msg=f'Truncated response for {query.model_dump(exclude_none=True)}: {truncated}')
+        return items
+
+    async def count_by_day(self, query: quieries.FlightsQuery, max_pages: int = 10, **kw) -> Counter[date]:
+        """ Число рейсов по дням в поясе `date_start`. Неполный подсчет не отдается, поднимается TruncatedResponse """
+        tz = query.date_start.tzinfo
+        return Counter(
+            datetime.fromisoformat(item['date']).astimezone(tz).date()
+            for item in await self.get_raw_items(query, max_pages=max_pages, strict=True)
+        )
+
     async def get_many_by_id(self, ids: Sequence) -> list[schemas.FlightSchema]:
         response = await to_thread(
             self.session.post,
             URL.FLIGHTS_URL,
             json=list(ids),
+            timeout=self.timeout,
         )
         response.raise_for_status()
 
         data = await to_thread(response.json)
+        self._notify(data)
         data = [schemas.FlightSchema.model_validate(flight) for flight in data]
         return data
+
+
+# one endpoint and so one http session for the services and the background jobs
+flight_endpoint = FlightEndpoint(timeout=settings.API_TIMEOUT)
@@ -1,6 +1,8 @@
+import hashlib
 from collections import defaultdict
 from datetime import datetime
 from enum import StrEnum
+from functools import cached_property
 from typing import Literal, Annotated, Any
 from zoneinfo import ZoneInfo
 
@@ -124,6 +126,8 @@ class FlightSchema(BaseSchema):
     gate_id_log: list[tuple[str | None, AwareDatetime]] = Field(default_factory=list)
     term_local_log: list[tuple[str | None, AwareDatetime]] = Field(default_factory=list)
     bbel_id_log: list[tuple[str | None, AwareDatetime]] = Field(default_factory=list)
+    # set when the flight is served from the offline snapshot
+    snapshot_at: AwareDatetime | None = Field(None, exclude=True)
 
     @property
     def local_mar(self) -> AirportSchema:
@@ -133,6 +137,20 @@ class FlightSchema(BaseSchema):
     def other_mar(self) -> AirportSchema:
         return getattr(self, 'mar1' if self.direction == 'arrival' else 'mar2')
 
+    @cached_property
+    def version(self) -> str:
+        """ Хэш содержимого рейса, меняется при любом изменении данных """
+        content = self.model_dump_json()
+        if self.snapshot_at is not None:
+            # a flight from the snapshot is rendered apart from the same flight fetched from the api
+            content += self.snapshot_at.isoformat()
+        return hashlib.blake2b(content.encode(), digest_size=8).hexdigest()
+
+    @property
+    def is_completed(self) -> bool:
+        """ Последний этап рейса пройден, данные больше не меняются """
+        return (self.bbel_end if self.direction == 'arrival' else self.at_other) is not None
+
     @property
     def is_delayed(self) -> bool:
         if self.direction == 'departure':
@@ -227,7 +245,20 @@ class PagedResponse(BaseSchema):
     total: int = 0
     page: int = 0
     total_pages: int = 0
+    snapshot_at: AwareDatetime | None = None
 
 
 class PagedFlightResponse(PagedResponse):
     items: list[FlightSchema] = Field(default_factory=list)
+
+
+class FlightCountResponse(BaseSchema):
+    """ Сводка поиска: число рейсов и id рейса, если он единственный """
+    total: int = 0
+    id: int | None = None
+    snapshot_at: AwareDatetime | None = None
+
+    @classmethod
+    def from_paged(cls, response: PagedFlightResponse) -> 'FlightCountResponse':
+        return cls(total=response.total, id=response.items[0].id if response.total == 1 and response.items else None,
+                   snapshot_at=response.snapshot_at)
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import logging
+import math
+import mmap
+import struct
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable
+
+from .api import FlightEndpoint, TruncatedResponse, flight_endpoint, schemas
+from .api.quieries import FlightsQuery
+from .constants import SVO_TIMEZONE
+from .metrics import metrics
+from .settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_completed(item: dict) -> bool:
+    """ То же, что `FlightSchema.is_completed`, но по сырым данным рейса """
+    return item.get('bbel_end' if item.get('direction') == 'arrival' else 'at_other') is not None
+
+
+def flight_day(item: dict) -> date:
+    return datetime.fromisoformat(item['date']).astimezone(SVO_TIMEZONE).date()
+
+
+@dataclass(frozen=True, slots=True)
+class Entry:
+    flight_id: int
+    offset: int
+    length: int
+    direction: str
+    sked: int
+    airport: str
+    company: str
+    number: str
+
+
+class Segment:
+    """ Файл рейсов одного дня: только дописывается и читается через mmap,
+    по заголовкам записей рейсы ищутся без распаковки """
+    directions = ('arrival', 'departure')
+    # flight id, payload length, direction, scheduled time, other airport, company, number
+    _header = struct.Struct('>QIBq3s2s5s')
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: dict[int, Entry] = {}
+        self._size = 0
+        self._mmap: mmap.mmap | None = None
+        if path.exists() and path.stat().st_size:
+            with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self._index(data, base=0)
+
+    def _index(self, data: bytes | mmap.mmap, base: int) -> int:
+        """ Добавляет в индекс записи `data`, которые лежат в файле начиная с `base` """
+        offset = count = 0
+        while offset + self._header.size <= len(data):
+            flight_id, length, direction, sked, airport, company, number = self._header.unpack_from(data, offset)
+            start = offset + self._header.size
+            if start + length > len(data):
+                # a record cut by a crash while it was written, the next append overwrites it
+                break
+            self.entries[flight_id] = Entry(
+                flight_id=flight_id,
+                offset=base + start,
+                length=length,
+                direction=self.directions[direction],
+                sked=sked,
+                airport=airport.rstrip(b'\x00').decode(),
+                company=company.rstrip(b'\x00').decode(),
+                number=number.rstrip(b'\x00').decode(),
+            )
+            offset = start + length
+            count += 1
+        self._size = base + offset
+        return count
+
+    def append(self, items: Iterable[dict]) -> int:
+        records = bytearray()
+        for item in items:
+            if item['id'] in self.entries:
+                continue
+            payload = zlib.compress(json.dumps(item, ensure_ascii=False).encode())
+            try:
+                other = item['mar1' if item['direction'] == 'arrival' else 'mar2']
+                sked = datetime.fromisoformat(item.get('sked_local') or item['date'])
+                header = self._header.pack(
+                    item['id'],
+                    len(payload),
+                    self.directions.index(item['direction']),
+                    int(sked.timestamp()),
+                    other['iata'].encode(),
+                    item['company']['iata'].encode(),
+                    item['number'].upper().lstrip('0').encode(),
+                )
+            except (KeyError, TypeError, ValueError, AttributeError, struct.error):
+                logger.warning(msg=f'Flight {item["id"]} is not archived, unexpected payload')
+                continue
+            records += header + payload
+        if not records:
+            return 0
+
+        with open(self.path, 'r+b' if self.path.exists() else 'wb') as file:
+            file.seek(self._size)
+            file.write(records)
+            file.truncate()
+        # entries are indexed only when their data is on disk
+        return self._index(records, base=self._size)
+
+    def read(self, entry: Entry) -> dict:
+        if self._mmap is None or len(self._mmap) < entry.offset + entry.length:
+            self.close()
+            with open(self.path, 'rb') as file:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return json.loads(zlib.decompress(self._mmap[entry.offset:entry.offset + entry.length]))
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class FlightArchive:
+    """ Завершенные рейсы прошедших дней: такие рейсы больше не меняются и отдаются без запросов к API.
+    День отдается для поиска целиком, только когда он запечатан, т.е. загружен полностью """
+    def __init__(self, path: Path | None, fetch_day: Callable[[date], Awaitable[list[dict]]] | None = None,
+                 listeners: list[Callable] | None = None, seal_after: int = 2, backfill: int = 7,
+                 interval: float = 60):
+        self.path = path
+        self.seal_after = seal_after
+        self.backfill = backfill
+        self.interval = interval
+        self.listeners = listeners if listeners is not None else []
+        self._fetch_day = fetch_day
+        self._segments: dict[date, Segment] = {}
+        self._sealed: set[date] = set()
+        self._days: dict[int, date] = {}
+        self._failures: Counter[date] = Counter()
+        self._pending: list[dict] = []
+        self._task: asyncio.Task | None = None
+
+    def load(self) -> None:
+        if self.path is None:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        for file in sorted(self.path.glob('*.seg')):
+            self._segment(date.fromisoformat(file.stem))
+        self._sealed = {date.fromisoformat(file.stem) for file in self.path.glob('*.sealed')}
+
+    def _segment(self, day: date) -> Segment:
+        if (segment := self._segments.get(day)) is None:
+            segment = self._segments[day] = Segment(self.path / f'{day.isoformat()}.seg')
+            self._days.update(dict.fromkeys(segment.entries, day))
+        return segment
+
+    def observe(self, items: Iterable[dict]) -> None:
+        """ Слушатель ответов API, завершенные рейсы записываются в архив при следующем сбросе """
+        self._pending.extend(item for item in items if is_completed(item) and item.get('id') not in self._days)
+
+    def write(self, items: Iterable[dict]) -> int:
+        by_day: dict[date, list[dict]] = {}
+        for item in items:
+            try:
+                by_day.setdefault(flight_day(item), []).append(item)
+            except (KeyError, TypeError, ValueError):
+                continue
+
+        written = 0
+        for day, day_items in by_day.items():
+            segment = self._segment(day)
+            written += segment.append(day_items)
+            self._days.update(dict.fromkeys(segment.entries, day))
+        return written
+
+    def take_pending(self) -> list[dict]:
+        items, self._pending = self._pending, []
+        return items
+
+    async def seal(self, day: date) -> bool:
+        """ Загружает день целиком, после этого поиск по нему идет только по архиву.
+        День, загруженный не полностью, не запечатывается """
+        try:
+            items = await self._fetch_day(day)
+        except TruncatedResponse as error:
+            logger.warning(msg=f'Day {day} is not sealed: {error}')
+            self._failures[day] += 1
+            return False
+        await asyncio.to_thread(self.write, items)
+        # flights with an unexpected payload are not written, a day without them is not complete
+        if missing := [item.get('id') for item in items if item.get('id') not in self._days]:
+            logger.warning(msg=f'Day {day} is not sealed: flights {missing} are not archived')
+            self._failures[day] += 1
+            return False
+        (self.path / f'{day.isoformat()}.sealed').touch()
+        self._sealed.add(day)
+        self._failures.pop(day, None)
+        metrics.incr('archive.sealed')
+        return True
+
+    def unsealed(self, today: date | None = None) -> list[date]:
+        today = today or datetime.now(tz=SVO_TIMEZONE).date()
+        last = today - timedelta(days=self.seal_after)
+        days = (last - timedelta(days=days) for days in range(self.backfill))
+        return [day for day in days if day not in self._sealed]
+
+    def get_one(self, flight_id: int | str) -> schemas.FlightSchema | None:
+        try:
+            flight_id = int(flight_id)
+        except (TypeError, ValueError):
+            return None
+        if (day := self._days.get(flight_id)) is None:
+            metrics.incr('archive.miss')
+            return None
+        segment = self._segments[day]
+        metrics.incr('archive.hit')
+        return schemas.FlightSchema.model_validate(segment.read(segment.entries[flight_id]))
+
+    def sealed_day(self, query: FlightsQuery) -> date | None:
+        """ День запроса, если запрос покрывает ровно один запечатанный день и его можно выполнить по архиву """
+        if query.gate_id is not None or query.term_local is not None:
+            return None
+        date_start = query.date_start.astimezone(SVO_TIMEZONE)
+        if date_start.time() != time() or query.date_end - query.date_start != timedelta(days=1):
+            return None
+        day = date_start.date()
+        return day if day in self._sealed else None
+
+    def _match(self, day: date, query: FlightsQuery) -> list[Entry]:
+        destinations = set(query.destination.upper().split(',')) if query.destination else None
+        companies = set(query.company.upper().split(',')) if query.company else None
+        number = query.number.upper().lstrip('0') if query.number else None
+        # a copy, the segment may be appended to by a flush in another thread
+        entries = [
+            entry for entry in list(self._segment(day).entries.values())
+            if (query.direction is None or entry.direction == query.direction)
+            and (destinations is None or entry.airport in destinations)
+            and (companies is None or entry.company in companies)
+            and (number is None or entry.number == number)
+        ]
+        return sorted(entries, key=lambda entry: (entry.sked, entry.flight_id), reverse=query.order == 'desc')
+
+    def count(self, query: FlightsQuery) -> schemas.FlightCountResponse | None:
+        if (day := self.sealed_day(query)) is None:
+            return None
+        entries = self._match(day, query)
+        metrics.incr('archive.search')
+        return schemas.FlightCountResponse(total=len(entries), id=entries[0].flight_id if len(entries) == 1 else None)
+
+    def get_many(self, query: FlightsQuery) -> schemas.PagedFlightResponse | None:
+        if (day := self.sealed_day(query)) is None:
+            return None
+        entries = self._match(day, query)
+        page = entries[query.page * query.limit:(query.page + 1) * query.limit]
+        segment = self._segments[day]
+        metrics.incr('archive.search')
+        # only the requested page is unpacked and validated
+        return schemas.PagedFlightResponse(
+            items=[schemas.FlightSchema.model_validate(segment.read(entry)) for entry in page],
+            count=len(page),
+            total=len(entries),
+            page=query.page,
+            total_pages=math.ceil(len(entries) / query.limit),
+        )
+
+    async def start(self) -> None:
+        if self.path is None:
+            return
+        await asyncio.to_thread(self.load)
+        self.listeners.append(self.observe)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.observe in self.listeners:
+            self.listeners.remove(self.observe)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await asyncio.to_thread(self.write, self.take_pending())
+        for segment in self._segments.values():
+            segment.close()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # pending flights are taken in the loop, the listener keeps appending to a new list
+                metrics.incr('archive.written', await asyncio.to_thread(self.write, self.take_pending()))
+                # one day per tick, so a backfill doesn't load the upstream at once
+                if self._fetch_day is not None and (days := self.unsealed()):
+                    # a day that can't be sealed doesn't hold back the others
+                    await self.seal(min(days, key=lambda day: self._failures[day]))
+            except Exception:
+                logger.exception(msg='Failed to update flight archive')
+
+
+async def fetch_day(day: date) -> list[dict]:
+    date_start = datetime.combine(day, time(), tzinfo=SVO_TIMEZONE)
+    query = FlightsQuery(date_start=date_start, date_end=date_start + timedelta(days=1))
+    return await flight_endpoint.get_raw_items(query=query, max_pages=settings.ARCHIVE_MAX_PAGES, strict=True)
+
+
+flight_archive = FlightArchive(
+    path=settings.ARCHIVE_PATH,
+    fetch_day=fetch_day,
+    listeners=FlightEndpoint.listeners,
+    seal_after=settings.ARCHIVE_SEAL_AFTER,
+    backfill=settings.ARCHIVE_BACKFILL,
+    interval=settings.ARCHIVE_INTERVAL,
+)
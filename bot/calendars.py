@@ -0,0 +1,82 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram_calendar import SimpleCalendar, SimpleCalendarCallback
+from aiogram_calendar.schemas import SimpleCalAct, superscript
+
+from .cache import LRUCache
+from .constants import SVO_TIMEZONE
+from .metrics import metrics
+from .settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class FlightCalendar(SimpleCalendar):
+    """ Календарь выбора даты с числом рейсов по дням для сохраненного запроса """
+    markups = LRUCache(maxsize=settings.CALENDAR_CACHE_SIZE, ttl=settings.CALENDAR_TTL)
+    # counts being fetched per markup key, shared by callbacks that ask for the same month
+    pending: dict[tuple, asyncio.Task] = {}
+
+    def __init__(self, key: str | None = None,
+                 count_by_month: Callable[[int, int], Awaitable[dict[int, int]]] | None = None,
+                 timeout: float = settings.CALENDAR_COUNTS_TIMEOUT):
+        super().__init__()
+        self.key = key
+        self.count_by_month = count_by_month
+        self.timeout = timeout
+
+    async def start_calendar(self, year: int | None = None, month: int | None = None) -> InlineKeyboardMarkup:
+        today = datetime.now(tz=SVO_TIMEZONE)
+        year, month = year or today.year, month or today.month
+        if self.key is None or self.count_by_month is None:
+            return await super().start_calendar(year=year, month=month)
+
+        # today is highlighted on the markup, so it is a part of the key as well
+        key = (self.key, year, month, today.date())
+        if (markup := self.markups.get(key)) is not None:
+            metrics.incr('calendar.hit')
+            return markup
+
+        metrics.incr('calendar.miss')
+        markup = await super().start_calendar(year=year, month=month)
+        if (task := self.pending.get(key)) is None:
+            task = self.pending[key] = asyncio.create_task(self._annotate(key, markup, year, month))
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        try:
+            # the callback waits briefly, slow counts are cached by the task for the next time
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout) or markup
+        except TimeoutError:
+            metrics.incr('calendar.late')
+            return markup
+
+    async def _annotate(self, key: tuple, markup: InlineKeyboardMarkup, year: int,
+                        month: int) -> InlineKeyboardMarkup | None:
+        try:
+            counts = await self.count_by_month(year, month)
+        except Exception:
+            # a plain calendar is shown and not cached, so the counts are tried again next time
+            logger.warning(msg=f'Failed to count flights for {year}-{month:02}', exc_info=True)
+            return None
+        markup = self.annotate(markup, counts)
+        self.markups.set(key, markup)
+        return markup
+
+    @staticmethod
+    def annotate(markup: InlineKeyboardMarkup, counts: dict[int, int]) -> InlineKeyboardMarkup:
+        rows = []
+        for row in markup.inline_keyboard:
+            buttons = []
+            for btn in row:
+                if btn.callback_data != SimpleCalendar.ignore_callback:
+                    data = SimpleCalendarCallback.unpack(btn.callback_data)
+                    if data.act == SimpleCalAct.day and (count := counts.get(data.day)):
+                        btn = InlineKeyboardButton(text=btn.text + superscript(str(count)),
+                                                   callback_data=btn.callback_data)
+                buttons.append(btn)
+            rows.append(buttons)
+        return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -1,6 +1,14 @@
 from enum import IntEnum, auto
 
-from aiogram.filters.callback_data import CallbackData
+from aiogram.filters.callback_data import CallbackData, MAX_CALLBACK_LENGTH
+
+
+class PaddedUnpackMixin:
+    @classmethod
+    def unpack(cls, value: str):
+        # buttons sent before a field was added carry fewer parts, missing ones get default values
+        missing = len(cls.model_fields) - value.count(cls.__separator__)
+        return super().unpack(value + cls.__separator__ * max(missing, 0))
 
 
 ################ Flight ################
@@ -10,12 +18,14 @@ class FlightAction(IntEnum):
     update = auto()
     toggle_favorite = auto()
     toggle_changelog = auto()
+    toggle_tracking = auto()
 
 
-class FlightCD(CallbackData, prefix='flight', sep='^'):
+class FlightCD(PaddedUnpackMixin, CallbackData, prefix='flight', sep='^'):
     id: int
     changelog: bool
     action: FlightAction
+    digest: str = ''
 
 
 ################ SearchFlight ################
@@ -25,5 +35,10 @@ class SearchFlightAction(IntEnum):
     pick_date = auto()
 
 
-class SearchFlightCD(CallbackData, prefix='search_flight', sep='^'):
+class SearchFlightCD(PaddedUnpackMixin, CallbackData, prefix='search_flight', sep='^'):
     action: SearchFlightAction
+    state: str = ''
+
+    @classmethod
+    def max_state_length(cls) -> int:
+        return MAX_CALLBACK_LENGTH - len(cls(action=max(SearchFlightAction)).pack())
@@ -19,16 +19,82 @@ class Settings(BaseSettings):
     )
     BOT_NAME: str
     BOT_TOKEN: SecretStr
-    DB_HOST: str
-    DB_PORT: int
-    DB_USERNAME: SecretStr
-    DB_PASSWORD: SecretStr
+    STORAGE_BACKEND: Literal['mongo', 'sqlite'] = 'mongo'
+    DB_HOST: str | None = None
+    DB_PORT: int | None = None
+    DB_USERNAME: SecretStr | None = None
+    DB_PASSWORD: SecretStr | None = None
+    SQLITE_PATH: Path = Path('data/svologbot.sqlite3')
     UPDATE_METHOD: Literal['long-polling', 'webhook'] = cmd_args.update_method
     WEBHOOK_SECRET: SecretStr | None = None
     WEBHOOK_ENDPOINT: str | None = None
     WEBHOOK_BASE: str | None = None
     WEB_SERVER_HOST: str | None = None
     WEB_SERVER_PORT: int | None = None
+    API_TIMEOUT: float = 10
+    SEARCH_QUERY_TTL: int = 60 * 60 * 24 * 7
+    SEARCH_QUERY_CACHE_SIZE: int = 10_000
+    SEARCH_COUNT_CACHE_SIZE: int = 2000
+    SEARCH_COUNT_TTL: float = 60
+    SEARCH_MAX_RANGE_DAYS: int = 14
+    SEARCH_RANGE_CONCURRENCY: int = 4
+    CALENDAR_CACHE_SIZE: int = 1000
+    CALENDAR_TTL: float = 300
+    CALENDAR_MAX_PAGES: int = 10
+    CALENDAR_COUNTS_TIMEOUT: float = 1
+    NUMBER_INDEX_PAST_DAYS: int = 1
+    NUMBER_INDEX_AHEAD_DAYS: int = 2
+    NUMBER_INDEX_SWEEP_INTERVAL: float = 600
+    NUMBER_INDEX_MAX_PAGES: int = 50
+    NUMBER_INDEX_NEAREST: int = 3
+    ARCHIVE_PATH: Path | None = Path('data/archive')
+    ARCHIVE_SEAL_AFTER: int = 2
+    ARCHIVE_BACKFILL: int = 7
+    ARCHIVE_INTERVAL: float = 60
+    ARCHIVE_MAX_PAGES: int = 30
+    FLIGHT_CACHE_SIZE: int = 5000
+    FLIGHT_CACHE_TTL: float = 30
+    SNAPSHOT_PATH: Path | None = Path('data/snapshot.bin')
+    SNAPSHOT_PAST_DAYS: int = 1
+    SNAPSHOT_AHEAD_DAYS: int = 2
+    SNAPSHOT_INTERVAL: float = 600
+    SNAPSHOT_RETRY: float = 30
+    SNAPSHOT_MAX_PAGES: int = 50
+    DELAYS_PATH: Path | None = Path('data/delays.npz')
+    DELAYS_HISTORY_DAYS: int = 365
+    DELAYS_ON_TIME_MINUTES: int = 15
+    DELAYS_MIN_COUNT: int = 5
+    DELAYS_INTERVAL: float = 300
+    WRITE_BEHIND_INTERVAL: float = 0.05
+    WRITE_BEHIND_BATCH: int = 100
+    HANDLER_TIMEOUT: float = 15
+    INLINE_CACHE_TIME: int = 5
+    INLINE_RENDER_CACHE_SIZE: int = 5000
+    RENDER_CACHE_SIZE: int = 5000
+    KEYBOARD_CACHE_SIZE: int = 5000
+    INLINE_DEBOUNCE: float = 0
+    UPDATE_CONCURRENCY: int = 32
+    UPDATE_QUEUE_SIZE: int = 256
+    ADMIN_IDS: list[int] = []
+    ANALYTICS_PATH: Path = Path('data/analytics.json')
+    ANALYTICS_TOP_K: int = 50
+    ANALYTICS_WINDOW: float = 300
+    ANALYTICS_WINDOWS: int = 12
+    ANALYTICS_SNAPSHOT_INTERVAL: float = 300
+    WARM_TOP_K: int = 50
+    WARM_TTL: float = 60
+    WARM_INTERVAL: float = 30
+    WARM_BUDGET: int = 20
+    WARM_CONCURRENCY: int = 4
+    PREFETCH_TTL: float = 30
+    PREFETCH_CONCURRENCY: int = 2
+    TRACKING_TICK: float = 15
+    TRACKING_BATCH_SIZE: int = 50
+    OUTBOUND_RATE: float = 30
+    OUTBOUND_CHAT_RATE: float = 1
+    OUTBOUND_GROUP_RATE: float = 20 / 60
+    OUTBOUND_CHAT_BURST: float = 3
+    OUTBOUND_RESERVE: float = 10
 
     @computed_field
     @property
@@ -48,3 +114,16 @@ class Settings(BaseSettings):
             if mandatory_unset:
                 raise ValueError(f'If `UPDATE_METHOD` is `webhook` then {", ".join(mandatory_unset)} must be set')
         return self
+
+    @model_validator(mode='after')
+    def check_db_variables(self) -> 'Settings':
+        if self.STORAGE_BACKEND == 'mongo':
+            mandatory_unset = list(filter(lambda x: getattr(self, x) is None, [
+                'DB_HOST',
+                'DB_PORT',
+                'DB_USERNAME',
+                'DB_PASSWORD',
+            ]))
+            if mandatory_unset:
+                raise ValueError(f'If `STORAGE_BACKEND` is `mongo` then {", ".join(mandatory_unset)} must be set')
+        return self
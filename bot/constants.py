@@ -30,6 +30,8 @@ class EMOJI(StrEnum):
     arrow_right = emoji.emojize(':arrow_right:', language='alias')
     red_heart = emoji.emojize(':heart:', language='alias')
     white_heart = emoji.emojize(':white_heart:', language='alias')
+    bell = emoji.emojize(':bell:', language='alias')
+    no_bell = emoji.emojize(':no_bell:', language='alias')
 
 
 class INLINE_PLANE_IMAGE(StrEnum):
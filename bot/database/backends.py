@@ -0,0 +1,61 @@
+from functools import cache
+from typing import Literal
+
+from .base import BaseSearchQueryStorage, BaseFavoriteStorage, BaseSubscriptionStorage
+from ..settings import settings
+
+
+@cache
+def sqlite_database():
+    from .sqlite import SqliteDatabase
+
+    return SqliteDatabase(path=settings.SQLITE_PATH)
+
+
+def search_query_storage(query_type: Literal['flight']) -> BaseSearchQueryStorage:
+    if settings.STORAGE_BACKEND == 'sqlite':
+        from .sqlite import SqliteSearchQueryStorage
+
+        return SqliteSearchQueryStorage(query_type=query_type, database=sqlite_database())
+
+    from .storage import SearchQueryStorage
+
+    return SearchQueryStorage(query_type=query_type)
+
+
+def favorite_storage(favorite_type: Literal['flight']) -> BaseFavoriteStorage:
+    if settings.STORAGE_BACKEND == 'sqlite':
+        from .sqlite import SqliteFavoriteStorage
+
+        return SqliteFavoriteStorage(favorite_type=favorite_type, database=sqlite_database())
+
+    from .storage import FavoriteStorage
+
+    return FavoriteStorage(favorite_type=favorite_type)
+
+
+def subscription_storage(subscription_type: Literal['flight']) -> BaseSubscriptionStorage:
+    if settings.STORAGE_BACKEND == 'sqlite':
+        from .sqlite import SqliteSubscriptionStorage
+
+        return SqliteSubscriptionStorage(subscription_type=subscription_type, database=sqlite_database())
+
+    from .storage import SubscriptionStorage
+
+    return SubscriptionStorage(subscription_type=subscription_type)
+
+
+async def bootstrap() -> None:
+    if settings.STORAGE_BACKEND == 'sqlite':
+        await sqlite_database().run(lambda connection: None)  # connecting creates the schema
+        return
+
+    from .db import get_db
+    from .storage import registry  # migrations of mongo collections are registered along with their storages
+
+    await registry.apply(get_db())
+
+
+async def close() -> None:
+    if settings.STORAGE_BACKEND == 'sqlite':
+        await sqlite_database().close()
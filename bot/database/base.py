@@ -0,0 +1,96 @@
+from abc import ABCMeta, abstractmethod
+from datetime import datetime, timezone
+from typing import Literal
+
+from .write_behind import WriteBehindQueue
+from ..cache import LRUCache
+from ..settings import settings
+
+
+class BaseSearchQueryStorage(metaclass=ABCMeta):
+    name = 'search_queries'
+
+    def __init__(self, query_type: Literal['flight']):
+        self._query_type = query_type
+        self._cache = LRUCache(maxsize=settings.SEARCH_QUERY_CACHE_SIZE, ttl=settings.SEARCH_QUERY_TTL)
+        self._writes = WriteBehindQueue(
+            name=f'{self.name}.write_behind',
+            flush=self.upsert_many,
+            interval=settings.WRITE_BEHIND_INTERVAL,
+            max_batch=settings.WRITE_BEHIND_BATCH,
+        )
+
+    @abstractmethod
+    async def find_one(self, chat_id: int, message_id: int) -> dict | None:
+        ...
+
+    @abstractmethod
+    async def upsert_many(self, updates: list[tuple[tuple[int, int], dict]]) -> None:
+        ...
+
+    async def get_one(self, chat_id: int, message_id: int) -> dict | None:
+        key = (chat_id, message_id)
+        if (query_data := self._cache.get(key) or self._writes.get(key)) is not None:
+            return dict(query_data)
+
+        query_data = await self.find_one(chat_id=chat_id, message_id=message_id)
+        if query_data is not None:
+            self._cache.set(key, query_data)
+            query_data = dict(query_data)
+
+        return query_data
+
+    async def upsert_one(self, chat_id: int, message_id: int, update: dict) -> None:
+        key = (chat_id, message_id)
+        update = update | {'_updated_at': datetime.now(tz=timezone.utc)}
+        self._cache.set(key, update)
+        self._writes.put(key, update)
+
+    async def close(self) -> None:
+        await self._writes.close()
+
+
+class BaseFavoriteStorage(metaclass=ABCMeta):
+    def __init__(self, favorite_type: Literal['flight']):
+        self._favorite_type = favorite_type
+
+    @abstractmethod
+    async def add_favorite_one(self, user_id: int, favorite_id: int, favorite_obj: dict) -> None:
+        ...
+
+    @abstractmethod
+    async def remove_favorite_one(self, user_id: int, favorite_id: int) -> None:
+        ...
+
+    @abstractmethod
+    async def get_favorites_all(self, user_id: int) -> dict:
+        ...
+
+    @abstractmethod
+    async def is_favorite(self, user_id: int, favorite_id: int) -> bool:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class BaseSubscriptionStorage(metaclass=ABCMeta):
+    name = 'subscriptions'
+
+    def __init__(self, subscription_type: Literal['flight']):
+        self._subscription_type = subscription_type
+
+    @abstractmethod
+    async def add_one(self, chat_id: int, message_id: int, subscription: dict) -> None:
+        ...
+
+    @abstractmethod
+    async def remove_one(self, chat_id: int, message_id: int) -> None:
+        ...
+
+    @abstractmethod
+    async def get_all(self) -> list[dict]:
+        ...
+
+    async def close(self) -> None:
+        pass
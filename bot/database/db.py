@@ -1,16 +1,24 @@
+from functools import cache
+
 from pymongo import MongoClient
+from pymongo.database import Database
 
 from ..settings import settings
 
 
-client = MongoClient(
-    settings.DB_HOST,
-    settings.DB_PORT,
-    tz_aware=True,
-    username=settings.DB_USERNAME.get_secret_value(),
-    password=settings.DB_PASSWORD.get_secret_value(),
-    authSource='admin',
-    authMechanism='SCRAM-SHA-1',
-)
+@cache
+def get_client() -> MongoClient:
+    # the client is created on first use, so importing storages doesn't need a database
+    return MongoClient(
+        settings.DB_HOST,
+        settings.DB_PORT,
+        tz_aware=True,
+        username=settings.DB_USERNAME.get_secret_value(),
+        password=settings.DB_PASSWORD.get_secret_value(),
+        authSource='admin',
+        authMechanism='SCRAM-SHA-1',
+    )
+
 
-db = client.svologbot
+def get_db() -> Database:
+    return get_client().svologbot
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from asyncio import to_thread
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable
+
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Migration:
+    collection: str
+    version: int
+    apply: Callable[[Collection], None]
+
+    @property
+    def name(self) -> str:
+        return f'{self.collection} v{self.version} ({self.apply.__name__})'
+
+
+class MigrationRegistry:
+    """ Индексы и миграции коллекций, применяются при запуске бота """
+    marker_collection = 'migrations'
+
+    def __init__(self):
+        self._migrations: defaultdict[str, dict[int, Migration]] = defaultdict(dict)
+
+    def register(self, collection: str, version: int) -> Callable[[Callable], Callable]:
+        def decorator(apply: Callable[[Collection], None]) -> Callable[[Collection], None]:
+            if version in self._migrations[collection]:
+                raise ValueError(f'Migration {collection} v{version} is already registered')
+            self._migrations[collection][version] = Migration(collection=collection, version=version, apply=apply)
+            return apply
+
+        return decorator
+
+    async def apply(self, db: Database) -> None:
+        # collections don't depend on each other, so they are migrated concurrently
+        await asyncio.gather(*(
+            self._apply_collection(db, collection, migrations)
+            for collection, migrations in self._migrations.items()
+        ))
+
+    async def _apply_collection(self, db: Database, collection: str, migrations: dict[int, Migration]) -> None:
+        markers = db[self.marker_collection]
+        marker = await to_thread(markers.find_one, {'_id': collection})
+        current_version = (marker or {}).get('version', 0)
+
+        for version in sorted(migrations):
+            if version <= current_version:
+                continue
+
+            migration = migrations[version]
+            logger.info(msg=f'Applying migration {migration.name}')
+            await to_thread(migration.apply, db[collection])
+            await to_thread(
+                markers.update_one,
+                {'_id': collection},
+                {'$set': {'version': version, 'applied_at': datetime.now(tz=timezone.utc)}},
+                upsert=True,
+            )
+
+
+registry = MigrationRegistry()
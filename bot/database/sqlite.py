@@ -0,0 +1,176 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable
+
+from .base import BaseSearchQueryStorage, BaseFavoriteStorage, BaseSubscriptionStorage
+from ..settings import settings
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS search_queries (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    query_type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, message_id, query_type)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS search_queries_updated_at ON search_queries (updated_at);
+
+CREATE TABLE IF NOT EXISTS favorites (
+    user_id INTEGER NOT NULL,
+    favorite_type TEXT NOT NULL,
+    favorite_id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (user_id, favorite_type, favorite_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS subscriptions (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    subscription_type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, message_id, subscription_type)
+) WITHOUT ROWID;
+'''
+
+
+def _dumps(obj: dict) -> str:
+    return json.dumps(obj, default=lambda o: o.isoformat() if isinstance(o, datetime) else str(o))
+
+
+class SqliteDatabase:
+    """ Встроенная база: одно соединение в режиме WAL, запросы выполняются в отдельном потоке """
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._connection: sqlite3.Connection | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # statements below are constant, so sqlite keeps them prepared in the statement cache
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                         cached_statements=128)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _call(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        return func(self._connect())
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, partial(func, *args))
+
+    async def execute(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        return await self.run(lambda connection: connection.execute(sql, parameters).fetchall())
+
+    async def execute_many(self, *statements: tuple[str, list[tuple]]) -> None:
+        def transaction(connection: sqlite3.Connection) -> None:
+            with connection:
+                connection.execute('BEGIN')
+                for sql, seq_of_parameters in statements:
+                    connection.executemany(sql, seq_of_parameters)
+
+        await self.run(transaction)
+
+    async def close(self) -> None:
+        def close(connection: sqlite3.Connection) -> None:
+            connection.close()
+            self._connection = None
+
+        if self._connection is not None:
+            await self.run(close)
+
+
+class SqliteSearchQueryStorage(BaseSearchQueryStorage):
+    SELECT = 'SELECT data FROM search_queries WHERE chat_id = ? AND message_id = ? AND query_type = ? AND updated_at >= ?'
+    UPSERT = ('INSERT INTO search_queries (chat_id, message_id, query_type, data, updated_at) VALUES (?, ?, ?, ?, ?) '
+              'ON CONFLICT (chat_id, message_id, query_type) DO UPDATE SET data = excluded.data, '
+              'updated_at = excluded.updated_at')
+    DELETE_EXPIRED = 'DELETE FROM search_queries WHERE updated_at < ?'
+
+    def __init__(self, query_type, database: SqliteDatabase):
+        super().__init__(query_type=query_type)
+        self.database = database
+
+    async def find_one(self, chat_id: int, message_id: int) -> dict | None:
+        rows = await self.database.execute(
+            self.SELECT,
+            (chat_id, message_id, self._query_type, time.time() - settings.SEARCH_QUERY_TTL),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    async def upsert_many(self, updates: list[tuple[tuple[int, int], dict]]) -> None:
+        rows = [
+            (chat_id, message_id, self._query_type, _dumps(update), update['_updated_at'].timestamp())
+            for (chat_id, message_id), update in updates
+        ]
+        await self.database.execute_many(
+            (self.UPSERT, rows),
+            (self.DELETE_EXPIRED, [(time.time() - settings.SEARCH_QUERY_TTL,)]),
+        )
+
+
+class SqliteFavoriteStorage(BaseFavoriteStorage):
+    INSERT = ('INSERT OR IGNORE INTO favorites (user_id, favorite_type, favorite_id, data, created_at) '
+              'VALUES (?, ?, ?, ?, ?)')
+    DELETE = 'DELETE FROM favorites WHERE user_id = ? AND favorite_type = ? AND favorite_id = ?'
+    SELECT_ALL = 'SELECT favorite_id, data FROM favorites WHERE user_id = ? AND favorite_type = ? ORDER BY created_at'
+    SELECT_ONE = 'SELECT 1 FROM favorites WHERE user_id = ? AND favorite_type = ? AND favorite_id = ?'
+
+    def __init__(self, favorite_type, database: SqliteDatabase):
+        super().__init__(favorite_type=favorite_type)
+        self.database = database
+
+    async def add_favorite_one(self, user_id: int, favorite_id: int, favorite_obj: dict) -> None:
+        await self.database.execute(
+            self.INSERT,
+            (user_id, self._favorite_type, int(favorite_id), _dumps(favorite_obj), time.time()),
+        )
+
+    async def remove_favorite_one(self, user_id: int, favorite_id: int) -> None:
+        await self.database.execute(self.DELETE, (user_id, self._favorite_type, int(favorite_id)))
+
+    async def get_favorites_all(self, user_id: int) -> dict:
+        rows = await self.database.execute(self.SELECT_ALL, (user_id, self._favorite_type))
+        return {str(favorite_id): json.loads(data) for favorite_id, data in rows}
+
+    async def is_favorite(self, user_id: int, favorite_id: int) -> bool:
+        rows = await self.database.execute(self.SELECT_ONE, (user_id, self._favorite_type, int(favorite_id)))
+        return bool(rows)
+
+
+class SqliteSubscriptionStorage(BaseSubscriptionStorage):
+    UPSERT = ('INSERT INTO subscriptions (chat_id, message_id, subscription_type, data, created_at) '
+              'VALUES (?, ?, ?, ?, ?) ON CONFLICT (chat_id, message_id, subscription_type) DO UPDATE SET data = excluded.data')
+    DELETE = 'DELETE FROM subscriptions WHERE chat_id = ? AND message_id = ? AND subscription_type = ?'
+    SELECT_ALL = 'SELECT data FROM subscriptions WHERE subscription_type = ? ORDER BY created_at'
+
+    def __init__(self, subscription_type, database: SqliteDatabase):
+        super().__init__(subscription_type=subscription_type)
+        self.database = database
+
+    async def add_one(self, chat_id: int, message_id: int, subscription: dict) -> None:
+        await self.database.execute(
+            self.UPSERT,
+            (chat_id, message_id, self._subscription_type, _dumps(subscription), time.time()),
+        )
+
+    async def remove_one(self, chat_id: int, message_id: int) -> None:
+        await self.database.execute(self.DELETE, (chat_id, message_id, self._subscription_type))
+
+    async def get_all(self) -> list[dict]:
+        rows = await self.database.execute(self.SELECT_ALL, (self._subscription_type,))
+        return [json.loads(data) for data, in rows]
@@ -1,21 +1,56 @@
 from asyncio import to_thread
 from datetime import datetime, timezone
-from typing import Literal
 
 import pymongo
+from pymongo.collection import Collection
 
-from .db import db
+from .base import BaseSearchQueryStorage, BaseFavoriteStorage, BaseSubscriptionStorage
+from .db import get_db
+from .migrations import registry
+from ..settings import settings
 
 
-class SearchQueryStorage:
-    collection = db.search_queries
+@registry.register('search_queries', version=1)
+def create_message_index(collection: Collection) -> None:
+    collection.create_index(
+        [('chat_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)],
+        unique=True,
+        partialFilterExpression={'chat_id': {'$exists': True}},  # legacy documents are keyed by `message_id` only
+    )
 
-    def __init__(self, query_type: Literal['flight']):
-        self._query_type = query_type
 
-    async def get_one(self, message_id: int) -> dict | None:
+@registry.register('search_queries', version=2)
+def create_ttl_index(collection: Collection) -> None:
+    collection.create_index([('_updated_at', pymongo.ASCENDING)], expireAfterSeconds=settings.SEARCH_QUERY_TTL)
+
+
+@registry.register('search_queries', version=3)
+def remove_legacy_queries(collection: Collection) -> None:
+    # queries stored by `message_id` only are never read and have no field to expire by
+    collection.delete_many({'chat_id': {'$exists': False}})
+
+
+@registry.register('favorites', version=1)
+def create_user_index(collection: Collection) -> None:
+    collection.create_index([('user_id', pymongo.ASCENDING)], unique=True)
+
+
+@registry.register('subscriptions', version=1)
+def create_subscription_index(collection: Collection) -> None:
+    collection.create_index(
+        [('type', pymongo.ASCENDING), ('chat_id', pymongo.ASCENDING), ('message_id', pymongo.ASCENDING)],
+        unique=True,
+    )
+
+
+class SearchQueryStorage(BaseSearchQueryStorage):
+    @property
+    def collection(self) -> Collection:
+        return get_db()[self.name]
+
+    async def find_one(self, chat_id: int, message_id: int) -> dict | None:
         projection = {self._query_type: 1}
-        filter = {'message_id': message_id}
+        filter = {'chat_id': chat_id, 'message_id': message_id}
 
         query_data = await to_thread(
             self.collection.find_one,
@@ -27,24 +62,27 @@ class SearchQueryStorage:
 
         return query_data
 
-    async def upsert_one(self, message_id: int, update: dict) -> None:
-        filter = {f'message_id': message_id}
-        query = {'$set': {self._query_type: update | {'_updated_at': datetime.now(tz=timezone.utc)}}}
+    async def upsert_many(self, updates: list[tuple[tuple[int, int], dict]]) -> None:
+        requests = [
+            pymongo.UpdateOne(
+                {'chat_id': chat_id, 'message_id': message_id},
+                {'$set': {self._query_type: update, '_updated_at': update['_updated_at']}},
+                upsert=True,
+            )
+            for (chat_id, message_id), update in updates
+        ]
 
         await to_thread(
-            self.collection.update_one,
-            filter,
-            query,
-            upsert=True,
+            self.collection.bulk_write,
+            requests,
+            ordered=False,
         )
 
 
-class FavoriteStorage:
-    collection = db.favorites
-    collection.create_index([('user_id', pymongo.ASCENDING)], unique=True)
-
-    def __init__(self, favorite_type: Literal['flight']):
-        self._favorite_type = favorite_type
+class FavoriteStorage(BaseFavoriteStorage):
+    @property
+    def collection(self) -> Collection:
+        return get_db().favorites
 
     async def add_favorite_one(self, user_id: int, favorite_id: int, favorite_obj: dict) -> None:
         field = f'{self._favorite_type}.{favorite_id}'
@@ -99,3 +137,38 @@ class FavoriteStorage:
             projection,
         )
         return bool(favorite)
+
+
+
+class SubscriptionStorage(BaseSubscriptionStorage):
+    @property
+    def collection(self) -> Collection:
+        return get_db()[self.name]
+
+    async def add_one(self, chat_id: int, message_id: int, subscription: dict) -> None:
+        filter = {'type': self._subscription_type, 'chat_id': chat_id, 'message_id': message_id}
+        query = {'$set': {'data': subscription}, '$setOnInsert': {'_created_at': datetime.now(tz=timezone.utc)}}
+
+        await to_thread(
+            self.collection.update_one,
+            filter,
+            query,
+            upsert=True,
+        )
+
+    async def remove_one(self, chat_id: int, message_id: int) -> None:
+        filter = {'type': self._subscription_type, 'chat_id': chat_id, 'message_id': message_id}
+
+        await to_thread(
+            self.collection.delete_one,
+            filter,
+        )
+
+    async def get_all(self) -> list[dict]:
+        filter = {'type': self._subscription_type}
+        projection = {'data': 1}
+
+        subscriptions = await to_thread(
+            lambda: list(self.collection.find(filter, projection).sort('_created_at', pymongo.ASCENDING))
+        )
+        return [subscription['data'] for subscription in subscriptions]
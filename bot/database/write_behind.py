@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from itertools import islice
+from typing import Any, Awaitable, Callable, Hashable
+
+from ..metrics import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """ Копит записи и сбрасывает их пачками, повторные записи по одному ключу схлопываются """
+    def __init__(self, name: str, flush: Callable[[list[tuple[Hashable, Any]]], Awaitable[None]],
+                 interval: float = 0.05, max_batch: int = 100):
+        self.name = name
+        self.interval = interval
+        self.max_batch = max_batch
+        self._flush = flush
+        self._pending: dict[Hashable, Any] = {}
+        self._has_items = asyncio.Event()
+        self._is_full = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return self._pending.get(key, default)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if key in self._pending:
+            metrics.incr(f'{self.name}.coalesced')
+        self._pending[key] = value
+        metrics.gauge(f'{self.name}.depth', len(self._pending))
+
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch:
+            self._is_full.set()
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            while self._pending:
+                batch = list(islice(self._pending.items(), self.max_batch))
+                for key, _ in batch:
+                    del self._pending[key]
+                metrics.gauge(f'{self.name}.depth', len(self._pending))
+
+                start = time.perf_counter()
+                try:
+                    await self._flush(batch)
+                except asyncio.CancelledError:
+                    # the batch is already out of `_pending`, it is put back for the final drain
+                    self._requeue(batch)
+                    raise
+                except Exception:
+                    logger.exception(msg=f'Failed to flush {len(batch)} writes of `{self.name}`')
+                    self._requeue(batch)
+                    break
+                finally:
+                    metrics.observe(f'{self.name}.flush_latency', time.perf_counter() - start)
+                metrics.incr(f'{self.name}.flushed', len(batch))
+
+            if not self._pending:
+                self._has_items.clear()
+                self._is_full.clear()
+
+    def _requeue(self, batch: list[tuple[Hashable, Any]]) -> None:
+        for key, value in batch:
+            # newer writes of the same key are already pending
+            self._pending.setdefault(key, value)
+        metrics.gauge(f'{self.name}.depth', len(self._pending))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            # the task is stopped between flushes, a running flush is awaited instead of being cancelled
+            async with self._flush_lock:
+                self._task.cancel()
+                await asyncio.gather(self._task, return_exceptions=True)
+                self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_items.wait()
+            try:
+                await asyncio.wait_for(self._is_full.wait(), timeout=self.interval)
+            except TimeoutError:
+                pass
+            await self.flush()
+            if self._pending:
+                # the last flush failed, back off before retrying
+                await asyncio.sleep(self.interval)
@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable
+
+import numpy as np
+
+from .api import FlightEndpoint
+from .archive import is_completed
+from .cache import LRUCache
+from .metrics import metrics
+from .settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class DelaySummary:
+    count: int
+    median: float
+    p90: float
+    on_time: float
+
+
+class DelayStats:
+    """ История завершенных рейсов в колонках numpy: задержка в минутах и коды номера, авиакомпании и аэропорта.
+    Распределения задержек считаются векторно по маскам колонок """
+    directions = ('arrival', 'departure')
+    categories = ('number', 'company', 'airport')
+
+    def __init__(self, path: Path | None = None, listeners: list[Callable] | None = None, history: int = 365,
+                 on_time: int = 15, interval: float = 300, cache_size: int = 1000):
+        self.path = path
+        self.history = history
+        self.on_time = on_time
+        self.interval = interval
+        self.listeners = listeners if listeners is not None else []
+        self.ids = np.empty(0, dtype=np.int64)
+        self.sked = np.empty(0, dtype=np.int64)
+        self.delay = np.empty(0, dtype=np.int32)
+        self.direction = np.empty(0, dtype=np.int8)
+        self.codes = {category: np.empty(0, dtype=np.int32) for category in self.categories}
+        # category value -> code, codes index the value lists
+        self._codes: dict[str, dict[str, int]] = {category: {} for category in self.categories}
+        self._values: dict[str, list[str]] = {category: [] for category in self.categories}
+        self._seen: set[int] = set()
+        self._pending: list[tuple[int, int, int, int, int, int, int]] = []
+        self._summaries = LRUCache(maxsize=cache_size)
+        # bumped whenever the columns change, e.g. to invalidate texts rendered from the summaries
+        self.generation = 0
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def normalize(number: str) -> str:
+        return number.upper().lstrip('0')
+
+    def _code(self, category: str, value: str) -> int:
+        if (code := self._codes[category].get(value)) is None:
+            code = self._codes[category][value] = len(self._values[category])
+            self._values[category].append(value)
+        return code
+
+    def observe(self, items: Iterable[dict]) -> None:
+        """ Слушатель ответов API, завершенные рейсы попадают в колонки при следующем уплотнении """
+        for item in items:
+            if item.get('id') in self._seen or not is_completed(item):
+                continue
+            try:
+                sked = datetime.fromisoformat(item['sked_local'])
+                actual = datetime.fromisoformat(item['at_local'])
+                row = (
+                    item['id'],
+                    int(sked.timestamp()),
+                    round((actual - sked).total_seconds() / 60),
+                    self.directions.index(item['direction']),
+                    self._code('number', self.normalize(item['number'])),
+                    self._code('company', item['company']['iata']),
+                    self._code('airport', item['mar1' if item['direction'] == 'arrival' else 'mar2']['iata']),
+                )
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+            self._seen.add(item['id'])
+            self._pending.append(row)
+
+    def compact(self, now: float | None = None) -> int:
+        """ Переносит накопленные рейсы в колонки и отбрасывает рейсы старше `history` дней """
+        rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        ids, sked, delay, direction, *codes = (np.array(column) for column in zip(*rows))
+        # new arrays instead of in place updates, so a snapshot being saved in a thread stays consistent
+        self.ids = np.concatenate((self.ids, ids.astype(np.int64)))
+        self.sked = np.concatenate((self.sked, sked.astype(np.int64)))
+        self.delay = np.concatenate((self.delay, delay.astype(np.int32)))
+        self.direction = np.concatenate((self.direction, direction.astype(np.int8)))
+        self.codes = {
+            category: np.concatenate((self.codes[category], column.astype(np.int32)))
+            for category, column in zip(self.categories, codes)
+        }
+        self.prune(now)
+        self._summaries.clear()
+        self.generation += 1
+        return len(rows)
+
+    def prune(self, now: float | None = None) -> None:
+        keep = self.sked >= (now or time.time()) - self.history * 86400
+        if keep.all():
+            return
+        self.ids = self.ids[keep]
+        self.sked = self.sked[keep]
+        self.delay = self.delay[keep]
+        self.direction = self.direction[keep]
+        self.codes = {category: column[keep] for category, column in self.codes.items()}
+        self._seen = set(self.ids.tolist())
+
+    def _mask(self, number: str | None = None, company: str | None = None, airport: str | None = None,
+              direction: str | None = None, since: datetime | None = None) -> np.ndarray | None:
+        mask = np.ones(len(self), dtype=bool)
+        for category, value in zip(self.categories, (number and self.normalize(number), company, airport)):
+            if value is None:
+                continue
+            if (code := self._codes[category].get(value.upper())) is None:
+                return None
+            mask &= self.codes[category] == code
+        if direction is not None:
+            mask &= self.direction == self.directions.index(direction)
+        if since is not None:
+            mask &= self.sked >= int(since.timestamp())
+        return mask
+
+    def summary(self, number: str | None = None, company: str | None = None, airport: str | None = None,
+                direction: str | None = None, since: datetime | None = None) -> DelaySummary | None:
+        key = (number, company, airport, direction, since)
+        if key in self._summaries:
+            return self._summaries.get(key)
+
+        summary = None
+        if (mask := self._mask(number, company, airport, direction, since)) is not None:
+            delays = self.delay[mask]
+            if len(delays):
+                median, p90 = np.percentile(delays, (50, 90))
+                summary = DelaySummary(
+                    count=len(delays),
+                    median=float(median),
+                    p90=float(p90),
+                    on_time=np.count_nonzero(delays <= self.on_time) / len(delays),
+                )
+        self._summaries.set(key, summary)
+        return summary
+
+    def rank(self, category: str = 'company', min_count: int = 1, n: int = 10,
+             **filters) -> list[tuple[str, int, float, float]]:
+        """ Значения категории с числом рейсов, долей рейсов вовремя и средней задержкой, самые частые первыми """
+        if (mask := self._mask(**filters)) is None:
+            return []
+        codes = self.codes[category][mask]
+        delays = self.delay[mask]
+        size = len(self._values[category])
+        counts = np.bincount(codes, minlength=size)
+        on_time = np.bincount(codes, weights=delays <= self.on_time, minlength=size)
+        total = np.bincount(codes, weights=delays, minlength=size)
+        found = np.flatnonzero(counts >= max(min_count, 1))
+        found = found[np.argsort(-counts[found], kind='stable')][:n]
+        return [
+            (self._values[category][code], int(counts[code]), on_time[code] / counts[code], total[code] / counts[code])
+            for code in found.tolist()
+        ]
+
+    def snapshot(self) -> dict[str, np.ndarray]:
+        return dict(
+            ids=self.ids,
+            sked=self.sked,
+            delay=self.delay,
+            direction=self.direction,
+            **{f'{category}_codes': column for category, column in self.codes.items()},
+            **{f'{category}_values': np.array(self._values[category], dtype=str) for category in self.categories},
+        )
+
+    def save(self, snapshot: dict[str, np.ndarray]) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, **snapshot)
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                self.ids, self.sked = data['ids'], data['sked']
+                self.delay, self.direction = data['delay'], data['direction']
+                self.codes = {category: data[f'{category}_codes'] for category in self.categories}
+                self._values = {category: data[f'{category}_values'].tolist() for category in self.categories}
+        except (OSError, ValueError, KeyError):
+            logger.warning(msg=f'Broken delay statistics {self.path}', exc_info=True)
+            return
+        self._codes = {category: {value: code for code, value in enumerate(values)}
+                       for category, values in self._values.items()}
+        self._seen = set(self.ids.tolist())
+        self.prune()
+        self._summaries.clear()
+        self.generation += 1
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.load)
+        self.listeners.append(self.observe)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.observe in self.listeners:
+            self.listeners.remove(self.observe)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            if self.compact():
+                await asyncio.to_thread(self.save, self.snapshot())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                # compaction is done in the loop, the saved snapshot holds arrays that are never modified
+                if added := self.compact():
+                    metrics.incr('delays.added', added)
+                    metrics.gauge('delays.size', len(self))
+                    with metrics.timer('delays.save'):
+                        await asyncio.to_thread(self.save, self.snapshot())
+            except Exception:
+                logger.exception(msg='Failed to update delay statistics')
+
+
+delay_stats = DelayStats(
+    path=settings.DELAYS_PATH,
+    listeners=FlightEndpoint.listeners,
+    history=settings.DELAYS_HISTORY_DAYS,
+    on_time=settings.DELAYS_ON_TIME_MINUTES,
+    interval=settings.DELAYS_INTERVAL,
+)
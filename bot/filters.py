@@ -3,7 +3,9 @@ from datetime import datetime, timezone, timedelta
 from aiogram import types
 from aiogram.filters import BaseFilter
 
+from .analytics import analytics
 from .search_engine import co_number_search, param_search
+from .settings import settings
 
 
 class SearchFlightFilter(BaseFilter):
@@ -13,7 +15,10 @@ class SearchFlightFilter(BaseFilter):
 
         search_result['date_start'] = (search_result.pop('date', None) or datetime.now(tz=timezone(timedelta(hours=3)))
                                        .replace(hour=0, minute=0, second=0, microsecond=0))
-        search_result['date_end'] = ((search_result['date_start'] + timedelta(days=1))
+        # a range is split into per-day queries, so its length is limited
+        date_end = search_result.pop('date_end', None) or search_result['date_start'] + timedelta(days=1)
+        search_result['date_end'] = (min(date_end, search_result['date_start'] +
+                                         timedelta(days=settings.SEARCH_MAX_RANGE_DAYS))
                                      .replace(hour=0, minute=0, second=0, microsecond=0))
         if search_result.get('number') is not None:
             search_result['number'] = f'{search_result["number"]:0>3}'
@@ -31,5 +36,24 @@ class SearchFlightFilter(BaseFilter):
         if not any(search_result.values()):
             return
 
+        date_given = search_result.get('date') is not None
         self._prepare_search_result(search_result)
-        return dict(search_params=search_result)
+        analytics.record_destinations(search_result['destination'])
+        return dict(search_params=search_result, date_given=date_given)
+
+
+class DelayStatsFilter(SearchFlightFilter):
+    """ Рейс, авиакомпания или направление из аргументов команды """
+    async def __call__(self, message: types.Message) -> dict | None:
+        _, _, args = (message.text or '').partition(' ')
+        search_result = self._search(args)
+        if not any(search_result.values()):
+            return
+
+        stats_params = dict(
+            number=search_result.get('number'),
+            company=search_result.get('company_iata'),
+            airport=search_result.get('airport_iata'),
+            direction=search_result.get('direction'),
+        )
+        return dict(stats_params=stats_params)
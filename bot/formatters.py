@@ -1,22 +1,35 @@
-from datetime import datetime
+import base64
+import hashlib
+from datetime import datetime, timedelta
+from functools import cache, lru_cache
 
 from aiogram.utils.deep_linking import create_deep_link
 
+from .constants import SVO_TIMEZONE
 from .settings import settings
 
 
+# formatters run for every line of every rendered flight, so `strftime` is avoided in them
+
+
 def ftime(time: datetime | None, placeholder='...') -> str:
     if time is None:
         return placeholder
-    return time.strftime('%H:%M')
+    return f'{time.hour:02}:{time.minute:02}'
 
 
 def ftimezone(time: datetime | None, placeholder='...'):
     if time is None:
         return placeholder
+    return _ftimezone(time.utcoffset())
 
-    tz = time.strftime('%z')
-    hours, minutes = map(int, [tz[:3], tz[3:]])
+
+@cache
+def _ftimezone(offset: timedelta) -> str:
+    # hours carry the sign of the offset like in `%z`, so -00:30 is shown as +0:30
+    total = offset // timedelta(minutes=1)
+    hours, minutes = divmod(abs(total), 60)
+    hours = -hours if total < 0 else hours
     result = 'UTC'
     if hours != 0 or minutes != 0:
         result += f' {hours:+}'
@@ -28,10 +41,36 @@ def ftimezone(time: datetime | None, placeholder='...'):
 def fdate(date: datetime | None, placeholder='...') -> str:
     if date is None:
         return placeholder
-    return date.strftime('%d.%m.%Y')
+    return f'{date.day:02}.{date.month:02}.{date.year}'
+
+
+def fdate_range(date_start: datetime | None, date_end: datetime | None, placeholder='...') -> str:
+    if date_start is None:
+        return placeholder
+    if date_end is None or date_end - date_start <= timedelta(days=1):
+        return fdate(date_start)
+    # the end of a range is exclusive, the last day of it is shown
+    return f'{fdate(date_start)}-{fdate(date_end - timedelta(days=1))}'
+
 
+def fsnapshot(created_at: datetime) -> str:
+    created_at = created_at.astimezone(SVO_TIMEZONE)
+    return f'Нет связи с svolog.ru, данные на {ftime(created_at)} {created_at.day:02}.{created_at.month:02}'
 
+
+def fdelay(minutes: float | None, placeholder='...') -> str:
+    if minutes is None:
+        return placeholder
+    return f'{round(minutes):+} мин'
+
+
+@lru_cache(maxsize=4096)
 def create_flight_link(flight_id: int) -> str:
     payload = f'flight-{flight_id}'
     url = create_deep_link(settings.BOT_NAME, link_type='start', payload=payload, encode=True)
     return url
+
+
+def digest(*parts) -> str:
+    data = '\x1f'.join(map(str, parts)).encode()
+    return base64.urlsafe_b64encode(hashlib.blake2b(data, digest_size=6).digest()).decode()
@@ -9,6 +9,9 @@ from . import (
     callback_data as cd,
     processors,
 )
+from .analytics import analytics
+from .metrics import metrics
+from .settings import settings
 
 router = Router()
 router.message.middleware(ChatActionMiddleware())
@@ -35,9 +38,30 @@ async def favorite_flight_message(message: types.Message):
     await processors.FavoriteFlightProcessor().process_message(message=message)
 
 
+@router.message(Command('top'), F.from_user.id.in_(settings.ADMIN_IDS))
+async def analytics_top_cmd(message: types.Message):
+    await message.answer(**templates.AnalyticsTopTemplate(top=analytics.top(10)).as_kwargs())
+
+
+@router.message(Command('metrics'), F.from_user.id.in_(settings.ADMIN_IDS))
+async def metrics_cmd(message: types.Message):
+    await message.answer(**templates.MetricsTemplate(snapshot=metrics.snapshot()).as_kwargs())
+
+
+@router.message(Command('delays'), filters.DelayStatsFilter())
+async def delay_stats_message(message: types.Message, stats_params: dict):
+    await processors.DelayStatsProcessor().process_message(message=message, stats_params=stats_params)
+
+
+@router.message(Command('delays'))
+async def delay_stats_usage(message: types.Message):
+    await message.answer(templates.DelayStatsTemplate.get_message_usage())
+
+
 @router.message(filters.SearchFlightFilter())
-async def search_flight_message(message: types.Message, search_params: dict):
-    await processors.SearchFlightProcessor().process_message(message, search_params=search_params)
+async def search_flight_message(message: types.Message, search_params: dict, date_given: bool):
+    await processors.SearchFlightProcessor().process_message(message, search_params=search_params,
+                                                             date_given=date_given)
 
 
 @router.message()
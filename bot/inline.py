@@ -0,0 +1,68 @@
+from typing import Iterable
+
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+
+from . import constants, templates
+from .api import schemas
+from .cache import LRUCache
+from .delays import delay_stats
+from .metrics import metrics
+from .settings import settings
+
+
+class InlineResultRenderer:
+    """ Кэширует строки инлайн-выдачи по версии рейса, строки с отметкой избранного кэшируются отдельно """
+    def __init__(self, maxsize: int = 5000):
+        self._cache = LRUCache(maxsize=maxsize)
+
+    def render(self, flight: schemas.FlightSchema, is_favorite: bool, sender: bool) -> InlineQueryResultArticle:
+        return self.render_many([flight], favorites={flight.id} if is_favorite else set(), sender=sender)[0]
+
+    def render_many(self, flights: Iterable[schemas.FlightSchema], favorites: set[int],
+                    sender: bool) -> list[InlineQueryResultArticle]:
+        results = []
+        misses = 0
+        for flight in flights:
+            is_favorite = flight.id in favorites
+            # the row message has the delay line, which changes with the statistics
+            key = (flight.id, flight.version, sender, is_favorite, delay_stats.generation)
+            if (result := self._cache.get(key)) is None:
+                misses += 1
+                result = self._render_variant(flight, is_favorite=is_favorite, sender=sender)
+                self._cache.set(key, result)
+            results.append(result)
+
+        # counted once per batch, all 50 rows of a page are rendered in one pass
+        metrics.incr('inline.render.miss', misses)
+        metrics.incr('inline.render.hit', len(results) - misses)
+        return results
+
+    def _render_variant(self, flight: schemas.FlightSchema, is_favorite: bool, sender: bool) -> InlineQueryResultArticle:
+        if not is_favorite:
+            return self._render(flight, sender=sender)
+
+        shared = self.render_many([flight], favorites=set(), sender=sender)[0]
+        return shared.model_copy(update=dict(title=templates.FlightTemplate.mark_favorite(shared.title)))
+
+    @staticmethod
+    def _render(flight: schemas.FlightSchema, sender: bool) -> InlineQueryResultArticle:
+        template = templates.get_flight_template(flight)(flight, is_favorite=False, changelog=False)
+
+        if sender:
+            message = f'/flight {flight.id}'
+            reply_markup = None
+        else:
+            message = template.get_inline_query_message()
+            reply_markup = template.get_inline_query_keyboard()
+
+        return InlineQueryResultArticle(
+            id=str(flight.id),
+            title=template.get_inline_query_title(),
+            description=template.get_inline_query_description(),
+            input_message_content=InputTextMessageContent(message_text=message),
+            reply_markup=reply_markup,
+            thumbnail_url=constants.INLINE_PLANE_IMAGE[flight.direction],
+        )
+
+
+renderer = InlineResultRenderer(maxsize=settings.INLINE_RENDER_CACHE_SIZE)
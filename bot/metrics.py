@@ -0,0 +1,77 @@
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class Timing:
+    def __init__(self, size: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples = deque(maxlen=size)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self._samples.append(value)
+
+    def percentile(self, p: float) -> float:
+        if not self._samples:
+            return 0.0
+        samples = sorted(self._samples)
+        return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+    def snapshot(self) -> dict:
+        return dict(
+            count=self.count,
+            avg=self.total / self.count if self.count else 0.0,
+            p50=self.percentile(0.5),
+            p95=self.percentile(0.95),
+            max=self.max,
+        )
+
+
+class Metrics:
+    """ Счетчики, текущие значения и замеры времени внутри процесса """
+    def __init__(self):
+        self.counters: defaultdict[str, int] = defaultdict(int)
+        self.gauges: dict[str, float] = {}
+        self.timings: defaultdict[str, Timing] = defaultdict(Timing)
+
+    def incr(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def gauge(self, name: str, value: float) -> None:
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        self.timings[name].observe(value)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def hit_rates(self) -> dict[str, float]:
+        """ Доля попаданий для пар счетчиков `<name>.hit` и `<name>.miss` """
+        rates = {}
+        for name, hits in self.counters.items():
+            if name.endswith('.hit') and (total := hits + self.counters.get(name[:-4] + '.miss', 0)):
+                rates[name[:-4]] = hits / total
+        return rates
+
+    def snapshot(self) -> dict:
+        return dict(
+            counters=dict(self.counters),
+            hit_rates=self.hit_rates(),
+            gauges=dict(self.gauges),
+            timings={name: timing.snapshot() for name, timing in self.timings.items()},
+        )
+
+
+metrics = Metrics()
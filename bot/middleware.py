@@ -1,7 +1,13 @@
-from typing import Callable, Dict, Any, Awaitable
+import asyncio
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Any, Awaitable, AsyncIterator
 
 from aiogram import BaseMiddleware
-from aiogram.types import TelegramObject
+from aiogram.types import TelegramObject, InlineQuery, Update
+
+from .metrics import metrics
 
 
 class LoggingMiddleware(BaseMiddleware):
@@ -14,3 +20,117 @@ class LoggingMiddleware(BaseMiddleware):
             return await handler(event, data)
         except Exception:
             self.logger.exception(msg='Uncaught exception', extra={'data': data})
+
+
+class InlineQuerySupersedeMiddleware(BaseMiddleware):
+    """ Отменяет обработку инлайн-запроса пользователя, когда от него приходит более новый """
+    def __init__(self, debounce: float = 0):
+        self.debounce = debounce
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], event: InlineQuery,
+                       data: Dict[str, Any]) -> Any:
+        user_id = event.from_user.id
+        if (previous := self._tasks.get(user_id)) is not None:
+            previous.cancel()
+
+        task = asyncio.create_task(self._handle(handler, event, data))
+        self._tasks[user_id] = task
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # the update itself is cancelled (e.g. on shutdown), not superseded
+                task.cancel()
+                raise
+            return None
+        finally:
+            if self._tasks.get(user_id) is task:
+                del self._tasks[user_id]
+
+    async def _handle(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], event: InlineQuery,
+                      data: Dict[str, Any]) -> Any:
+        if self.debounce:
+            try:
+                await asyncio.sleep(self.debounce)
+            except asyncio.CancelledError:
+                metrics.incr('inline.debounced')
+                raise
+
+        try:
+            return await handler(event, data)
+        except asyncio.CancelledError:
+            metrics.incr('inline.cancelled')
+            raise
+
+
+class UpdateConcurrencyMiddleware(BaseMiddleware):
+    """ Ограничивает число одновременно обрабатываемых обновлений и длину очереди к ним,
+    сообщения и нажатия кнопок одного пользователя обрабатываются по очереди """
+    serialized = frozenset({'message', 'callback_query'})
+
+    def __init__(self, limit: int = 32, max_pending: int = 256):
+        self.limit = limit
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(limit)
+        self._pending = 0
+        self._active = 0
+        self._user_locks: dict[int, asyncio.Lock] = {}
+        self._user_holders: Counter[int] = Counter()
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]], event: Update,
+                       data: Dict[str, Any]) -> Any:
+        if self._pending >= self.max_pending:
+            metrics.incr('updates.shed')
+            await self._shed(event)
+            return None
+
+        user = data.get('event_from_user')
+        user_id = user.id if user is not None and event.event_type in self.serialized else None
+
+        start = time.perf_counter()
+        self._pending += 1
+        queued = True
+        self._update_gauges()
+        try:
+            async with self._user_lock(user_id), self._semaphore:
+                self._pending -= 1
+                queued = False
+                self._active += 1
+                self._update_gauges()
+                metrics.observe('updates.queue_wait', time.perf_counter() - start)
+                try:
+                    return await handler(event, data)
+                finally:
+                    self._active -= 1
+        finally:
+            if queued:
+                self._pending -= 1
+            self._update_gauges()
+
+    @asynccontextmanager
+    async def _user_lock(self, user_id: int | None) -> AsyncIterator[None]:
+        if user_id is None:
+            yield
+            return
+
+        lock = self._user_locks.setdefault(user_id, asyncio.Lock())
+        self._user_holders[user_id] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._user_holders[user_id] -= 1
+            if not self._user_holders[user_id]:
+                del self._user_holders[user_id]
+                del self._user_locks[user_id]
+
+    def _update_gauges(self) -> None:
+        metrics.gauge('updates.pending', self._pending)
+        metrics.gauge('updates.active', self._active)
+
+    @staticmethod
+    async def _shed(event: Update) -> None:
+        if event.callback_query is not None:
+            # otherwise the button keeps spinning until the client gives up
+            await event.callback_query.answer('Сервис перегружен, попробуйте позже')
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Iterable
+
+from .api import TruncatedResponse
+from .constants import SVO_TIMEZONE
+from .metrics import metrics
+from .services import services
+from .settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class FlightNumberIndex:
+    """ Недавние и ближайшие рейсы по номеру, собираются из всех ответов API и фонового обхода """
+    def __init__(self, sweep: Callable[[datetime, datetime], Awaitable[Any]] | None, listeners: list[Callable],
+                 past: timedelta = timedelta(days=1), ahead: timedelta = timedelta(days=2), interval: float = 600):
+        self.past = past
+        self.ahead = ahead
+        self.interval = interval
+        self.listeners = listeners
+        self._sweep = sweep
+        # number -> company -> flight id -> scheduled time
+        self._flights: dict[str, dict[str, dict[int, datetime]]] = {}
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return sum(len(flights) for companies in self._flights.values() for flights in companies.values())
+
+    @staticmethod
+    def normalize(number: str) -> str:
+        # numbers are zero padded differently by the api and by the search
+        return number.upper().lstrip('0')
+
+    def window(self, now: datetime | None = None) -> tuple[datetime, datetime]:
+        now = now or datetime.now(tz=SVO_TIMEZONE)
+        return now - self.past, now + self.ahead
+
+    def observe(self, items: Iterable[dict]) -> None:
+        """ Обновляет индекс по сырым данным рейсов, рейсы вне окна не хранятся """
+        lower, upper = self.window()
+        for item in items:
+            try:
+                number = self.normalize(item['number'])
+                company = item['company']['iata']
+                date = datetime.fromisoformat(item.get('sked_local') or item['date'])
+                flight_id = item['id']
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+            if lower <= date < upper:
+                self._flights.setdefault(number, {}).setdefault(company, {})[flight_id] = date
+
+    def nearest(self, number: str, company: str | None = None, n: int = 3,
+                now: datetime | None = None) -> list[tuple[datetime, int]]:
+        now = now or datetime.now(tz=SVO_TIMEZONE)
+        found = [
+            (date, flight_id)
+            for code, flights in self._flights.get(self.normalize(number), {}).items() if company in (None, code)
+            for flight_id, date in flights.items()
+        ]
+        return sorted(sorted(found, key=lambda flight: abs(flight[0] - now))[:n])
+
+    def prune(self, now: datetime | None = None) -> None:
+        lower, upper = self.window(now)
+        for number, companies in list(self._flights.items()):
+            for company, flights in list(companies.items()):
+                for flight_id, date in list(flights.items()):
+                    if not lower <= date < upper:
+                        del flights[flight_id]
+                if not flights:
+                    del companies[company]
+            if not companies:
+                del self._flights[number]
+
+    async def sweep(self) -> None:
+        """ Запрашивает все рейсы окна, индекс обновляется слушателем ответов API.
+        Без `sweep` окно загружает кто-то другой, остается только убрать старые рейсы """
+        if self._sweep is not None:
+            lower, upper = self.window()
+            date_start = lower.replace(hour=0, minute=0, second=0, microsecond=0)
+            with metrics.timer('number_index.sweep'):
+                await self._sweep(date_start, upper)
+        self.prune()
+        metrics.gauge('number_index.size', len(self))
+
+    async def start(self) -> None:
+        self.listeners.append(self.observe)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.observe in self.listeners:
+            self.listeners.remove(self.observe)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception(msg='Failed to sweep flight numbers')
+            await asyncio.sleep(self.interval)
+
+
+async def sweep_flights(date_start: datetime, date_end: datetime) -> None:
+    # day by day, so a busy window doesn't run past the page limit at once
+    while date_start < date_end:
+        day_end = min(date_start + timedelta(days=1), date_end)
+        params = dict(date_start=date_start, date_end=day_end, max_pages=settings.NUMBER_INDEX_MAX_PAGES)
+        try:
+            await services.FlightQueryService.get_raw_items(**params, strict=True)
+        except TruncatedResponse:
+            # the pages that fit are still indexed, the cut off is logged by the api
+            metrics.incr('number_index.truncated')
+            await services.FlightQueryService.get_raw_items(**params)
+        date_start = day_end
+
+
+# the schedule snapshot fetches the same window just as often and its responses reach the index as well
+snapshot_covers_index = (settings.SNAPSHOT_PAST_DAYS >= settings.NUMBER_INDEX_PAST_DAYS
+                         and settings.SNAPSHOT_AHEAD_DAYS >= settings.NUMBER_INDEX_AHEAD_DAYS)
+
+number_index = FlightNumberIndex(
+    sweep=None if snapshot_covers_index else sweep_flights,
+    listeners=services.FlightQueryService.api.listeners,
+    past=timedelta(days=settings.NUMBER_INDEX_PAST_DAYS),
+    ahead=timedelta(days=settings.NUMBER_INDEX_AHEAD_DAYS),
+    interval=settings.NUMBER_INDEX_SWEEP_INTERVAL,
+)
@@ -0,0 +1,155 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Hashable, Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, SendChatAction, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from .cache import LRUCache
+from .metrics import metrics
+
+
+_background: ContextVar[bool] = ContextVar('outbound_background', default=False)
+
+
+@contextmanager
+def background() -> Iterator[None]:
+    """ Запросы внутри блока уступают очередь ответам пользователям """
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, reserve: float = 0, is_stale: Callable[[], bool] = lambda: False) -> bool:
+        """ Ждет свободный токен, возвращает `False`, если запрос перестал быть нужен раньше """
+        while not is_stale():
+            self._refill()
+            if self._tokens >= 1 + reserve:
+                self._tokens -= 1
+                return True
+            await asyncio.sleep((1 + reserve - self._tokens) / self.rate)
+        return False
+
+    def pause(self, seconds: float) -> None:
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+
+class _Edit:
+    def __init__(self):
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.successor: _Edit | None = None
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """ Ограничивает отправку сообщений общим и по-чатовым лимитами Telegram.
+    Ждущая своей очереди правка сообщения заменяется более новой правкой того же сообщения """
+    def __init__(self, rate: float = 30, chat_rate: float = 1, group_rate: float = 20 / 60, chat_burst: float = 3,
+                 reserve: float = 10, max_retries: int = 3):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        # background requests must still be able to get a token
+        self.reserve = min(reserve, max(rate - 1, 0))
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate=rate, capacity=rate)
+        # an idle bucket refills in a minute, so it can be forgotten
+        self._chat_buckets = LRUCache(maxsize=10_000, ttl=60)
+        self._edits: dict[Hashable, _Edit] = {}
+
+    @staticmethod
+    def is_limited(method: TelegramMethod) -> bool:
+        name = type(method).__name__
+        return name.startswith(('Send', 'Edit', 'Copy', 'Forward')) and not isinstance(method, SendChatAction)
+
+    @staticmethod
+    def edit_key(method: TelegramMethod) -> Hashable | None:
+        if not type(method).__name__.startswith('EditMessage'):
+            return None
+        # only edits of the same kind supersede each other, a markup edit must not drop a pending text edit
+        if (inline_message_id := getattr(method, 'inline_message_id', None)) is not None:
+            return type(method).__name__, inline_message_id
+        return type(method).__name__, getattr(method, 'chat_id', None), getattr(method, 'message_id', None)
+
+    def chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        if (bucket := self._chat_buckets.get(chat_id)) is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(rate=self.group_rate if is_group else self.chat_rate, capacity=self.chat_burst)
+        # refreshes the expiration on every use
+        self._chat_buckets.set(chat_id, bucket)
+        return bucket
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        if not self.is_limited(method):
+            return await make_request(bot, method)
+
+        if (key := self.edit_key(method)) is None:
+            return await self._request(make_request, bot, method)
+
+        edit = _Edit()
+        if (previous := self._edits.get(key)) is not None:
+            previous.successor = edit
+            metrics.incr('outbound.superseded')
+        self._edits[key] = edit
+
+        try:
+            response = await self._request(make_request, bot, method, is_stale=lambda: edit.successor is not None)
+            if response is None:
+                # the outcome of the newer edit of the same message is the outcome of this one
+                response = await asyncio.shield(edit.successor.result)
+        except asyncio.CancelledError:
+            edit.result.cancel()
+            raise
+        except Exception as e:
+            edit.result.set_exception(e)
+            edit.result.exception()  # nobody may wait for it, so mark it retrieved
+            raise
+        else:
+            edit.result.set_result(response)
+        finally:
+            if self._edits.get(key) is edit:
+                del self._edits[key]
+
+        return response
+
+    async def _request(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType],
+                       is_stale: Callable[[], bool] = lambda: False) -> Response[TelegramType] | None:
+        chat_id = getattr(method, 'chat_id', None)
+        reserve = self.reserve if _background.get() else 0
+
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            if chat_id is not None and not await self.chat_bucket(chat_id).acquire(is_stale=is_stale):
+                return None
+            if not await self._bucket.acquire(reserve=reserve, is_stale=is_stale):
+                return None
+            metrics.observe('outbound.wait', time.perf_counter() - start)
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                metrics.incr('outbound.retry_after')
+                if attempt == self.max_retries:
+                    raise
+                (self.chat_bucket(chat_id) if chat_id is not None else self._bucket).pause(e.retry_after)
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from .constants import COUNTER_DIRECTION
+from .metrics import metrics
+from .settings import settings
+from .warming import QueryWarmer, warmer
+
+
+logger = logging.getLogger(__name__)
+
+
+def follow_up_queries(query: dict) -> list[dict]:
+    """ Запросы, которые пользователь вероятнее всего сделает следующими: другое направление и соседние дни """
+    queries = []
+    if (direction := query.get('direction')) is not None:
+        queries.append(query | dict(direction=COUNTER_DIRECTION[direction].value))
+    for days in (-1, 1):
+        queries.append(query | dict(
+            date_start=query['date_start'] + timedelta(days=days),
+            date_end=query['date_end'] + timedelta(days=days),
+        ))
+    return queries
+
+
+class SearchPrefetcher:
+    """ Загружает в фоне ответы на вероятные следующие запросы, не мешая запросам пользователей """
+    def __init__(self, warmer: QueryWarmer, ttl: float = 30, concurrency: int = 2, max_pending: int = 100):
+        self.warmer = warmer
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def schedule(self, query: dict, summary: bool = False) -> None:
+        """ `summary` для сообщений поиска, им нужно только число рейсов, а не страницы """
+        for follow_up in follow_up_queries(query):
+            if len(self._tasks) >= self.max_pending:
+                metrics.incr('prefetch.dropped')
+                return
+            task = asyncio.create_task(self._prefetch(follow_up, summary=summary))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _prefetch(self, query: dict, summary: bool) -> None:
+        async with self._semaphore:
+            try:
+                await self.warmer.prefetch(query, ttl=self.ttl, summary=summary)
+            except Exception:
+                metrics.incr('prefetch.failed')
+                logger.debug(msg='Failed to prefetch query', exc_info=True)
+
+
+prefetcher = SearchPrefetcher(
+    warmer=warmer,
+    ttl=settings.PREFETCH_TTL,
+    concurrency=settings.PREFETCH_CONCURRENCY,
+)
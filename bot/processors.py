@@ -1,20 +1,51 @@
+import asyncio
 import binascii
 import re
 from abc import ABCMeta, abstractmethod
 from datetime import datetime, timedelta
-from typing import Any
+from functools import wraps
+from typing import Any, Callable
 
 from aiogram import types
-from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
 from aiogram.utils.payload import decode_payload
-from aiogram_calendar import SimpleCalendar, SimpleCalendarCallback
+from aiogram_calendar import SimpleCalendarCallback
+from aiogram_calendar.schemas import SimpleCalAct
 
 from . import (
+    calendars,
     callback_data as cd,
     templates,
     constants,
+    inline,
+    prefetch,
+    tracking,
+    warming,
 )
+from .analytics import analytics
+from .api import schemas
+from .cache import LRUCache
+from .delays import delay_stats
+from .metrics import metrics
+from .number_index import number_index
 from .services import services
+from .settings import settings
+
+
+def instrumented(method: Callable) -> Callable:
+    """ Замеряет время обработчика и ограничивает его `HANDLER_TIMEOUT` """
+    @wraps(method)
+    async def wrapper(self, *a, **kw):
+        with metrics.timer(f'{type(self).__name__}.{method.__name__}'):
+            try:
+                async with asyncio.timeout(settings.HANDLER_TIMEOUT):
+                    return await method(self, *a, **kw)
+            except TimeoutError:
+                metrics.incr(f'{type(self).__name__}.{method.__name__}.timeout')
+                if (callback := kw.get('callback')) is not None:
+                    await callback.answer('Сервис не отвечает, попробуйте позже')
+                raise
+
+    return wrapper
 
 
 class Processor(metaclass=ABCMeta):
@@ -40,24 +71,55 @@ class Processor(metaclass=ABCMeta):
 
 
 class SearchFlightProcessor(Processor):
-    def init_template(self, response: Any, query: dict, *a, **kw) -> templates.SearchFlightTemplate:
-        return templates.SearchFlightTemplate(response, query)
+    text_digests = LRUCache(maxsize=settings.SEARCH_QUERY_CACHE_SIZE, ttl=settings.SEARCH_QUERY_TTL)
+
+    def init_template(self, response: Any, query: dict, occurrences: list[tuple[datetime, int]] = (),
+                      *a, **kw) -> templates.SearchFlightTemplate:
+        return templates.SearchFlightTemplate(response, query, state=self.encode_state(query), occurrences=occurrences)
 
-    async def get_query(self, message_id: int, *a, **kw) -> dict | None:
-        return await services.FlightQueryService.get_query(message_id)
+    def encode_state(self, query: dict) -> str | None:
+        return services.FlightQueryService.encode_query(query, max_length=cd.SearchFlightCD.max_state_length())
+
+    async def get_query(self, chat_id: int, message_id: int, state: str = '', *a, **kw) -> dict | None:
+        if state and (query := services.FlightQueryService.decode_query(state)) is not None:
+            return query
+        return await services.FlightQueryService.get_query(chat_id=chat_id, message_id=message_id)
+
+    async def store_query(self, template: templates.SearchFlightTemplate, message: types.Message) -> None:
+        self.text_digests.set((message.chat.id, message.message_id), template.text_digest)
+        # the query is kept in the keyboard itself unless it doesn't fit into `callback_data`
+        if template.state is None:
+            await services.FlightQueryService.store_query(query_dict=template.query, chat_id=message.chat.id,
+                                                          message_id=message.message_id)
 
     async def get_response(self, query: dict, *a, **kw) -> Any:
-        response = await services.FlightQueryService.get_many(**query)
+        response = await warming.warmer.get_many(query)
         return response
 
-    async def process_message(self, message, search_params: dict, *a, **kw) -> None:
+    async def get_count(self, query: dict) -> schemas.FlightCountResponse:
+        # the search message shows only the number of flights
+        return await warming.warmer.get_count(query)
+
+    async def edit_message(self, message: types.Message, template: templates.SearchFlightTemplate) -> types.Message:
+        if self.text_digests.get((message.chat.id, message.message_id)) == template.text_digest:
+            # e.g. direction toggled but the number of flights is the same, only the keyboard has to be replaced
+            return await message.edit_reply_markup(reply_markup=template.get_keyboard())
+        return await message.edit_text(**template.as_kwargs())
+
+    async def process_message(self, message, search_params: dict, date_given: bool = True, *a, **kw) -> None:
         if search_params.get('number') is None:
             search_params.setdefault('direction', 'departure')
-        response = await self.get_response(query=search_params)
-        template = self.init_template(response=response, query=search_params)
+        response = await self.get_count(query=search_params)
+        # without a date the flight may be on another day, its known occurrences are offered right away
+        occurrences = []
+        if search_params.get('number') is not None and not date_given:
+            occurrences = number_index.nearest(number=search_params['number'], company=search_params.get('company'),
+                                               n=settings.NUMBER_INDEX_NEAREST)
+        template = self.init_template(response=response, query=search_params, occurrences=occurrences)
 
         sent_message = await message.answer(**template.as_kwargs())
-        await services.FlightQueryService.store_query(query_dict=search_params, message_id=sent_message.message_id)
+        await self.store_query(template=template, message=sent_message)
+        prefetch.prefetcher.schedule(search_params, summary=True)
 
     async def process_inline(self, inline_query: types.InlineQuery, search_params: dict, *a, **kw):
         offset = int(inline_query.offset or 0)
@@ -67,8 +129,6 @@ class SearchFlightProcessor(Processor):
         if response.count == 0:
             return []
 
-        results = []
-
         if response.items:
             paged_favorites = await services.FlightFavoriteService.get_paged_ids(
                 user_id=inline_query.from_user.id,
@@ -79,73 +139,81 @@ class SearchFlightProcessor(Processor):
         else:
             favorites = set()
 
-        for flight in response.items:
-            template = FlightProcessor().init_template(
-                flight=flight,
-                is_favorite=flight.id in favorites,
-                changelog=False
-            )
-
-            if inline_query.chat_type == 'sender':
-                message = f'/flight {flight.id}'
-                reply_markup = None
-            else:
-                message = template.get_inline_query_message()
-                reply_markup = template.get_inline_query_keyboard()
-
-            results.append(InlineQueryResultArticle(
-                id=str(flight.id),
-                title=template.get_inline_query_title(),
-                description=template.get_inline_query_description(),
-                input_message_content=InputTextMessageContent(message_text=message),
-                reply_markup=reply_markup,
-                thumbnail_url=constants.INLINE_PLANE_IMAGE[flight.direction],
-            ))
+        sender = inline_query.chat_type == 'sender'
+        results = inline.renderer.render_many(response.items, favorites=favorites, sender=sender)
 
-        await inline_query.answer(results, is_personal=True, cache_time=0, next_offset=str(offset + 1))
+        # rows carry the user's favorite marks, even a page without them is wrong for a user who has some,
+        # and telegram doesn't tell the chat type apart, so the answer is cached only for this user and briefly
+        await inline_query.answer(
+            results,
+            is_personal=True,
+            cache_time=settings.INLINE_CACHE_TIME,
+            next_offset=str(offset + 1),
+        )
 
     async def toggle_direction_cb(self, callback: types.CallbackQuery, callback_data: cd.SearchFlightCD):
-        query = await self.get_query(message_id=callback.message.message_id)
+        query = await self.get_query(chat_id=callback.message.chat.id, message_id=callback.message.message_id,
+                                     state=callback_data.state)
         query['direction'] = constants.COUNTER_DIRECTION[query['direction']].value
 
         template = self.init_template(
-            response=await self.get_response(query),
+            response=await self.get_count(query),
             query=query
         )
 
-        sent_message = await callback.message.edit_text(**template.as_kwargs())
-        await services.FlightQueryService.store_query(query_dict=query, message_id=sent_message.message_id)
+        sent_message = await self.edit_message(message=callback.message, template=template)
+        await self.store_query(template=template, message=sent_message)
+        prefetch.prefetcher.schedule(query, summary=True)
         await callback.answer()
 
     async def pick_date_cb(self, callback: types.CallbackQuery, callback_data: cd.SearchFlightCD):
-        query = await self.get_query(message_id=callback.message.message_id)
+        query = await self.get_query(chat_id=callback.message.chat.id, message_id=callback.message.message_id,
+                                     state=callback_data.state)
         if query.get('number') is None:
             query.setdefault('direction', 'departure')
+        if callback_data.state:
+            # calendar buttons can't carry the query, so it is stored until the date is picked
+            await services.FlightQueryService.store_query(query_dict=query, chat_id=callback.message.chat.id,
+                                                          message_id=callback.message.message_id)
 
-        calendar = SimpleCalendar()
+        calendar = self.init_calendar(query)
         today = datetime.now(tz=constants.SVO_TIMEZONE)
         await callback.message.edit_reply_markup(
             reply_markup=await calendar.start_calendar(year=today.year, month=today.month))
 
         await callback.answer()
 
+    def init_calendar(self, query: dict | None) -> calendars.FlightCalendar:
+        if query is None:
+            return calendars.FlightCalendar()
+
+        async def count_by_month(year: int, month: int) -> dict[int, int]:
+            return await services.FlightQueryService.count_by_month(year, month, **query)
+
+        # the month's counts don't depend on the picked dates
+        key = services.FlightQueryService.count_key('date_start', 'date_end', **query)
+        return calendars.FlightCalendar(key=key, count_by_month=count_by_month)
+
     async def process_calendar(self, callback: types.CallbackQuery, callback_data: SimpleCalendarCallback):
-        calendar = SimpleCalendar()
+        query = None
+        if callback_data.act != SimpleCalAct.ignore:
+            query = await self.get_query(chat_id=callback.message.chat.id, message_id=callback.message.message_id)
+        calendar = self.init_calendar(query)
         selected, date = await calendar.process_selection(callback, callback_data)
 
         if selected:
-            query = await self.get_query(message_id=callback.message.message_id)
             if date is not None:
                 query['date_start'] = date.astimezone(constants.SVO_TIMEZONE)
                 query['date_end'] = query['date_start'] + timedelta(days=1)
 
             template = self.init_template(
-                response=await self.get_response(query),
+                response=await self.get_count(query),
                 query=query,
             )
 
-            sent_message = await callback.message.edit_text(**template.as_kwargs())
-            await services.FlightQueryService.store_query(query_dict=query, message_id=sent_message.message_id)
+            sent_message = await self.edit_message(message=callback.message, template=template)
+            await self.store_query(template=template, message=sent_message)
+            prefetch.prefetcher.schedule(query, summary=True)
             await callback.answer()
 
 
@@ -176,37 +244,58 @@ class FavoriteFlightProcessor(Processor):
         if response.count == 0:
             return []
 
-        results = []
-        for flight in response.items:
-            template = FlightProcessor().init_template(flight=flight, is_favorite=True, changelog=False)
-
-            if inline_query.chat_type == 'sender':
-                message = f'/flight {flight.id}'
-                reply_markup = None
-            else:
-                message = template.get_inline_query_message()
-                reply_markup = template.get_inline_query_keyboard()
-
-            results.append(InlineQueryResultArticle(
-                id=str(flight.id),
-                title=template.get_inline_query_title(),
-                description=template.get_inline_query_description(),
-                input_message_content=InputTextMessageContent(message_text=message),
-                reply_markup=reply_markup,
-                thumbnail_url=constants.INLINE_PLANE_IMAGE[flight.direction],
-            ))
+        results = inline.renderer.render_many(
+            response.items,
+            favorites={flight.id for flight in response.items},
+            sender=inline_query.chat_type == 'sender',
+        )
 
         await inline_query.answer(results, is_personal=True, cache_time=0, next_offset=str(offset + 1))
 
 
-class FlightProcessor(Processor):
-    def init_template(self, flight, is_favorite: bool, changelog: bool, *a, **kw) -> templates.BaseTemplate:
-        template = dict(
-            arrival=templates.FlightArrivalTemplate,
-            departure=templates.FlightDepartureTemplate
-        )[flight.direction]
+class DelayStatsProcessor(Processor):
+    def init_template(self, response: Any, query: dict, *a, **kw) -> templates.BaseTemplate:
+        summary, ranking = response
+        return templates.DelayStatsTemplate(summary=summary, params=query, ranking=ranking)
+
+    async def get_query(self, stats_params: dict, *a, **kw) -> dict:
+        return {key: value for key, value in stats_params.items() if value is not None}
+
+    async def get_response(self, query: dict, *a, **kw) -> Any:
+        summary = delay_stats.summary(**query)
+        # airlines are compared only when the query doesn't pin one
+        ranking = delay_stats.rank('company', min_count=settings.DELAYS_MIN_COUNT, **query) \
+            if query.get('company') is None and query.get('number') is None else []
+        return summary, ranking
+
+    @instrumented
+    async def process_message(self, message: types.Message, stats_params: dict, *a, **kw) -> None:
+        query = await self.get_query(stats_params)
+        template = self.init_template(response=await self.get_response(query), query=query)
+        await message.answer(**template.as_kwargs())
 
-        return template(flight, is_favorite=is_favorite, changelog=changelog)
+
+class FlightProcessor(Processor):
+    def init_template(self, flight, is_favorite: bool, changelog: bool, is_tracking: bool = False,
+                      *a, **kw) -> templates.BaseTemplate:
+        template = templates.get_flight_template(flight)
+        return template(flight, is_favorite=is_favorite, changelog=changelog, is_tracking=is_tracking)
+
+    @staticmethod
+    def is_tracking(message: types.Message) -> bool:
+        return tracking.tracker.is_tracking(chat_id=message.chat.id, message_id=message.message_id)
+
+    @staticmethod
+    async def sync_tracking(message: types.Message, template: templates.FlightTemplate, changelog: bool,
+                            is_favorite: bool) -> None:
+        """ Сообщение изменено обработчиком, трекер должен сравнивать новые данные уже с ним """
+        await tracking.tracker.update(
+            chat_id=message.chat.id,
+            message_id=message.message_id,
+            changelog=changelog,
+            is_favorite=is_favorite,
+            digest=template.digest,
+        )
 
     async def get_query(self, flight_id: int, *a, **kw) -> dict:
         return dict(id=flight_id)
@@ -218,99 +307,88 @@ class FlightProcessor(Processor):
     async def is_favorite(self, user_id: int, flight_id: int) -> bool:
         return await services.FlightFavoriteService.is_favorite(user_id=user_id, favorite_id=flight_id)
 
+    async def fetch(self, flight_id: int | str | None, user_id: int) -> tuple[schemas.FlightSchema | None, bool]:
+        try:
+            # ids come from user input, storages expect numeric ones
+            flight_id = int(flight_id)
+        except (TypeError, ValueError):
+            return None, False
+
+        with metrics.timer('FlightProcessor.fetch'):
+            query = await self.get_query(flight_id=flight_id)
+            async with asyncio.TaskGroup() as tg:
+                flight = tg.create_task(self.get_response(query))
+                is_favorite = tg.create_task(self.is_favorite(user_id=user_id, flight_id=flight_id))
+
+        if flight.result() is not None:
+            analytics.record_flight(flight.result().id)
+        return flight.result(), is_favorite.result()
+
+    @instrumented
     async def process_message(self, message: types.Message, command: types.BotCommand, *a, **kw) -> None:
         flight_id = command.args
-        query = await self.get_query(flight_id=flight_id)
-
-        flight = await self.get_response(query)
+        flight, is_favorite = await self.fetch(flight_id=flight_id, user_id=message.from_user.id)
         if flight is None:
             await message.answer(text='Рейс не найден')
             return
 
-        template = self.init_template(
-            flight,
-            is_favorite=await self.is_favorite(user_id=message.from_user.id, flight_id=flight_id),
-            changelog=False
-        )
+        template = self.init_template(flight, is_favorite=is_favorite, changelog=False)
 
         await message.answer(**template.as_kwargs())
 
+    @instrumented
     async def process_deeplink(self, message: types.Message, command: types.BotCommand, *a, **kw) -> None:
         try:
             args = decode_payload(command.args)
             match = re.match(r'flight-(?P<flight>\d+)?', args)
-            flight_id = match.groupdict().get('flight')
-        except (binascii.Error, AttributeError):
+            flight_id = int(match.groupdict().get('flight'))
+        except (binascii.Error, AttributeError, TypeError):
             await message.answer('Неверная ссылка')
             return
 
-        query = await self.get_query(flight_id=flight_id)
-        flight = await self.get_response(query)
+        flight, is_favorite = await self.fetch(flight_id=flight_id, user_id=message.from_user.id)
         if flight is None:
             await message.answer('Рейс не найден')
             return
 
-        is_favorite = await self.is_favorite(user_id=message.from_user.id, flight_id=int(flight_id))
         template = self.init_template(flight=flight, is_favorite=is_favorite, changelog=False)
         await message.answer(**template.as_kwargs())
 
+    @instrumented
     async def process_inline(self, inline_query: types.InlineQuery, flight_id: str, *a, **kw):
-        query = await self.get_query(flight_id=int(flight_id))
-        flight = await self.get_response(query)
+        flight, is_favorite = await self.fetch(flight_id=int(flight_id), user_id=inline_query.from_user.id)
         if flight is None:
             return
 
-        is_favorite = await self.is_favorite(user_id=inline_query.from_user.id, flight_id=int(flight_id))
-        template = self.init_template(flight, is_favorite=is_favorite, changelog=False)
-
-        if inline_query.chat_type == 'sender':
-            message = f'/flight {flight.id}'
-            reply_markup = None
-        else:
-            message = template.get_inline_query_message()
-            reply_markup = template.get_inline_query_keyboard()
-
-        results = [InlineQueryResultArticle(
-            id=flight_id,
-            title=template.get_inline_query_title(),
-            description=template.get_inline_query_description(),
-            input_message_content=InputTextMessageContent(message_text=message),
-            reply_markup=reply_markup,
-            thumbnail_url=constants.INLINE_PLANE_IMAGE[flight.direction],
-        )]
+        results = [inline.renderer.render(flight, is_favorite=is_favorite, sender=inline_query.chat_type == 'sender')]
 
         await inline_query.answer(results, is_personal=True, cache_time=0)
 
+    @instrumented
     async def show_cb(self, callback: types.CallbackQuery, callback_data: cd.FlightCD) -> None:
-        query = await self.get_query(flight_id=callback_data.id)
-        template = self.init_template(
-            flight=await self.get_response(query),
-            is_favorite=await self.is_favorite(user_id=callback.from_user.id, flight_id=callback_data.id),
-            changelog=callback_data.changelog
-        )
+        flight, is_favorite = await self.fetch(flight_id=callback_data.id, user_id=callback.from_user.id)
+        template = self.init_template(flight=flight, is_favorite=is_favorite, changelog=callback_data.changelog)
 
         await callback.message.answer(**template.as_kwargs())
         await callback.answer()
 
+    @instrumented
     async def update_cb(self, callback: types.CallbackQuery, callback_data: cd.FlightCD) -> None:
-        query = await self.get_query(flight_id=callback_data.id)
-        template = self.init_template(
-            flight=await self.get_response(query),
-            is_favorite=await self.is_favorite(user_id=callback.from_user.id, flight_id=callback_data.id),
-            changelog=callback_data.changelog
-        )
+        flight, is_favorite = await self.fetch(flight_id=callback_data.id, user_id=callback.from_user.id)
+        template = self.init_template(flight=flight, is_favorite=is_favorite, changelog=callback_data.changelog,
+                                      is_tracking=self.is_tracking(callback.message))
 
-        if not template.has_same_text(callback.message.text):
+        # the digest is carried by the keyboard, so a changed one always changes the markup as well
+        if template.digest != callback_data.digest:
             await callback.message.edit_text(**template.as_kwargs())
-        elif not template.has_same_markup(callback.message.reply_markup):
-            await callback.message.edit_reply_markup(reply_markup=template.get_keyboard())
+            await self.sync_tracking(callback.message, template, changelog=callback_data.changelog,
+                                     is_favorite=is_favorite)
         await callback.answer('Обновлено')
 
+    @instrumented
     async def toggle_favorite_cb(self, callback: types.CallbackQuery, callback_data: cd.FlightCD) -> None:
-        query = await self.get_query(flight_id=callback_data.id)
-        flight = await self.get_response(query)
+        flight, is_favorite = await self.fetch(flight_id=callback_data.id, user_id=callback.from_user.id)
 
-        is_favorite = await self.is_favorite(user_id=callback.from_user.id, flight_id=callback_data.id)
         if is_favorite is False:
             await services.FlightFavoriteService.add_one(user_id=callback.from_user.id, favorite_id=callback_data.id,
                                                          sked_local=flight.sked_local.timestamp())  # sked_local use as sort field
@@ -321,22 +399,59 @@ class FlightProcessor(Processor):
             answer = 'Удалено из избранного'
             is_favorite = False
 
-        template = self.init_template(flight, is_favorite=is_favorite, changelog=callback_data.changelog)
+        template = self.init_template(flight, is_favorite=is_favorite, changelog=callback_data.changelog,
+                                      is_tracking=self.is_tracking(callback.message))
 
-        if not template.has_same_text(callback.message.text):
+        if template.digest != callback_data.digest:
             await callback.message.edit_text(**template.as_kwargs())
-        elif not template.has_same_markup(callback.message.reply_markup):
-            await callback.message.edit_reply_markup(reply_markup=template.get_keyboard())
+            await self.sync_tracking(callback.message, template, changelog=callback_data.changelog,
+                                     is_favorite=is_favorite)
 
         await callback.answer(answer)
 
+    @instrumented
     async def toggle_changelog_cb(self, callback: types.CallbackQuery, callback_data: cd.FlightCD) -> None:
-        query = await self.get_query(flight_id=callback_data.id)
-        template = self.init_template(
-            flight=await self.get_response(query),
-            is_favorite=await self.is_favorite(user_id=callback.from_user.id, flight_id=callback_data.id),
-            changelog=callback_data.changelog
-        )
+        flight, is_favorite = await self.fetch(flight_id=callback_data.id, user_id=callback.from_user.id)
+        template = self.init_template(flight=flight, is_favorite=is_favorite, changelog=callback_data.changelog,
+                                      is_tracking=self.is_tracking(callback.message))
 
         await callback.message.edit_text(**template.as_kwargs())
+        await self.sync_tracking(callback.message, template, changelog=callback_data.changelog,
+                                 is_favorite=is_favorite)
         await callback.answer()
+
+    @instrumented
+    async def toggle_tracking_cb(self, callback: types.CallbackQuery, callback_data: cd.FlightCD) -> None:
+        flight, is_favorite = await self.fetch(flight_id=callback_data.id, user_id=callback.from_user.id)
+        message = callback.message
+        if flight is None:
+            await callback.answer('Рейс не найден')
+            return
+
+        if self.is_tracking(message):
+            await tracking.tracker.unsubscribe(chat_id=message.chat.id, message_id=message.message_id)
+            answer = 'Отслеживание выключено'
+            is_tracking = False
+        elif flight.is_completed:
+            answer = 'Рейс завершен'
+            is_tracking = False
+        else:
+            answer = 'Сообщение будет обновляться при изменениях рейса'
+            is_tracking = True
+
+        template = self.init_template(flight, is_favorite=is_favorite, changelog=callback_data.changelog,
+                                      is_tracking=is_tracking)
+        if is_tracking:
+            subscription = tracking.Subscription(
+                flight_id=flight.id,
+                chat_id=message.chat.id,
+                message_id=message.message_id,
+                changelog=callback_data.changelog,
+                is_favorite=is_favorite,
+                digest=template.digest,
+            )
+            await tracking.tracker.subscribe(subscription, flight=flight)
+
+        if template.digest != callback_data.digest:
+            await message.edit_text(**template.as_kwargs())
+        await callback.answer(answer)
@@ -66,6 +66,59 @@ class DateFilter(SearchFilter):
         result_dict['date'] = date_from_input(**match_dict)
 
 
+class DateRangeFilter(SearchFilter):
+    """ Период вида `20.12-25.12`, конец периода входит в него """
+    def result_factory(self) -> dict:
+        return dict(date=None, date_end=None)
+
+    def match(self, string: str | None, *args, **kwargs) -> dict | None:
+        match = Regex.date_range.search(string)
+        if match is None:
+            return
+        return match.groupdict()
+
+    def update_result(self, result_dict: dict, match_dict: dict) -> None:
+        date_end = date_from_input(**match_dict)
+        if date_end is None:
+            return
+        date_start = date_from_input(
+            day=match_dict['day_start'],
+            month=match_dict['month_start'] or date_end.month,
+            year=match_dict['year_start'] or date_end.year,
+        )
+        if date_start is None:
+            return
+        if date_start > date_end and match_dict['year_start'] is None:
+            # e.g. `28.12-03.01`, the period starts in the previous year
+            date_start = date_start.replace(year=date_start.year - 1)
+        if date_start > date_end:
+            return
+
+        result_dict['date'] = date_start
+        result_dict['date_end'] = date_end + timedelta(days=1)
+
+
+class DateRangeWordFilter(SearchFilter):
+    range_map = {
+        'неделя': timedelta(days=7),
+        'неделю': timedelta(days=7),
+    }
+
+    def result_factory(self) -> dict:
+        return dict(date=None, date_end=None)
+
+    def match(self, string: str | None, *args, **kwargs) -> dict | None:
+        match = Regex.date_range_word.search(string.lower())
+        if match is None:
+            return
+
+        date = datetime.now(tz=timezone(timedelta(hours=3))).replace(hour=0, minute=0, second=0, microsecond=0)
+        return dict(
+            date=date,
+            date_end=date + self.range_map[match.groupdict()['range_word']],
+        )
+
+
 class CompanyFlightFilter(SearchFilter):
     def result_factory(self) -> dict:
         return dict(
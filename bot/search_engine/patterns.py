@@ -6,6 +6,11 @@ class Regex(Enum):
     company_iata = re.compile(r'(^|\s+)(?P<company_iata>\d[a-z]|[a-z]\d|[a-z]{2})(\s+|$)', re.I)
     airport_iata = re.compile(r'(^|\s+)(?P<airport_iata>[a-z]{3})(\s+|$)', re.I)
     date = re.compile(r'(^|\s+)((?P<day>\d{1,2})\.)(?P<month>\d{1,2})?(?(month)\.(?P<year>\d{4}|\d{2}))?(\s+|$)')
+    date_range = re.compile(r'(^|\s+)(?P<day_start>\d{1,2})(\.(?P<month_start>\d{1,2})(\.(?P<year_start>\d{4}|\d{2}))?)?'
+                            r'\s*-\s*(?P<day>\d{1,2})\.(?P<month>\d{1,2})(\.(?P<year>\d{4}|\d{2}))?(\s+|$)')
+    # spaces around the dash of a period, e.g. `20.12 - 25.12`
+    date_range_dash = re.compile(r'(?<=\d)\s*-\s*(?=\d)')
+    date_range_word = re.compile(r'(^|\s+)(?P<range_word>неделя|неделю)(\s+|$)', re.I)
     date_word = re.compile(r'(^|\s+)(?P<date_word>вчера|сегодня|завтра)(\s+|$)', re.I)
     company_flight = re.compile(r'(^|\s+)((?P<company_iata>[a-z]\d|\d[a-z]|[a-z]{2})\s*((?P<number>\d{1,4}|\d{3}[a-z]|\d{2}[a-z]\d|\d[a-z]\d{2}|[a-z]\d{3})(\s+|$)))', re.I)
     flight = re.compile(r'(^|\s+)(?P<number>\d{1,4}|\d{3}[a-z]|\d{2}[a-z]\d|\d[a-z]\d{2}|[a-z]\d{3})(\s+|$)', re.I)
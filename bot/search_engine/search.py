@@ -4,6 +4,7 @@ from typing import Literal
 
 from . import filters
 from . import mappings
+from .patterns import Regex
 
 
 class BaseSearch(metaclass=ABCMeta):
@@ -32,6 +33,8 @@ class FlightNumberSearch(BaseSearch):
     @cached_property
     def filters(self) -> list:
         return [
+            filters.DateRangeFilter(to_none=False),
+            filters.DateRangeWordFilter(to_none=False),
             filters.DateFilter(to_none=False),
             filters.DateWordFilter(to_none=False),
             filters.CompanyFlightFilter(to_none=False),
@@ -48,6 +51,8 @@ class ParamsSearch(BaseSearch):
     def filters(self) -> list:
         return [
             filters.DirectionFilter(to_none=True),
+            filters.DateRangeFilter(to_none=True),
+            filters.DateRangeWordFilter(to_none=True),
             filters.DateFilter(to_none=True),
             filters.DateWordFilter(to_none=True),
             filters.AirportIataFilter(to_none=True),
@@ -57,6 +62,10 @@ class ParamsSearch(BaseSearch):
             filters.CompanyNameFilter(to_none=True),
         ]
 
+    def prepare_input(self, _s: str, /) -> list:
+        # words are matched one by one, so a period written with spaces is joined into one word first
+        return super().prepare_input(Regex.date_range_dash.value.sub('-', _s))
+
 
 def get_airport_city(iata: str, lang: Literal['ru', 'en'] = 'ru') -> str | None:
     if not isinstance(iata, str):
@@ -0,0 +1,134 @@
+import base64
+import struct
+import zlib
+from datetime import date, datetime, time, timedelta
+from typing import Type
+
+from . import quieries
+from ..constants import SVO_TIMEZONE
+from ..search_engine.mappings import compare_mapping
+
+
+class SearchStateCodec:
+    """ Компактная упаковка параметров поиска для передачи в `callback_data` """
+    epoch = date(2000, 1, 1)
+    raw_marker = 0xFF
+    directions = (None, 'arrival', 'departure')
+    # values of these fields can't be encoded, so the query fits only if they are left default
+    defaults = dict(page=0, limit=5, order='asc', gate_id=None, term_local=None)
+
+    _header = struct.Struct('>BBHB')
+    _direction_mask = 0b11
+    _has_company = 1 << 2
+    _has_number = 1 << 3
+    _has_country = 1 << 4
+    _has_destination = 1 << 5
+
+    def __init__(self, query_schema: Type[quieries.SaveFlightServiceQuery] = quieries.SaveFlightServiceQuery):
+        self.query_schema = query_schema
+        self.airports = self._intern(compare_mapping.ap_mapping)
+        self.companies = self._intern(compare_mapping.co_mapping)
+        self.countries = self._intern(compare_mapping.ct_mapping)
+        # changes of the interned tables invalidate states packed into already sent buttons
+        self.tag = zlib.crc32('|'.join(['1', *self.airports, *self.companies, *self.countries]).encode()) & 0xFF
+
+    @staticmethod
+    def _intern(mapping: dict) -> list[str]:
+        return sorted(mapping)[:0xFF]
+
+    def encode(self, query: dict, max_length: int | None = None) -> str | None:
+        try:
+            payload = self._pack(self.query_schema.model_validate(query).model_dump())
+        except (ValueError, struct.error):
+            return None
+
+        state = base64.urlsafe_b64encode(payload).rstrip(b'=').decode()
+        if max_length is not None and len(state) > max_length:
+            return None
+        return state
+
+    def decode(self, state: str) -> dict | None:
+        try:
+            payload = base64.urlsafe_b64decode(state + '=' * (-len(state) % 4))
+            query = self._unpack(payload)
+        except (ValueError, IndexError, struct.error):
+            return None
+        return self.query_schema(**query).model_dump()
+
+    def _pack(self, query: dict) -> bytes:
+        if any(query.get(field) != value for field, value in self.defaults.items()):
+            raise ValueError('Query has non default parameters')
+
+        date_start = query['date_start'].astimezone(SVO_TIMEZONE)
+        if date_start.time() != time():
+            raise ValueError('Date start is not a midnight')
+        span, rest = divmod(query['date_end'] - query['date_start'], timedelta(days=1))
+        if rest:
+            raise ValueError('Date range is not a whole number of days')
+
+        flags = self.directions.index(query.get('direction'))
+        body = bytearray()
+        if (company := query.get('company')) is not None:
+            flags |= self._has_company
+            body += self._pack_code(company, self.companies)
+        if (number := query.get('number')) is not None:
+            flags |= self._has_number
+            body += bytes([len(number)]) + number.encode('ascii')
+        if (country := query.get('country_name')) is not None:
+            flags |= self._has_country
+            body.append(self.countries.index(country))
+        if (destination := query.get('destination')) is not None:
+            flags |= self._has_destination
+            codes = destination.split(',')
+            body.append(len(codes))
+            for code in codes:
+                body += self._pack_code(code, self.airports)
+
+        header = self._header.pack(self.tag, flags, (date_start.date() - self.epoch).days, span)
+        return header + bytes(body)
+
+    def _unpack(self, payload: bytes) -> dict:
+        tag, flags, days, span = self._header.unpack_from(payload)
+        if tag != self.tag:
+            raise ValueError('State was packed with other tables')
+
+        date_start = datetime.combine(self.epoch + timedelta(days=days), time(), tzinfo=SVO_TIMEZONE)
+        query = dict(
+            direction=self.directions[flags & self._direction_mask],
+            date_start=date_start,
+            date_end=date_start + timedelta(days=span),
+        )
+
+        offset = self._header.size
+        if flags & self._has_company:
+            query['company'], offset = self._unpack_code(payload, offset, self.companies, size=2)
+        if flags & self._has_number:
+            length = payload[offset]
+            query['number'] = payload[offset + 1:offset + 1 + length].decode('ascii')
+            offset += 1 + length
+        if flags & self._has_country:
+            query['country_name'] = self.countries[payload[offset]]
+            offset += 1
+        if flags & self._has_destination:
+            count = payload[offset]
+            offset += 1
+            codes = []
+            for _ in range(count):
+                code, offset = self._unpack_code(payload, offset, self.airports, size=3)
+                codes.append(code)
+            query['destination'] = ','.join(codes)
+
+        if offset != len(payload):
+            raise ValueError('State has trailing bytes')
+        return query
+
+    def _pack_code(self, code: str, table: list[str]) -> bytes:
+        try:
+            return bytes([table.index(code)])
+        except ValueError:
+            return bytes([self.raw_marker]) + code.encode('ascii')
+
+    def _unpack_code(self, payload: bytes, offset: int, table: list[str], size: int) -> tuple[str, int]:
+        if payload[offset] != self.raw_marker:
+            return table[payload[offset]], offset + 1
+        return payload[offset + 1:offset + 1 + size].decode('ascii'), offset + 1 + size
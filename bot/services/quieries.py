@@ -1,4 +1,5 @@
 from datetime import timezone, timedelta
+from typing import Self
 
 from pydantic import field_validator, Field, AliasChoices, AwareDatetime
 
@@ -24,6 +25,16 @@ class FlightServiceQuery(api_quieries.FlightsQuery):
     def _as_timezone(cls, date: AwareDatetime) -> AwareDatetime:
         return date.astimezone(tz=timezone(timedelta(hours=3)))
 
+    def split_by_day(self) -> list[Self]:
+        """ Запросы по одному дню, на которые разбивается поиск за период """
+        days = []
+        date_start = self.date_start
+        while date_start < self.date_end:
+            date_end = min(date_start + timedelta(days=1), self.date_end)
+            days.append(self.model_copy(update=dict(date_start=date_start, date_end=date_end)))
+            date_start = date_end
+        return days or [self]
+
 
 class SaveFlightServiceQuery(FlightServiceQuery):
     """ Используется для сохранения параметров, которые не должны передаваться в запросе """
@@ -1,71 +1,258 @@
+import asyncio
 import math
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from itertools import islice
-from typing import Any, Type
+from typing import Any, Awaitable, Callable, Type
 
 from bot.api import (
     SvologEndpoint,
-    FlightEndpoint,
+    TruncatedResponse,
+    flight_endpoint,
+    is_unavailable,
     schemas as api_schemas,
 )
-from . import quieries
+from . import quieries, codecs
 from ..api.quieries import BaseQuery
-from ..database import storage
+from ..archive import FlightArchive, flight_archive
+from ..cache import LRUCache
+from ..constants import SVO_TIMEZONE
+from ..database import backends, base
+from ..metrics import metrics
+from ..settings import settings
+from ..snapshot import ScheduleSnapshot, schedule_snapshot
 
 
 class QueryService:
-    storage: storage.SearchQueryStorage
+    storage: base.BaseSearchQueryStorage
     api: SvologEndpoint
     query_schema: Type[BaseQuery]
     save_query_schema: Type[BaseQuery]
+    state_codec: codecs.SearchStateCodec
+    counts: LRUCache
+    flights: LRUCache | None = None
+    archive: FlightArchive | None = None
+    snapshot: ScheduleSnapshot | None = None
     paged_response: Type[api_schemas.PagedResponse] = api_schemas.PagedResponse
 
+    @classmethod
+    async def close(cls) -> None:
+        await cls.storage.close()
+
     @classmethod
     async def get_one_by_id(cls, id: Any) -> api_schemas.FlightSchema | None:
+        if cls.archive is not None and (item := cls.archive.get_one(id)) is not None:
+            return item
         try:
-            item = await cls.api.get_one_by_id(id=id)
+            item = await cls._or_snapshot(lambda: cls.api.get_one_by_id(id=id), lambda: cls.snapshot.get_one(id))
         except Exception:
             # todo log `not found flight`
             item = None
 
+        if item is not None:
+            cls.remember([item])
         return item
 
+    @classmethod
+    async def get_many_by_id(cls, ids: list[Any]) -> list[api_schemas.FlightSchema]:
+        items = await cls.api.get_many_by_id(ids=ids)
+        cls.remember(items)
+        return items
+
+    @classmethod
+    def remember(cls, items: list[api_schemas.FlightSchema]) -> None:
+        """ Свежие рейсы из API для списков, которым допустимы данные возрастом до `FLIGHT_CACHE_TTL` """
+        if cls.flights is None:
+            return
+        for item in items:
+            # flights from the snapshot are older than the cache allows
+            if item.snapshot_at is None:
+                cls.flights.set(str(item.id), item)
+
     @classmethod
     async def get_many(cls, **params) -> paged_response:
         query = cls.query_schema(**params)
-        response = await cls.api.get_many(query=query)
+        if len(days := query.split_by_day()) > 1:
+            return await cls._get_many_by_day(query, days)
+        return await cls._get_many(query)
+
+    @classmethod
+    async def _get_many(cls, query: BaseQuery) -> paged_response:
+        # past days are searched in the archive, their flights don't change anymore
+        if cls.archive is not None and (response := cls.archive.get_many(query)) is not None:
+            return response
+        return await cls._or_snapshot(lambda: cls.api.get_many(query=query), lambda: cls.snapshot.get_many(query))
+
+    @classmethod
+    async def _or_snapshot(cls, request: Callable[[], Awaitable], fallback: Callable[[], Any]) -> Any:
+        """ Ответ API, а пока API недоступен - ответ из снимка расписания, если снимок покрывает запрос """
+        if cls.snapshot is None:
+            return await request()
+        if cls.snapshot.is_offline and (response := fallback()) is not None:
+            return response
+        try:
+            return await request()
+        except Exception as error:
+            if not is_unavailable(error):
+                raise
+            cls.snapshot.mark_offline()
+            if (response := fallback()) is None:
+                raise
+            return response
+
+    @classmethod
+    async def _get_many_by_day(cls, query: BaseQuery, days: list[BaseQuery]) -> paged_response:
+        """ Поиск за период по дням: нужная страница собирается из страниц тех дней, на которые она приходится """
+        if query.order == 'desc':
+            days = days[::-1]
+        counts = await cls._gather(*map(cls._count, days))
+        totals = [count.total for count in counts]
+
+        start, end = query.page * query.limit, (query.page + 1) * query.limit
+        slices, pages = [], []
+        offset = 0
+        for day, total in zip(days, totals):
+            # positions of the requested page within the day
+            lo, hi = max(start - offset, 0), min(end - offset, total)
+            offset += total
+            if lo >= hi:
+                continue
+            first, last = lo // query.limit, (hi - 1) // query.limit
+            slices.append((len(pages), last - first + 1, lo - first * query.limit, hi - first * query.limit))
+            pages.extend(day.model_copy(update=dict(page=page)) for page in range(first, last + 1))
+
+        responses = await cls._gather(*map(cls._get_many, pages))
+        items = []
+        for index, size, lo, hi in slices:
+            day_items = [item for response in responses[index:index + size] for item in response.items]
+            items.extend(day_items[lo:hi])
+
+        total = sum(totals)
+        return cls.paged_response(
+            items=items,
+            count=len(items),
+            total=total,
+            page=query.page,
+            total_pages=math.ceil(total / query.limit),
+            snapshot_at=cls._snapshot_at(*counts, *responses),
+        )
+
+    @staticmethod
+    def _snapshot_at(*responses) -> datetime | None:
+        # a response put together from parts is as old as its oldest part from the snapshot
+        return min((response.snapshot_at for response in responses if response.snapshot_at is not None), default=None)
+
+    @staticmethod
+    async def _gather(*coros) -> list:
+        # sub-queries of a range search are fetched at once, but not all of them in parallel
+        semaphore = asyncio.Semaphore(settings.SEARCH_RANGE_CONCURRENCY)
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        return await asyncio.gather(*map(bounded, coros))
+
+    @classmethod
+    def count_key(cls, *exclude: str, **params) -> str:
+        """ Ключ запроса без параметров, которые не влияют на число найденных элементов """
+        return cls.query_schema(**params).model_dump_json(exclude={'page', 'limit', 'order', *exclude})
+
+    @classmethod
+    async def count(cls, **params) -> api_schemas.FlightCountResponse:
+        """ Только число найденных элементов, страница на него не влияет """
+        query = cls.query_schema(**params)
+        if len(days := query.split_by_day()) == 1:
+            return await cls._count(query)
+
+        counts = await cls._gather(*map(cls._count, days))
+        total = sum(count.total for count in counts)
+        return api_schemas.FlightCountResponse(
+            total=total,
+            id=next((count.id for count in counts if count.total), None) if total == 1 else None,
+            snapshot_at=cls._snapshot_at(*counts),
+        )
+
+    @classmethod
+    async def _count(cls, query: BaseQuery) -> api_schemas.FlightCountResponse:
+        if cls.archive is not None and (response := cls.archive.count(query)) is not None:
+            return response
+        key = query.model_dump_json(exclude={'page', 'limit', 'order'})
+        if (response := cls.counts.get(key)) is None:
+            response = await cls._or_snapshot(lambda: cls.api.count(query=query), lambda: cls.snapshot.count(query))
+            # counts from the snapshot are not cached, the next request tries the api again
+            if response.snapshot_at is None:
+                cls.counts.set(key, response)
         return response
 
     @classmethod
-    async def store_query(cls, query_dict: dict, message_id: int) -> None:
+    async def get_raw_items(cls, max_pages: int = 10, strict: bool = False, **params) -> list[dict]:
+        return await cls.api.get_raw_items(query=cls.query_schema(**params), max_pages=max_pages, strict=strict)
+
+    @classmethod
+    async def count_by_month(cls, year: int, month: int, **params) -> dict[int, int]:
+        """ Число рейсов по дням месяца одним постраничным запросом за весь месяц.
+        Если месяц не умещается в CALENDAR_MAX_PAGES страниц, каждый день считается отдельно """
+        date_start = datetime(year, month, 1, tzinfo=SVO_TIMEZONE)
+        date_end = (date_start + timedelta(days=31)).replace(day=1)
+        query = cls.query_schema(**params | dict(date_start=date_start, date_end=date_end))
+        try:
+            counts = await cls.api.count_by_day(query=query, max_pages=settings.CALENDAR_MAX_PAGES)
+        except TruncatedResponse:
+            metrics.incr('calendar.by_day')
+            days = query.split_by_day()
+            totals = await cls._gather(*map(cls._count, days))
+            return {day.date_start.day: count.total for day, count in zip(days, totals) if count.total}
+        return {day.day: count for day, count in counts.items() if (day.year, day.month) == (year, month)}
+
+    @classmethod
+    async def store_query(cls, query_dict: dict, chat_id: int, message_id: int) -> None:
         query = cls.save_query_schema.model_validate(query_dict)
         await cls.storage.upsert_one(
+            chat_id=chat_id,
             message_id=message_id,
             update=query.model_dump(by_alias=True),
         )
 
     @classmethod
-    async def get_query(cls, message_id: int) -> dict | None:
-        query_dict = await cls.storage.get_one(message_id=message_id)
+    async def get_query(cls, chat_id: int, message_id: int) -> dict | None:
+        query_dict = await cls.storage.get_one(chat_id=chat_id, message_id=message_id)
         if query_dict is None:
             return
         query = quieries.SaveFlightServiceQuery(**query_dict)
         return query.model_dump()
 
+    @classmethod
+    def encode_query(cls, query_dict: dict, max_length: int | None = None) -> str | None:
+        return cls.state_codec.encode(query_dict, max_length=max_length)
+
+    @classmethod
+    def decode_query(cls, state: str) -> dict | None:
+        return cls.state_codec.decode(state)
+
 
 class FlightQueryService(QueryService):
-    api = FlightEndpoint()
-    storage = storage.SearchQueryStorage(query_type='flight')
+    api = flight_endpoint
+    storage = backends.search_query_storage(query_type='flight')
     query_schema = quieries.FlightServiceQuery
     save_query_schema = quieries.SaveFlightServiceQuery
+    state_codec = codecs.SearchStateCodec(query_schema=quieries.SaveFlightServiceQuery)
+    counts = LRUCache(maxsize=settings.SEARCH_COUNT_CACHE_SIZE, ttl=settings.SEARCH_COUNT_TTL)
+    flights = LRUCache(maxsize=settings.FLIGHT_CACHE_SIZE, ttl=settings.FLIGHT_CACHE_TTL)
+    archive = flight_archive
+    snapshot = schedule_snapshot
     paged_response = api_schemas.PagedFlightResponse
 
 
 class FavoriteService:
     api: SvologEndpoint
-    storage: storage.FavoriteStorage
+    storage: base.BaseFavoriteStorage
+    query_service: Type[QueryService] | None = None
     paged_response: api_schemas.PagedResponse = api_schemas.PagedResponse
 
+    @classmethod
+    async def close(cls) -> None:
+        await cls.storage.close()
+
     @classmethod
     async def remove_one(cls, user_id, favorite_id: Any) -> None:
         await cls.storage.remove_favorite_one(user_id=user_id, favorite_id=favorite_id)
@@ -106,11 +293,37 @@ class FavoriteService:
     async def get_many(cls, user_id: int, page: int = 0, per_page: int = 5, sort_by: str | None = None,
                        **kwargs) -> paged_response:
         data = await cls.get_paged_ids(user_id=user_id, page=page, per_page=per_page, sort_by=sort_by)
-        data['items'] = await cls.api.get_many_by_id(ids=data['items'])
+        data['items'] = await cls.get_many_by_id(ids=data['items'])
+        if sort_by is not None:
+            data['items'].sort(key=lambda item: (getattr(item, sort_by) is None, getattr(item, sort_by)))
 
         paged_response = cls.paged_response.model_validate(data)
         return paged_response
 
+    @classmethod
+    async def get_many_by_id(cls, ids: list[Any]) -> list:
+        """ Элементы из архива и кэша `query_service`, одним запросом к API загружаются только остальные """
+        if cls.query_service is None:
+            return await cls.api.get_many_by_id(ids=ids)
+
+        archive, flights = cls.query_service.archive, cls.query_service.flights
+        found, missing = {}, []
+        for id in ids:
+            # completed flights don't change, the archive serves them regardless of age
+            if archive is not None and (item := archive.get_one(id)) is not None:
+                found[str(id)] = item
+            elif flights is not None and (item := flights.get(str(id))) is not None:
+                found[str(id)] = item
+            else:
+                missing.append(id)
+        metrics.incr('favorites.cached', len(found))
+        if missing:
+            metrics.incr('favorites.fetched', len(missing))
+            items = await cls.api.get_many_by_id(ids=missing)
+            cls.query_service.remember(items)
+            found.update((str(item.id), item) for item in items)
+        return [found[str(id)] for id in ids if str(id) in found]
+
     @classmethod
     def _obj_data(cls, **data) -> dict:
         obj = data | dict(
@@ -120,6 +333,42 @@ class FavoriteService:
 
 
 class FlightFavoriteService(FavoriteService):
-    api = FlightEndpoint()
-    storage = storage.FavoriteStorage(favorite_type='flight')
+    api = flight_endpoint
+    storage = backends.favorite_storage(favorite_type='flight')
+    query_service = FlightQueryService
     paged_response = api_schemas.PagedFlightResponse
+
+
+class SubscriptionService:
+    storage: base.BaseSubscriptionStorage
+
+    @classmethod
+    async def close(cls) -> None:
+        await cls.storage.close()
+
+    @classmethod
+    async def add_one(cls, chat_id: int, message_id: int, **data) -> None:
+        await cls.storage.add_one(chat_id=chat_id, message_id=message_id, subscription=data)
+
+    @classmethod
+    async def remove_one(cls, chat_id: int, message_id: int) -> None:
+        await cls.storage.remove_one(chat_id=chat_id, message_id=message_id)
+
+    @classmethod
+    async def get_all(cls) -> list[dict]:
+        return await cls.storage.get_all()
+
+
+class FlightSubscriptionService(SubscriptionService):
+    storage = backends.subscription_storage(subscription_type='flight')
+
+
+async def startup() -> None:
+    await backends.bootstrap()
+
+
+async def close() -> None:
+    await FlightQueryService.close()
+    await FlightFavoriteService.close()
+    await FlightSubscriptionService.close()
+    await backends.close()
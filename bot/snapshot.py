@@ -0,0 +1,237 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from .api import TruncatedResponse, flight_endpoint, schemas
+from .api.quieries import FlightsQuery
+from .constants import SVO_TIMEZONE
+from .metrics import metrics
+from .settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class Row:
+    flight_id: int
+    date: float
+    sked: float
+    direction: str
+    airport: str
+    company: str
+    number: str
+    gate_id: str
+    term_local: str
+
+
+class ScheduleSnapshot:
+    """ Снимок расписания текущего окна на диске. Пока API недоступен, поиск и рейсы отдаются из снимка """
+    def __init__(self, path: Path | None, fetch: Callable[[datetime, datetime], Awaitable[list[dict]]] | None = None,
+                 past: timedelta = timedelta(days=1), ahead: timedelta = timedelta(days=2), interval: float = 600,
+                 retry: float = 30):
+        self.path = path
+        self.past = past
+        self.ahead = ahead
+        self.interval = interval
+        self.retry = retry
+        self.created_at: datetime | None = None
+        self.window: tuple[datetime, datetime] | None = None
+        self._fetch = fetch
+        self._items: dict[int, dict] = {}
+        self._rows: list[Row] = []
+        self._offline_until = 0.0
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def is_offline(self) -> bool:
+        """ API недавно не ответил, запросы сразу отдаются из снимка до следующей попытки """
+        return time.monotonic() < self._offline_until
+
+    def mark_offline(self) -> None:
+        self._offline_until = time.monotonic() + self.retry
+        metrics.incr('snapshot.offline')
+
+    def mark_online(self) -> None:
+        self._offline_until = 0.0
+
+    @staticmethod
+    def _row(item: dict) -> Row:
+        other = item['mar1' if item['direction'] == 'arrival' else 'mar2']
+        return Row(
+            flight_id=item['id'],
+            date=datetime.fromisoformat(item['date']).timestamp(),
+            sked=datetime.fromisoformat(item.get('sked_local') or item['date']).timestamp(),
+            direction=item['direction'],
+            airport=other['iata'],
+            company=item['company']['iata'],
+            number=item['number'].upper().lstrip('0'),
+            gate_id=str(item.get('gate_id') or '').upper(),
+            term_local=str(item.get('term_local') or '').upper(),
+        )
+
+    def replace(self, items: list[dict], created_at: datetime, window: tuple[datetime, datetime]) -> None:
+        items_by_id, rows = {}, []
+        for item in items:
+            try:
+                rows.append(self._row(item))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+            items_by_id[item['id']] = item
+        # replaced at once, so readers in the loop never see a half built snapshot
+        self._items, self._rows, self.created_at, self.window = items_by_id, rows, created_at, window
+
+    def dump(self) -> bytes:
+        return zlib.compress(json.dumps(dict(
+            created_at=self.created_at.isoformat(),
+            window=[date.isoformat() for date in self.window],
+            items=list(self._items.values()),
+        ), ensure_ascii=False).encode())
+
+    def save(self, data: bytes) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            data = json.loads(zlib.decompress(self.path.read_bytes()))
+            window = tuple(datetime.fromisoformat(date) for date in data['window'])
+            self.replace(data['items'], created_at=datetime.fromisoformat(data['created_at']), window=window)
+        except (zlib.error, ValueError, TypeError, KeyError):
+            logger.warning(msg=f'Broken schedule snapshot {self.path}', exc_info=True)
+
+    async def sync(self) -> None:
+        """ Загружает окно по дням. Окно снимка заканчивается на последнем дне, загруженном полностью """
+        now = datetime.now(tz=SVO_TIMEZONE)
+        date_start = (now - self.past).replace(hour=0, minute=0, second=0, microsecond=0)
+        items, date_end = [], date_start
+        with metrics.timer('snapshot.sync'):
+            while date_end < now + self.ahead:
+                day_end = min(date_end + timedelta(days=1), now + self.ahead)
+                try:
+                    items.extend(await self._fetch(date_end, day_end))
+                except TruncatedResponse as error:
+                    logger.warning(msg=f'Schedule snapshot stops at {date_end}: {error}')
+                    metrics.incr('snapshot.truncated')
+                    break
+                date_end = day_end
+        # the previous snapshot is complete for its window, so it is kept if not even a day is fetched
+        if date_end > date_start:
+            self.replace(items, created_at=now, window=(date_start, date_end))
+            if self.path is not None:
+                # the snapshot is replaced only here, so it doesn't change while it is serialized in a thread
+                await asyncio.to_thread(self.save, await asyncio.to_thread(self.dump))
+        self.mark_online()
+        metrics.gauge('snapshot.size', len(self))
+
+    def covers(self, query: FlightsQuery) -> bool:
+        return self.window is not None and self.window[0] <= query.date_start and query.date_end <= self.window[1]
+
+    def _stamp(self, item: dict) -> schemas.FlightSchema:
+        return schemas.FlightSchema.model_validate(item | dict(snapshot_at=self.created_at))
+
+    def get_one(self, flight_id: int | str) -> schemas.FlightSchema | None:
+        try:
+            item = self._items.get(int(flight_id))
+        except (TypeError, ValueError):
+            return None
+        if item is None:
+            return None
+        metrics.incr('snapshot.served')
+        return self._stamp(item)
+
+    def _match(self, query: FlightsQuery) -> list[Row]:
+        destinations = set(query.destination.upper().split(',')) if query.destination else None
+        companies = set(query.company.upper().split(',')) if query.company else None
+        number = query.number.upper().lstrip('0') if query.number else None
+        date_start, date_end = query.date_start.timestamp(), query.date_end.timestamp()
+        rows = [
+            row for row in self._rows
+            if date_start <= row.date < date_end
+            and (query.direction is None or row.direction == query.direction)
+            and (destinations is None or row.airport in destinations)
+            and (companies is None or row.company in companies)
+            and (number is None or row.number == number)
+            and (query.gate_id is None or row.gate_id == query.gate_id.upper())
+            and (query.term_local is None or row.term_local == query.term_local.upper())
+        ]
+        return sorted(rows, key=lambda row: (row.sked, row.flight_id), reverse=query.order == 'desc')
+
+    def count(self, query: FlightsQuery) -> schemas.FlightCountResponse | None:
+        if not self.covers(query):
+            return None
+        rows = self._match(query)
+        metrics.incr('snapshot.served')
+        return schemas.FlightCountResponse(
+            total=len(rows),
+            id=rows[0].flight_id if len(rows) == 1 else None,
+            snapshot_at=self.created_at,
+        )
+
+    def get_many(self, query: FlightsQuery) -> schemas.PagedFlightResponse | None:
+        if not self.covers(query):
+            return None
+        rows = self._match(query)
+        page = rows[query.page * query.limit:(query.page + 1) * query.limit]
+        metrics.incr('snapshot.served')
+        return schemas.PagedFlightResponse(
+            items=[self._stamp(self._items[row.flight_id]) for row in page],
+            count=len(page),
+            total=len(rows),
+            page=query.page,
+            total_pages=math.ceil(len(rows) / query.limit),
+            snapshot_at=self.created_at,
+        )
+
+    async def start(self) -> None:
+        # the last snapshot is served right away, before the first sync is done
+        await asyncio.to_thread(self.load)
+        if self._fetch is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception(msg='Failed to sync schedule snapshot')
+            await asyncio.sleep(self.interval)
+
+
+async def fetch_window(date_start: datetime, date_end: datetime) -> list[dict]:
+    query = FlightsQuery(date_start=date_start, date_end=date_end)
+    return await flight_endpoint.get_raw_items(query=query, max_pages=settings.SNAPSHOT_MAX_PAGES, strict=True)
+
+
+schedule_snapshot = ScheduleSnapshot(
+    path=settings.SNAPSHOT_PATH,
+    fetch=fetch_window,
+    past=timedelta(days=settings.SNAPSHOT_PAST_DAYS),
+    ahead=timedelta(days=settings.SNAPSHOT_AHEAD_DAYS),
+    interval=settings.SNAPSHOT_INTERVAL,
+    retry=settings.SNAPSHOT_RETRY,
+)
@@ -1,6 +1,7 @@
-import re
+import json
 from abc import ABCMeta, abstractmethod
 from datetime import datetime
+from functools import cached_property
 from typing import Type
 
 from aiogram.enums.parse_mode import ParseMode
@@ -13,13 +14,20 @@ from . import (
     formatters,
 )
 from .api import schemas
+from .cache import LRUCache
 from .constants import (
     EMOJI,
     SVO_TIMEZONE,
     DIRECTION,
     GREETING
 )
+from .delays import DelaySummary, delay_stats
 from .search_engine import get_company_name, get_airport_city
+from .settings import settings
+
+
+_rendered_messages = LRUCache(maxsize=settings.RENDER_CACHE_SIZE)
+_keyboards = LRUCache(maxsize=settings.KEYBOARD_CACHE_SIZE)
 
 
 class BaseTemplate(metaclass=ABCMeta):
@@ -43,22 +51,6 @@ class BaseTemplate(metaclass=ABCMeta):
             d.pop(field, None)
         return d
 
-    def has_same_text(self, text: str) -> bool:
-        return text == re.sub(r'<.*?>', '', self.get_message()).strip()
-
-    def has_same_markup(self, markup: InlineKeyboardMarkup) -> bool:
-        new_kb = self.get_keyboard().inline_keyboard
-
-        try:
-            for x, line in enumerate(markup.inline_keyboard):
-                for y, btn in enumerate(line):
-                    if new_kb[x][y].text != btn.text:
-                        return False
-        except IndexError:
-            return False
-        else:
-            return True
-
 
 class StartCMDTemplate(BaseTemplate):
     def get_message(self) -> str:
@@ -71,9 +63,12 @@ class StartCMDTemplate(BaseTemplate):
 
 
 class SearchFlightTemplate(BaseTemplate):
-    def __init__(self, response: schemas.PagedFlightResponse, query: dict):
+    def __init__(self, response: schemas.FlightCountResponse, query: dict, state: str | None = None,
+                 occurrences: list[tuple[datetime, int]] = ()):
         self.response = response
         self.query = query
+        self.state = state
+        self.occurrences = occurrences
 
     def get_message(self) -> str:
         lines = [
@@ -81,6 +76,7 @@ class SearchFlightTemplate(BaseTemplate):
             self._message_company_line,
             self._message_destination_line,
             self._message_flight_count_line,
+            self._message_snapshot_line,
         ]
 
         line = '\n'.join(line for line in lines if line is not None).strip()
@@ -95,9 +91,15 @@ class SearchFlightTemplate(BaseTemplate):
 
         kb = InlineKeyboardBuilder()
         kb.add(*(btn for btn in buttons if btn is not None))
+        if self.occurrences:
+            kb.row(*self._keyboard_occurrence_btns)
 
         return kb.as_markup(resize_keyboard=resize_keyboard, **kwargs)
 
+    @cached_property
+    def text_digest(self) -> str:
+        return formatters.digest(self.get_message())
+
     @staticmethod
     def get_message_not_found() -> str:
         line = '{marker} По вашему запросу ничего не найдено'.format(
@@ -137,11 +139,17 @@ class SearchFlightTemplate(BaseTemplate):
 
         return line
 
+    @property
+    def _message_snapshot_line(self) -> str | None:
+        if self.response.snapshot_at is None:
+            return None
+        return '\n<i>{snapshot}</i>'.format(snapshot=formatters.fsnapshot(self.response.snapshot_at))
+
     @property
     def _keyboard_date_btn(self) -> InlineKeyboardButton:
         btn = InlineKeyboardButton(
-            text=formatters.fdate(self.query['date_start']),
-            callback_data=cd.SearchFlightCD(action=cd.SearchFlightAction.pick_date).pack(),
+            text=formatters.fdate_range(self.query['date_start'], self.query.get('date_end')),
+            callback_data=cd.SearchFlightCD(action=cd.SearchFlightAction.pick_date, state=self.state or '').pack(),
         )
         return btn
 
@@ -152,7 +160,8 @@ class SearchFlightTemplate(BaseTemplate):
         if (direction := self.query.get('direction')) is not None:
             btn = InlineKeyboardButton(
                 text=DIRECTION[direction].capitalize(),
-                callback_data=cd.SearchFlightCD(action=cd.SearchFlightAction.toggle_direction).pack(),
+                callback_data=cd.SearchFlightCD(action=cd.SearchFlightAction.toggle_direction,
+                                                state=self.state or '').pack(),
             )
 
         return btn
@@ -169,25 +178,36 @@ class SearchFlightTemplate(BaseTemplate):
         elif self.response.total == 1:
             btn = InlineKeyboardButton(
                 text='Показать',
-                callback_data=cd.FlightCD(action=cd.FlightAction.show, changelog=False, id=self.response.items[0].id).pack(),
+                callback_data=cd.FlightCD(action=cd.FlightAction.show, changelog=False, id=self.response.id).pack(),
             )
 
         return btn
 
+    @property
+    def _keyboard_occurrence_btns(self) -> list[InlineKeyboardButton]:
+        btns = [
+            InlineKeyboardButton(
+                text=f'{date.day:02}.{date.month:02} {formatters.ftime(date)}',
+                callback_data=cd.FlightCD(action=cd.FlightAction.show, changelog=False, id=flight_id).pack(),
+            )
+            for date, flight_id in self.occurrences
+        ]
+        return btns
+
     @property
     def _inline_query_text(self) -> str:
         if number := self.query.get('number'):
             query_text = ' '.join(filter(bool, (
                 self.query.get('company'),
                 number,
-                formatters.fdate(date=self.query.get('date_start'), placeholder=None),
+                formatters.fdate_range(self.query.get('date_start'), self.query.get('date_end'), placeholder=None),
             ))
                                   )
         else:
             query_text = ' '.join(filter(bool, (
                 self.query.get('country_name') or get_airport_city(self.query.get('destination')),
                 get_company_name(self.query.get('company') or ''),
-                formatters.fdate(date=self.query.get('date_start'), placeholder=None),
+                formatters.fdate_range(self.query.get('date_start'), self.query.get('date_end'), placeholder=None),
                 DIRECTION[direction] if (direction := self.query.get('direction')) else None,
             )))
         return query_text
@@ -214,17 +234,145 @@ class FavoriteFlightTemplate(BaseTemplate):
         return kb.as_markup(resize_keyboard=resize_keyboard, **kwargs)
 
 
+class AnalyticsTopTemplate(BaseTemplate):
+    sections = dict(
+        queries='Запросы',
+        flights='Рейсы',
+        destinations='Направления',
+    )
+
+    def __init__(self, top: dict[str, list[tuple[str, int]]]):
+        self.top = top
+
+    def get_message(self) -> str:
+        lines = []
+        for dimension, title in self.sections.items():
+            lines.append(f'<b><u>{title}:</u></b>')
+            lines.extend(
+                f'  <b>{count}</b>    {self._format_key(dimension, key)}' for key, count in self.top.get(dimension, [])
+            )
+            lines.append('')
+        return '\n'.join(lines).strip()
+
+    def get_keyboard(self, resize_keyboard=True, **kwargs) -> None:
+        return None
+
+    @staticmethod
+    def _format_key(dimension: str, key: str) -> str:
+        if dimension == 'flights':
+            return f'/flight {key}'
+        if dimension != 'queries':
+            return key
+
+        query = json.loads(key)
+        return ' '.join(filter(bool, (
+            DIRECTION[direction] if (direction := query.get('direction')) else None,
+            query.get('destination'),
+            query.get('company'),
+            query.get('number'),
+            formatters.fdate(datetime.fromisoformat(query['date_start']), placeholder=None),
+            f'стр. {query["page"]}' if query.get('page') else None,
+            f'по {query["limit"]}',
+        )))
+
+
+class MetricsTemplate(BaseTemplate):
+    def __init__(self, snapshot: dict):
+        self.snapshot = snapshot
+
+    def get_message(self) -> str:
+        lines = ['<b><u>Попадания:</u></b>']
+        lines.extend(f'  <b>{rate:.0%}</b>    {name}' for name, rate in sorted(self.snapshot['hit_rates'].items()))
+        lines.append('\n<b><u>Счетчики:</u></b>')
+        lines.extend(f'  <b>{value}</b>    {name}' for name, value in sorted(self.snapshot['counters'].items()))
+        lines.append('\n<b><u>Значения:</u></b>')
+        lines.extend(f'  <b>{value:g}</b>    {name}' for name, value in sorted(self.snapshot['gauges'].items()))
+        lines.append('\n<b><u>Время, мс</u></b> <i>(среднее / p95 / макс.)</i><b><u>:</u></b>')
+        lines.extend(
+            '  <b>{avg:.0f} / {p95:.0f} / {max:.0f}</b>    {name} <i>({count})</i>'.format(
+                name=name,
+                count=timing['count'],
+                **{key: timing[key] * 1000 for key in ('avg', 'p95', 'max')},
+            ) for name, timing in sorted(self.snapshot['timings'].items())
+        )
+        return '\n'.join(lines).strip()
+
+    def get_keyboard(self, resize_keyboard=True, **kwargs) -> None:
+        return None
+
+
+class DelayStatsTemplate(BaseTemplate):
+    def __init__(self, summary: DelaySummary | None, params: dict, ranking: list[tuple[str, int, float, float]] = ()):
+        self.summary = summary
+        self.params = params
+        self.ranking = ranking
+
+    def get_message(self) -> str:
+        lines = [self._message_title_line + '\n']
+        if self.summary is None:
+            lines.append('Нет данных о завершенных рейсах')
+        else:
+            lines.extend([
+                'Рейсов: <b>{count}</b>'.format(count=self.summary.count),
+                'Вовремя (до {minutes} мин): <b>{on_time:.0%}</b>'.format(
+                    minutes=settings.DELAYS_ON_TIME_MINUTES,
+                    on_time=self.summary.on_time,
+                ),
+                'Медиана задержки: <b>{median}</b>'.format(median=formatters.fdelay(self.summary.median)),
+                '90% рейсов: <b>до {p90}</b>'.format(p90=formatters.fdelay(self.summary.p90)),
+            ])
+        if self.ranking:
+            lines.append('\n<b><u>Авиакомпании:</u></b>')
+            lines.extend(
+                '  <b>{on_time:.0%}</b>    {company} <i>({count}, в среднем {mean})</i>'.format(
+                    on_time=on_time,
+                    company=get_company_name(company) or company,
+                    count=count,
+                    mean=formatters.fdelay(mean),
+                ) for company, count, on_time, mean in self.ranking
+            )
+        return '\n'.join(lines).strip()
+
+    def get_keyboard(self, resize_keyboard=True, **kwargs) -> None:
+        return None
+
+    @staticmethod
+    def get_message_usage() -> str:
+        return ('Укажите рейс, авиакомпанию или направление\n'
+                '<i>Например:</i> <code>/delays SU1152</code> или <code>/delays Сочи</code>')
+
+    @property
+    def _message_title_line(self) -> str:
+        p = self.params
+        parts = [
+            DIRECTION[direction] if (direction := p.get('direction')) else None,
+            f'{p.get("company") or ""}{p["number"]}' if p.get('number') else get_company_name(p.get('company')),
+            f'{get_airport_city(p["airport"]) or ""} <i>{p["airport"]}</i>' if p.get('airport') else None,
+        ]
+        return '<b><u>Пунктуальность:</u></b> ' + ' '.join(part for part in parts if part)
+
+
 class FlightTemplate(BaseTemplate):
-    def __init__(self, flight: schemas.FlightSchema, changelog: bool = False, is_favorite: bool = False):
+    def __init__(self, flight: schemas.FlightSchema, changelog: bool = False, is_favorite: bool = False,
+                 is_tracking: bool = False):
         self._changelog = changelog
         self._flight = flight
         self._is_favorite = is_favorite
+        self._is_tracking = is_tracking
+
+    @cached_property
+    def digest(self) -> str:
+        """ Зависит только от данных, по которым строится сообщение, поэтому считается без его построения """
+        # the delay line changes with the statistics, not with the flight
+        return formatters.digest(type(self).__name__, self._flight.version, self._changelog, self._is_favorite,
+                                 self._is_tracking, self._message_delay_line)
 
     @property
     def _keyboard_update_btn(self) -> InlineKeyboardButton:
         btn = InlineKeyboardButton(
             text='Обновить',
-            callback_data=cd.FlightCD(id=self._flight.id, changelog=self._changelog, action=cd.FlightAction.update).pack(),
+            callback_data=cd.FlightCD(id=self._flight.id, changelog=self._changelog, action=cd.FlightAction.update,
+                                      digest=self.digest).pack(),
         )
         return btn
 
@@ -232,7 +380,8 @@ class FlightTemplate(BaseTemplate):
     def _keyboard_favorite_btn(self) -> InlineKeyboardButton:
         btn = InlineKeyboardButton(
             text=EMOJI.white_heart if self._is_favorite is False else EMOJI.red_heart,
-            callback_data=cd.FlightCD(id=self._flight.id, changelog=self._changelog, action=cd.FlightAction.toggle_favorite).pack(),
+            callback_data=cd.FlightCD(id=self._flight.id, changelog=self._changelog,
+                                      action=cd.FlightAction.toggle_favorite, digest=self.digest).pack(),
         )
         return btn
 
@@ -240,7 +389,17 @@ class FlightTemplate(BaseTemplate):
     def _keyboard_change_btn(self) -> InlineKeyboardButton:
         btn = InlineKeyboardButton(
             text='Изменения',
-            callback_data=cd.FlightCD(id=self._flight.id, changelog=not self._changelog, action=cd.FlightAction.toggle_changelog).pack(),
+            callback_data=cd.FlightCD(id=self._flight.id, changelog=not self._changelog,
+                                      action=cd.FlightAction.toggle_changelog, digest=self.digest).pack(),
+        )
+        return btn
+
+    @property
+    def _keyboard_tracking_btn(self) -> InlineKeyboardButton:
+        btn = InlineKeyboardButton(
+            text=f'{EMOJI.bell} Следить' if self._is_tracking is False else f'{EMOJI.no_bell} Не следить',
+            callback_data=cd.FlightCD(id=self._flight.id, changelog=self._changelog,
+                                      action=cd.FlightAction.toggle_tracking, digest=self.digest).pack(),
         )
         return btn
 
@@ -253,19 +412,62 @@ class FlightTemplate(BaseTemplate):
         return btn
 
     def get_keyboard(self, resize_keyboard=True, **kwargs) -> InlineKeyboardMarkup:
+        # the digest covers version, changelog, favorite and tracking, so it identifies the markup as a whole
+        if resize_keyboard is not True or kwargs:
+            return self.build_keyboard(resize_keyboard=resize_keyboard, **kwargs)
+        key = (self._flight.id, self.digest)
+        if (markup := _keyboards.get(key)) is None:
+            markup = self.build_keyboard()
+            _keyboards.set(key, markup)
+        return markup
+
+    def build_keyboard(self, resize_keyboard=True, **kwargs) -> InlineKeyboardMarkup:
         buttons = [
             self._keyboard_update_btn,
             self._keyboard_favorite_btn,
             self._keyboard_change_btn,
-            self._keyboard_share_btn
         ]
+        # a completed flight doesn't change anymore, so there is nothing to track
+        if self._is_tracking or not self._flight.is_completed:
+            buttons.append(self._keyboard_tracking_btn)
+        buttons.append(self._keyboard_share_btn)
+
         kb = InlineKeyboardBuilder()
         kb.add(*buttons)
-        kb.adjust(3, 1)
+        kb.adjust(3, len(buttons) - 3)
         return kb.as_markup(resize_keyboard=resize_keyboard, **kwargs)
 
     def get_message(self) -> str:
-        raise NotImplemented
+        # favorite and tracking marks are on the keyboard only, the text depends on the flight and changelog
+        # and on the delay statistics, which change without the flight
+        key = (type(self).__name__, self._flight.id, self._flight.version, self._changelog, delay_stats.generation)
+        if (message := _rendered_messages.get(key)) is None:
+            message = self.render_message()
+            _rendered_messages.set(key, message)
+        return message
+
+    @abstractmethod
+    def render_message(self) -> str:
+        ...
+
+    @property
+    def _message_snapshot_line(self) -> str | None:
+        if self._flight.snapshot_at is None:
+            return None
+        return '<i>{snapshot}</i>'.format(snapshot=formatters.fsnapshot(self._flight.snapshot_at))
+
+    @property
+    def _message_delay_line(self) -> str | None:
+        summary = delay_stats.summary(number=self._flight.number, company=self._flight.company.iata,
+                                      direction=self._flight.direction)
+        if summary is None or summary.count < settings.DELAYS_MIN_COUNT:
+            return None
+        line = 'Вовремя: <b>{on_time:.0%}</b> <i>(медиана {median}, рейсов: {count})</i>'.format(
+            on_time=summary.on_time,
+            median=formatters.fdelay(summary.median),
+            count=summary.count,
+        )
+        return line
 
     @property
     def url(self) -> str:
@@ -276,13 +478,16 @@ class FlightTemplate(BaseTemplate):
 
     def get_inline_query_title(self) -> str:
         f = self._flight
-        description = '{time}  {city} {mar_iata}{favorite_mark}'.format(
-            favorite_mark=' ' + EMOJI.red_heart if self._is_favorite else '',
+        description = '{time}  {city} {mar_iata}'.format(
             time=formatters.ftime(f.sked_local),
             city=f.other_mar.city.name_ru,
             mar_iata=f.other_mar.iata,
         )
-        return description
+        return self.mark_favorite(description) if self._is_favorite else description
+
+    @staticmethod
+    def mark_favorite(title: str) -> str:
+        return title + ' ' + EMOJI.red_heart
 
     def get_inline_query_description(self) -> str:
         f = self._flight
@@ -295,6 +500,15 @@ class FlightTemplate(BaseTemplate):
         return title
 
     def get_inline_query_keyboard(self, resize_keyboard=True, **kwargs) -> InlineKeyboardMarkup:
+        if resize_keyboard is not True or kwargs:
+            return self.build_inline_query_keyboard(resize_keyboard=resize_keyboard, **kwargs)
+        key = (self._flight.id, 'inline')
+        if (markup := _keyboards.get(key)) is None:
+            markup = self.build_inline_query_keyboard()
+            _keyboards.set(key, markup)
+        return markup
+
+    def build_inline_query_keyboard(self, resize_keyboard=True, **kwargs) -> InlineKeyboardMarkup:
         kb = InlineKeyboardBuilder()
         kb.button(text='Поделиться', switch_inline_query=f'id_{self._flight.id}')
         kb.button(text='Перейти в Бот', url=self.url)
@@ -304,7 +518,7 @@ class FlightTemplate(BaseTemplate):
 
 
 class FlightArrivalTemplate(FlightTemplate):
-    def get_message(self) -> str:
+    def render_message(self) -> str:
         lines = [
             self._message_flight_num_line + '\n',
             self._message_destination_line,
@@ -315,6 +529,8 @@ class FlightArrivalTemplate(FlightTemplate):
             self._message_other_airport_line,
             self._message_local_airport_line,
             self._message_prb_line + '\n',
+            self._message_delay_line + '\n' if self._message_delay_line else None,
+            self._message_snapshot_line,
             ]
 
         if self._changelog:
@@ -443,7 +659,7 @@ class FlightArrivalTemplate(FlightTemplate):
 
 
 class FlightDepartureTemplate(FlightTemplate):
-    def get_message(self) -> str:
+    def render_message(self) -> str:
         lines = [
             self._message_flight_num_line + '\n',
             self._message_destination_line,
@@ -456,6 +672,8 @@ class FlightDepartureTemplate(FlightTemplate):
             self._message_otpr_line,
             self._message_local_airport_line,
             self._message_other_airport_line + '\n',
+            self._message_delay_line + '\n' if self._message_delay_line else None,
+            self._message_snapshot_line,
             ]
 
         if self._changelog:
@@ -612,3 +830,53 @@ class FlightDepartureTemplate(FlightTemplate):
                     )
                 )
         return changes
+
+
+class FlightChangesTemplate(BaseTemplate):
+    """ Уведомление подписчика об изменениях рейса """
+    fields = dict(
+        status='Статус',
+        term_local='Терминал',
+        gate_id='Выход на посадку',
+        chin_id='Стойки регистрации',
+        bbel_id='Выдача багажа',
+    )
+
+    def __init__(self, previous: schemas.FlightSchema, flight: schemas.FlightSchema):
+        self._previous = previous
+        self._flight = flight
+
+    @cached_property
+    def changes(self) -> list[tuple[str, str | None, str | None]]:
+        return [
+            (title, getattr(self._previous, field), getattr(self._flight, field))
+            for field, title in self.fields.items()
+            if getattr(self._previous, field) != getattr(self._flight, field)
+        ]
+
+    def get_keyboard(self, resize_keyboard=True, **kwargs) -> None:
+        return None
+
+    def get_message(self) -> str:
+        lines = [
+            '<b>{direction}  <u>{iata}{number} {date}</u></b>\n'.format(
+                direction=EMOJI.airplane_arrival if self._flight.direction == 'arrival' else EMOJI.airplane_departure,
+                iata=self._flight.company.iata,
+                number=self._flight.number,
+                date=formatters.fdate(self._flight.date),
+            ),
+            *('{title}: <s>{old}</s> {arrow} <b>{new}</b>'.format(
+                title=title,
+                old=old or '-',
+                arrow=EMOJI.arrow_right,
+                new=new or '-',
+            ) for title, old, new in self.changes),
+        ]
+        return '\n'.join(lines)
+
+
+def get_flight_template(flight: schemas.FlightSchema) -> Type[FlightTemplate]:
+    return dict(
+        arrival=FlightArrivalTemplate,
+        departure=FlightDepartureTemplate,
+    )[flight.direction]
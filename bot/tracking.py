@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import ReplyParameters
+
+from . import outbound, templates
+from .api import schemas
+from .api.schemas import ArrivalStatus, DepartureStatus
+from .metrics import metrics
+from .services import services
+from .settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+# seconds between polls of a flight, stages where gates and belts change are polled more often
+POLL_INTERVALS = dict(
+    arrival={
+        ArrivalStatus.base_status: 600,
+        ArrivalStatus.at_other: 300,
+        ArrivalStatus.at_local: 120,
+        ArrivalStatus.prb: 60,
+        ArrivalStatus.bbel_start: 60,
+    },
+    departure={
+        DepartureStatus.base_status: 600,
+        DepartureStatus.chin_start: 120,
+        DepartureStatus.chin_end: 60,
+        DepartureStatus.boarding_start: 60,
+        DepartureStatus.boarding_end: 60,
+        DepartureStatus.otpr: 120,
+        DepartureStatus.at_local: 300,
+    },
+)
+DEFAULT_POLL_INTERVAL = 600
+
+
+def poll_interval(flight: schemas.FlightSchema) -> float | None:
+    """ Через сколько секунд опросить рейс снова, `None` для завершенного рейса """
+    if flight.is_completed:
+        return None
+    return POLL_INTERVALS[flight.direction].get(flight.status, DEFAULT_POLL_INTERVAL)
+
+
+@dataclass
+class Subscription:
+    flight_id: int
+    chat_id: int
+    message_id: int
+    changelog: bool = False
+    is_favorite: bool = False
+    digest: str = ''  # digest of the message as it was last sent
+
+    @property
+    def key(self) -> tuple[int, int]:
+        return self.chat_id, self.message_id
+
+
+class FlightTracker:
+    """ Отслеживает рейсы подписчиков: каждый рейс опрашивается один раз на всех подписчиков,
+    сообщения правятся только при изменении их содержимого """
+    def __init__(self,
+                 fetch: Callable[[list[int]], Awaitable[list[schemas.FlightSchema]]],
+                 subscription_service: type[services.SubscriptionService],
+                 tick: float = 15, batch_size: int = 50):
+        self.tick = tick
+        self.batch_size = batch_size
+        self._fetch = fetch
+        self._service = subscription_service
+        self._subscriptions: dict[tuple[int, int], Subscription] = {}
+        self._subscribers: defaultdict[int, dict[tuple[int, int], Subscription]] = defaultdict(dict)
+        self._flights: dict[int, schemas.FlightSchema] = {}
+        self._due: dict[int, float] = {}
+        self._bot: Bot | None = None
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def is_tracking(self, chat_id: int, message_id: int) -> bool:
+        return (chat_id, message_id) in self._subscriptions
+
+    async def start(self, bot: Bot) -> None:
+        self._bot = bot
+        for data in await self._service.get_all():
+            self._add(Subscription(**data))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def subscribe(self, subscription: Subscription, flight: schemas.FlightSchema | None = None) -> None:
+        self._add(subscription)
+        if flight is not None and flight.id not in self._flights:
+            # the subscriber has just seen this flight, so the next poll isn't needed right away
+            self._flights[flight.id] = flight
+            self._due[flight.id] = time.monotonic() + (poll_interval(flight) or 0)
+        await self._service.add_one(**asdict(subscription))
+
+    async def unsubscribe(self, chat_id: int, message_id: int) -> Subscription | None:
+        subscription = self._subscriptions.pop((chat_id, message_id), None)
+        if subscription is None:
+            return None
+
+        subscribers = self._subscribers[subscription.flight_id]
+        subscribers.pop(subscription.key)
+        if not subscribers:
+            del self._subscribers[subscription.flight_id]
+            self._flights.pop(subscription.flight_id, None)
+            self._due.pop(subscription.flight_id, None)
+        self._update_gauges()
+
+        await self._service.remove_one(chat_id=chat_id, message_id=message_id)
+        return subscription
+
+    async def update(self, chat_id: int, message_id: int, **changes) -> None:
+        """ Сохраняет состояние сообщения подписчика, измененное вне трекера """
+        if (subscription := self._subscriptions.get((chat_id, message_id))) is None:
+            return
+        for field, value in changes.items():
+            setattr(subscription, field, value)
+        await self._service.add_one(**asdict(subscription))
+
+    async def poll(self) -> None:
+        now = time.monotonic()
+        due = [flight_id for flight_id, at in self._due.items() if at <= now]
+
+        for start in range(0, len(due), self.batch_size):
+            ids = due[start:start + self.batch_size]
+            with metrics.timer('tracking.fetch'):
+                flights = await self._fetch(ids)
+            metrics.incr('tracking.fetched', len(flights))
+
+            for flight_id in set(ids) - {flight.id for flight in flights}:
+                # the flight wasn't returned, don't ask for it on every tick
+                if flight_id in self._due:
+                    self._due[flight_id] = now + DEFAULT_POLL_INTERVAL
+            for flight in flights:
+                await self._apply(flight)
+
+    def _add(self, subscription: Subscription) -> None:
+        self._subscriptions[subscription.key] = subscription
+        self._subscribers[subscription.flight_id][subscription.key] = subscription
+        self._due.setdefault(subscription.flight_id, 0)
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        metrics.gauge('tracking.subscriptions', len(self._subscriptions))
+        metrics.gauge('tracking.flights', len(self._subscribers))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                with outbound.background():
+                    await self.poll()
+            except Exception:
+                logger.exception(msg='Failed to poll tracked flights')
+
+    async def _apply(self, flight: schemas.FlightSchema) -> None:
+        if flight.id not in self._subscribers:
+            return  # everyone unsubscribed while the flight was fetched
+
+        previous = self._flights.get(flight.id)
+        self._flights[flight.id] = flight
+        interval = poll_interval(flight)
+        if interval is not None:
+            self._due[flight.id] = time.monotonic() + interval
+
+        if previous is None or previous.version != flight.version:
+            changes = templates.FlightChangesTemplate(previous, flight) if previous is not None else None
+            for subscription in list(self._subscribers[flight.id].values()):
+                await self._push(subscription, flight, changes=changes, is_tracking=interval is not None)
+
+        if interval is None:
+            for subscription in list(self._subscribers.get(flight.id, {}).values()):
+                await self.unsubscribe(*subscription.key)
+
+    async def _push(self, subscription: Subscription, flight: schemas.FlightSchema,
+                    changes: templates.FlightChangesTemplate | None, is_tracking: bool) -> None:
+        template = templates.get_flight_template(flight)(
+            flight,
+            changelog=subscription.changelog,
+            is_favorite=subscription.is_favorite,
+            is_tracking=is_tracking,
+        )
+        if template.digest == subscription.digest:
+            return
+
+        try:
+            await self._bot.edit_message_text(
+                chat_id=subscription.chat_id,
+                message_id=subscription.message_id,
+                **template.as_kwargs(),
+            )
+            metrics.incr('tracking.edited')
+            if changes is not None and changes.changes:
+                await self._bot.send_message(
+                    chat_id=subscription.chat_id,
+                    reply_parameters=ReplyParameters(message_id=subscription.message_id,
+                                                     allow_sending_without_reply=True),
+                    **changes.as_kwargs(),
+                )
+                metrics.incr('tracking.notified')
+        except TelegramBadRequest as e:
+            if 'message is not modified' not in e.message:
+                # the message was deleted or can't be edited anymore
+                logger.warning(msg=f'Stop tracking flight {flight.id} for {subscription.key}: {e.message}')
+                await self.unsubscribe(*subscription.key)
+                return
+        except TelegramForbiddenError:
+            await self.unsubscribe(*subscription.key)
+            return
+
+        if subscription.key in self._subscriptions:
+            await self.update(*subscription.key, digest=template.digest)
+
+
+tracker = FlightTracker(
+    fetch=services.FlightQueryService.get_many_by_id,
+    subscription_service=services.FlightSubscriptionService,
+    tick=settings.TRACKING_TICK,
+    batch_size=settings.TRACKING_BATCH_SIZE,
+)
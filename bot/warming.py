@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from . import inline
+from .analytics import WindowedTopK, analytics
+from .api import schemas
+from .cache import LRUCache
+from .metrics import metrics
+from .services import services, quieries
+from .settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryWarmer:
+    """ Кэширует ответы на поисковые запросы и заранее обновляет ответы на самые частые из них,
+    частоты запросов ведет аналитика """
+    def __init__(self, fetch: Callable[..., Awaitable[schemas.PagedFlightResponse]], frequencies: WindowedTopK,
+                 count: Callable[..., Awaitable[schemas.FlightCountResponse]] | None = None, top_k: int = 50,
+                 ttl: float = 60, interval: float = 30, budget: int = 20, concurrency: int = 4, maxsize: int = 5000):
+        self.top_k = top_k
+        self.ttl = ttl
+        self.interval = interval
+        self.budget = budget
+        self.concurrency = concurrency
+        self.frequencies = frequencies
+        self._fetch = fetch
+        self._count = count or self._count_fetched
+        self._responses = LRUCache(maxsize=maxsize, ttl=ttl)
+        # prefetched summaries of follow-up searches, they need only the number of flights
+        self._counts = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: dict[str, asyncio.Task] = {}
+        self._hits = 0
+        self._misses = 0
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def key(query: dict) -> str:
+        return quieries.FlightServiceQuery(**query).model_dump_json()
+
+    def top(self) -> list[str]:
+        return [key for key, _ in self.frequencies.top(self.top_k)]
+
+    async def get_many(self, query: dict) -> schemas.PagedFlightResponse:
+        key = self.key(query)
+        if (cached := self._lookup(key)) is not None:
+            return cached
+        return await self._load(key, query)
+
+    async def get_count(self, query: dict) -> schemas.FlightCountResponse:
+        """ Сводка для сообщения поиска: из закэшированного ответа, иначе без загрузки самих рейсов """
+        key = self.key(query)
+        if (cached := self._lookup(key)) is not None:
+            return schemas.FlightCountResponse.from_paged(cached)
+        if (count := self._counts.get(key)) is not None:
+            metrics.incr('prefetch.hit')
+            return count
+        return await self._count(**query)
+
+    def _lookup(self, key: str) -> schemas.PagedFlightResponse | None:
+        self.frequencies.add(key)
+
+        if (cached := self._responses.get(key)) is not None:
+            self._hits += 1
+            metrics.incr('warming.hit')
+            if cached[2]:
+                metrics.incr('prefetch.hit')
+        else:
+            self._misses += 1
+            metrics.incr('warming.miss')
+        metrics.gauge('warming.hit_rate', self._hits / (self._hits + self._misses))
+
+        return cached[1] if cached is not None else None
+
+    async def prefetch(self, query: dict, ttl: float | None = None, summary: bool = False) -> None:
+        """ Загружает ответ заранее, не считая запрос сделанным пользователем.
+        Для сводки загружается только число рейсов """
+        key = self.key(query)
+        if key in self._responses or (summary and key in self._counts):
+            metrics.incr('prefetch.skipped')
+            return
+        if summary:
+            count = await self._count(**query)
+            if count.snapshot_at is None:
+                self._counts.set(key, count, ttl=ttl)
+        else:
+            await self._load(key, query, ttl=ttl, prefetched=True)
+        metrics.incr('prefetch.loaded')
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def warm(self) -> int:
+        """ Обновляет ответы частых запросов, которые устареют до следующего прогрева """
+        now = time.monotonic()
+        stale = [
+            key for key in self.top()
+            if (cached := self._responses.get(key)) is None or now - cached[0] >= self.ttl - self.interval
+        ][:self.budget]
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh(key: str) -> None:
+            async with semaphore:
+                try:
+                    response = await self._load(key, json.loads(key))
+                except Exception:
+                    logger.warning(msg=f'Failed to warm query {key}', exc_info=True)
+                    return
+            # inline rows are shared by all users, so they are rendered ahead as well
+            inline.renderer.render_many(response.items, favorites=set(), sender=False)
+
+        with metrics.timer('warming.warm'):
+            await asyncio.gather(*(refresh(key) for key in stale))
+        metrics.incr('warming.refreshed', len(stale))
+        return len(stale)
+
+    async def _count_fetched(self, **query) -> schemas.FlightCountResponse:
+        return schemas.FlightCountResponse.from_paged(await self._load(self.key(query), query))
+
+    async def _load(self, key: str, query: dict, ttl: float | None = None,
+                    prefetched: bool = False) -> schemas.PagedFlightResponse:
+        # concurrent misses of one query share a single upstream request
+        if (task := self._inflight.get(key)) is None:
+            task = self._inflight[key] = asyncio.create_task(self._fetch(**query))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        response = await asyncio.shield(task)
+        # answers from the offline snapshot are not kept, the next request tries the api again
+        if response.snapshot_at is None:
+            self._responses.set(key, (time.monotonic(), response, prefetched), ttl=ttl)
+        return response
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.warm()
+            except Exception:
+                logger.exception(msg='Failed to warm queries')
+
+
+warmer = QueryWarmer(
+    fetch=services.FlightQueryService.get_many,
+    frequencies=analytics.queries,
+    count=services.FlightQueryService.count,
+    top_k=settings.WARM_TOP_K,
+    ttl=settings.WARM_TTL,
+    interval=settings.WARM_INTERVAL,
+    budget=settings.WARM_BUDGET,
+    concurrency=settings.WARM_CONCURRENCY,
+)
@@ -3,25 +3,73 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
 from bot import handlers
+from bot.analytics import analytics
+from bot.archive import flight_archive
 from bot.connection import long_polling, webhook
+from bot.delays import delay_stats
 from bot.logger import logger
-from bot.middleware import LoggingMiddleware
+from bot.middleware import LoggingMiddleware, InlineQuerySupersedeMiddleware, UpdateConcurrencyMiddleware
+from bot.number_index import number_index
+from bot.outbound import OutboundScheduler
+from bot.prefetch import prefetcher
+from bot.services import services
 from bot.settings import settings
+from bot.snapshot import schedule_snapshot
+from bot.tracking import tracker
+from bot.warming import warmer
 
 
 async def bot_setup(bot: Bot) -> None:
     commands = [
         types.BotCommand(command='/start', description='Основное меню'),
         types.BotCommand(command='/favorite', description='Избранное'),
+        types.BotCommand(command='/delays', description='Пунктуальность рейсов'),
     ]
     await bot.set_my_commands(commands)
 
 
+async def bot_startup(bot: Bot) -> None:
+    await services.startup()
+    await schedule_snapshot.start()
+    await analytics.start()
+    await tracker.start(bot=bot)
+    await warmer.start()
+    await number_index.start()
+    await flight_archive.start()
+    await delay_stats.start()
+
+
+async def bot_shutdown() -> None:
+    await delay_stats.stop()
+    await flight_archive.stop()
+    await number_index.stop()
+    await prefetcher.stop()
+    await warmer.stop()
+    await tracker.stop()
+    await analytics.stop()
+    await schedule_snapshot.stop()
+    await services.close()
+
+
 def main() -> None:
     bot = Bot(token=settings.BOT_TOKEN.get_secret_value(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(OutboundScheduler(
+        rate=settings.OUTBOUND_RATE,
+        chat_rate=settings.OUTBOUND_CHAT_RATE,
+        group_rate=settings.OUTBOUND_GROUP_RATE,
+        chat_burst=settings.OUTBOUND_CHAT_BURST,
+        reserve=settings.OUTBOUND_RESERVE,
+    ))
 
     dp = Dispatcher()
+    dp.update.outer_middleware(UpdateConcurrencyMiddleware(
+        limit=settings.UPDATE_CONCURRENCY,
+        max_pending=settings.UPDATE_QUEUE_SIZE,
+    ))
     dp.update.middleware(LoggingMiddleware(logger=logger))
+    dp.inline_query.outer_middleware(InlineQuerySupersedeMiddleware(debounce=settings.INLINE_DEBOUNCE))
+    dp.startup.register(bot_startup)
+    dp.shutdown.register(bot_shutdown)
     dp.include_routers(
         handlers.router,
     )
@@ -0,0 +1,36 @@
+from copy import deepcopy
+
+
+FLIGHT_PAYLOAD = {
+    'id': 1000,
+    'orig_id': 2000,
+    'company': {'iata': 'SU', 'name': 'Аэрофлот', 'url_buy': None, 'url_register': None},
+    'mar1': {
+        'iata': 'SVO', 'icao': 'UUEE', 'code_ru': 'ШРМ', 'orig_id': 1, 'name': 'Sheremetyevo', 'name_ru': 'Шереметьево',
+        'city': {'name': 'Moscow', 'name_ru': 'Москва', 'timezone': 'Europe/Moscow',
+                 'country': {'name': 'Россия', 'region': None}},
+    },
+    'mar2': {
+        'iata': 'LED', 'icao': 'ULLI', 'code_ru': 'ПЛК', 'orig_id': 2, 'name': 'Pulkovo', 'name_ru': 'Пулково',
+        'city': {'name': 'Saint Petersburg', 'name_ru': 'Санкт-Петербург', 'timezone': 'Europe/Moscow',
+                 'country': {'name': 'Россия', 'region': None}},
+    },
+    'aircraft': {'name': 'A320', 'orig_id': 10},
+    'direction': 'departure',
+    'number': '0010',
+    'date': '2024-12-20T00:00:00+03:00',
+    'sked_local': '2024-12-20T10:00:00+03:00',
+    'sked_other': '2024-12-20T11:30:00+03:00',
+    'term_local': 'B',
+    'gate_id': '21',
+    'chin_id': '101-110',
+    'bbel_id': None,
+    'created_at': '2024-12-19T00:00:00+00:00',
+    'changelog': [
+        {'field': 'gate_id', 'old_value': '20', 'created_at': '2024-12-20T05:00:00+00:00'},
+    ],
+}
+
+
+def flight_payload(**overrides) -> dict:
+    return deepcopy(FLIGHT_PAYLOAD) | overrides
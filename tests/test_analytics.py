@@ -0,0 +1,58 @@
+import json
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from bot.analytics import Analytics, CountMinSketch, HeavyHitters, WindowedTopK
+
+
+class TestCountMinSketch(TestCase):
+    def test_estimate_never_underestimates(self):
+        sketch = CountMinSketch(width=64, depth=4)
+        for i in range(500):
+            sketch.add(f'key{i % 100}')
+
+        for i in range(100):
+            self.assertGreaterEqual(sketch.estimate(f'key{i}'), 5)
+
+
+class TestHeavyHitters(TestCase):
+    def test_keeps_most_frequent_keys(self):
+        hitters = HeavyHitters(k=3)
+        for key, count in (('AER', 10), ('LED', 8), ('KGD', 6), ('MRV', 1), ('OVB', 2)):
+            for _ in range(count):
+                hitters.add(key)
+
+        self.assertSetEqual(set(hitters.counts), {'AER', 'LED', 'KGD'})
+
+
+class TestWindowedTopK(TestCase):
+    @patch('bot.analytics.time.time')
+    def test_old_windows_are_forgotten(self, now):
+        top = WindowedTopK(k=5, window=60, windows=2)
+        now.return_value = 0
+        top.add('AER', 5)
+        now.return_value = 60
+        top.add('LED', 3)
+
+        self.assertListEqual(top.top(), [('AER', 5), ('LED', 3)])
+        now.return_value = 120
+        self.assertListEqual(top.top(), [('LED', 3)])
+
+
+class TestAnalytics(TestCase):
+    def test_snapshot_restored_after_restart(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'analytics.json'
+            analytics = Analytics(path=path)
+            analytics.record_destinations('AER,LED')
+            analytics.record_flight(1000)
+            analytics.save(analytics.snapshot())
+
+            restarted = Analytics(path=path)
+            restarted.load()
+
+            self.assertListEqual(restarted.flights.top(), [('1000', 1)])
+            self.assertCountEqual(restarted.destinations.top(), [('AER', 1), ('LED', 1)])
+            self.assertIn('flights', json.loads(path.read_text()))
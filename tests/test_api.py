@@ -0,0 +1,21 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import Mock
+
+from bot.api import FlightEndpoint, flight_endpoint
+from bot.settings import settings
+
+
+class TestFlightEndpoint(IsolatedAsyncioTestCase):
+    async def test_timeout_passed_to_every_request(self):
+        endpoint = FlightEndpoint(timeout=2.5)
+        endpoint.session = Mock()
+        endpoint.session.get.return_value.json.return_value = dict(total=0, total_pages=0, items=[])
+        endpoint.session.post.return_value.json.return_value = []
+
+        await endpoint.count(query=Mock())
+        await endpoint.get_raw_items(query=Mock())
+        await endpoint.get_many_by_id([1])
+
+        for call in endpoint.session.get.call_args_list + endpoint.session.post.call_args_list:
+            self.assertEqual(call.kwargs['timeout'], 2.5)
+        self.assertEqual(flight_endpoint.timeout, settings.API_TIMEOUT)
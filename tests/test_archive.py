@@ -0,0 +1,90 @@
+import tempfile
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from bot.api import TruncatedResponse
+from bot.api.quieries import FlightsQuery
+from bot.archive import FlightArchive
+from bot.constants import SVO_TIMEZONE
+from tests.samples import flight_payload
+
+
+DAY = date(2024, 12, 20)
+
+
+def completed(id: int, **overrides) -> dict:
+    return flight_payload(id=id, at_other='2024-12-20T11:40:00+03:00', **overrides)
+
+
+def query(**params) -> FlightsQuery:
+    date_start = datetime(2024, 12, 20, tzinfo=SVO_TIMEZONE)
+    return FlightsQuery(date_start=date_start, date_end=date_start + timedelta(days=1), **params)
+
+
+class TestFlightArchive(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = Path(self.tmp_dir.name)
+        self.day_items = [
+            completed(1, sked_local='2024-12-20T12:00:00+03:00'),
+            completed(2, sked_local='2024-12-20T09:00:00+03:00', number='1152'),
+            completed(3, company={'iata': 'FV', 'name': 'Россия'}),
+        ]
+        self.archive = self.open_archive()
+
+    def open_archive(self) -> FlightArchive:
+        archive = FlightArchive(path=self.path, fetch_day=AsyncMock(return_value=self.day_items))
+        archive.load()
+        self.addCleanup(lambda: [segment.close() for segment in archive._segments.values()])
+        return archive
+
+    def test_only_completed_flights_archived(self):
+        self.archive.observe([completed(10), flight_payload(id=11)])
+        self.archive.write(self.archive.take_pending())
+
+        self.assertEqual(self.archive.get_one('10').id, 10)
+        self.assertEqual(len(self.archive.get_one(10).gate_id_log), 2)
+        self.assertIsNone(self.archive.get_one(11))
+
+    async def test_sealed_day_searched_locally(self):
+        self.assertIsNone(self.archive.get_many(query()))
+        await self.archive.seal(DAY)
+
+        response = self.archive.get_many(query(company='SU', limit=1, page=1))
+        self.assertEqual((response.total, response.total_pages, [f.id for f in response.items]), (2, 2, [1]))
+        self.assertEqual(self.archive.count(query(number='1152')).id, 2)
+        self.assertEqual(self.archive.count(query(direction='arrival')).total, 0)
+        self.assertIsNone(self.archive.count(query(gate_id='21')))
+
+    async def test_reopened_archive_keeps_flights(self):
+        await self.archive.seal(DAY)
+        reopened = self.open_archive()
+
+        self.assertEqual(reopened.get_many(query()).total, 3)
+        self.assertEqual(reopened.get_one(3).company.iata, 'FV')
+        self.assertNotIn(DAY, reopened.unsealed(today=DAY + timedelta(days=2)))
+
+    async def test_incomplete_day_not_sealed(self):
+        self.archive._fetch_day.side_effect = TruncatedResponse(total=3500, fetched=3000)
+        self.assertFalse(await self.archive.seal(DAY))
+
+        self.archive._fetch_day.side_effect = None
+        self.day_items.append(completed(4, direction=None))
+        self.assertFalse(await self.archive.seal(DAY))
+        self.assertIsNone(self.archive.get_many(query()))
+        self.assertIn(DAY, self.archive.unsealed(today=DAY + timedelta(days=2)))
+        # failures are counted, so the other unsealed days are tried first
+        self.assertEqual(self.archive._failures[DAY], 2)
+
+    def test_cut_record_ignored_and_overwritten(self):
+        self.archive.write([completed(1)])
+        segment_path = self.path / f'{DAY.isoformat()}.seg'
+        with open(segment_path, 'ab') as file:
+            file.write(b'\x00' * 10)
+
+        reopened = self.open_archive()
+        reopened.write([completed(2)])
+        self.assertEqual(self.open_archive().get_one(2).id, 2)
@@ -0,0 +1,37 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from bot.cache import LRUCache
+
+
+class TestLRUCache(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    @patch('bot.cache.time.monotonic')
+    def test_expired_value_return_default(self, monotonic):
+        cache = LRUCache(maxsize=2, ttl=10)
+        monotonic.return_value = 100
+        cache.set('a', 1)
+
+        monotonic.return_value = 109
+        self.assertEqual(cache.get('a'), 1)
+        monotonic.return_value = 110
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_pop(self):
+        cache = LRUCache()
+        cache.set('a', 1)
+
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.pop('a', 'default'), 'default')
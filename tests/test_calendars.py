@@ -0,0 +1,60 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from aiogram_calendar import SimpleCalendarCallback
+from aiogram_calendar.schemas import SimpleCalAct
+
+from bot.calendars import FlightCalendar
+
+
+def day_texts(markup) -> dict[int, str]:
+    texts = {}
+    for row in markup.inline_keyboard:
+        for btn in row:
+            if btn.callback_data != FlightCalendar.ignore_callback:
+                data = SimpleCalendarCallback.unpack(btn.callback_data)
+                if data.act == SimpleCalAct.day:
+                    texts[data.day] = btn.text
+    return texts
+
+
+class TestFlightCalendar(IsolatedAsyncioTestCase):
+    def setUp(self):
+        FlightCalendar.markups.clear()
+
+    async def test_days_annotated_with_counts(self):
+        calendar = FlightCalendar(key='LED', count_by_month=AsyncMock(return_value={3: 12, 4: 0}))
+        texts = day_texts(await calendar.start_calendar(year=2024, month=2))
+
+        self.assertEqual(texts[3], '3¹²')
+        self.assertEqual(texts[4], '4')
+        self.assertEqual(len(texts), 29)
+
+    async def test_month_markup_cached_per_query(self):
+        count_by_month = AsyncMock(return_value={1: 5})
+        markup = await FlightCalendar(key='LED', count_by_month=count_by_month).start_calendar(year=2024, month=2)
+
+        self.assertIs(await FlightCalendar(key='LED', count_by_month=count_by_month).start_calendar(2024, 2), markup)
+        await FlightCalendar(key='AER', count_by_month=count_by_month).start_calendar(year=2024, month=2)
+        self.assertEqual(count_by_month.await_count, 2)
+
+    async def test_failed_counts_fall_back_to_plain_calendar(self):
+        count_by_month = AsyncMock(side_effect=ConnectionError)
+        calendar = FlightCalendar(key='LED', count_by_month=count_by_month)
+
+        self.assertEqual(day_texts(await calendar.start_calendar(year=2024, month=2))[1], '1')
+        await calendar.start_calendar(year=2024, month=2)
+        self.assertEqual(count_by_month.await_count, 2)
+
+    async def test_slow_counts_cached_in_background(self):
+        async def count_by_month(year: int, month: int) -> dict[int, int]:
+            await asyncio.sleep(0.05)
+            return {2: 7}
+
+        calendar = FlightCalendar(key='LED', count_by_month=AsyncMock(side_effect=count_by_month), timeout=0.01)
+        self.assertEqual(day_texts(await calendar.start_calendar(year=2024, month=2))[2], '2')
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(day_texts(await calendar.start_calendar(year=2024, month=2))[2], '2⁷')
+        self.assertEqual(calendar.count_by_month.await_count, 1)
@@ -31,3 +31,19 @@ class TestSettings(TestCase):
                 WEBHOOK_ENDPOINT=None,
                 WEBHOOK_BASE=None,
             )))
+
+    def test_db_mandatory_unset_raises(self):
+        with self.assertRaisesRegex(ValueError, expected_regex='.*DB_HOST, DB_PASSWORD must be set'):
+            Settings(**(valid_payload | dict(
+                DB_HOST=None,
+                DB_PASSWORD=None,
+            )))
+
+    def test_sqlite_backend_without_db_variables(self):
+        Settings(**(valid_payload | dict(
+            STORAGE_BACKEND='sqlite',
+            DB_HOST=None,
+            DB_PORT=None,
+            DB_USERNAME=None,
+            DB_PASSWORD=None,
+        )))
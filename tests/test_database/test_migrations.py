@@ -0,0 +1,51 @@
+from collections import defaultdict
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import MagicMock
+
+from bot.database.migrations import MigrationRegistry
+
+
+class FakeMarkers:
+    def __init__(self, versions: dict | None = None):
+        self.versions = versions or {}
+
+    def find_one(self, filter: dict) -> dict | None:
+        if filter['_id'] in self.versions:
+            return dict(_id=filter['_id'], version=self.versions[filter['_id']])
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False) -> None:
+        self.versions[filter['_id']] = update['$set']['version']
+
+
+class FakeDatabase(defaultdict):
+    def __init__(self, markers: FakeMarkers):
+        super().__init__(MagicMock)
+        self['migrations'] = markers
+
+
+class TestMigrationRegistry(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.registry = MigrationRegistry()
+        self.applied = []
+
+        for collection, version in [('first', 2), ('first', 1), ('second', 1)]:
+            self.registry.register(collection, version)(
+                lambda c, collection=collection, version=version: self.applied.append((collection, version))
+            )
+
+    async def test_apply_in_version_order(self):
+        markers = FakeMarkers()
+        await self.registry.apply(FakeDatabase(markers))
+
+        self.assertEqual([m for m in self.applied if m[0] == 'first'], [('first', 1), ('first', 2)])
+        self.assertIn(('second', 1), self.applied)
+        self.assertDictEqual(markers.versions, dict(first=2, second=1))
+
+    async def test_skip_applied_versions(self):
+        await self.registry.apply(FakeDatabase(FakeMarkers(dict(first=1, second=1))))
+
+        self.assertEqual(self.applied, [('first', 2)])
+
+    def test_register_same_version_raises(self):
+        with self.assertRaises(ValueError):
+            self.registry.register('first', 1)(lambda c: None)
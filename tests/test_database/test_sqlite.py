@@ -0,0 +1,78 @@
+import tempfile
+from datetime import datetime, timezone
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase
+
+from bot.database.sqlite import SqliteDatabase, SqliteSearchQueryStorage, SqliteFavoriteStorage, \
+    SqliteSubscriptionStorage
+
+
+class SqliteTestCase(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.database = SqliteDatabase(path=Path(self.tmp_dir.name) / 'test.sqlite3')
+
+    async def asyncTearDown(self):
+        await self.database.close()
+        self.tmp_dir.cleanup()
+
+
+class TestSqliteSearchQueryStorage(SqliteTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.storage = SqliteSearchQueryStorage(query_type='flight', database=self.database)
+
+    async def test_upsert_and_find(self):
+        date = datetime(2024, 12, 20, tzinfo=timezone.utc)
+        await self.storage.upsert_one(chat_id=1, message_id=10, update=dict(direction='arrival', date_start=date))
+        await self.storage.upsert_one(chat_id=2, message_id=10, update=dict(direction='departure'))
+        await self.storage.close()
+
+        first = await self.storage.find_one(chat_id=1, message_id=10)
+        self.assertEqual(first['direction'], 'arrival')
+        self.assertEqual(datetime.fromisoformat(first['date_start']), date)
+        self.assertEqual((await self.storage.find_one(chat_id=2, message_id=10))['direction'], 'departure')
+        self.assertIsNone(await self.storage.find_one(chat_id=3, message_id=10))
+
+    async def test_get_one_served_before_flush(self):
+        await self.storage.upsert_one(chat_id=1, message_id=10, update=dict(direction='arrival'))
+
+        self.assertEqual((await self.storage.get_one(chat_id=1, message_id=10))['direction'], 'arrival')
+        await self.storage.close()
+
+
+class TestSqliteFavoriteStorage(SqliteTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.storage = SqliteFavoriteStorage(favorite_type='flight', database=self.database)
+
+    async def test_add_keeps_first_object(self):
+        await self.storage.add_favorite_one(user_id=1, favorite_id=100, favorite_obj=dict(sked_local=1.0))
+        await self.storage.add_favorite_one(user_id=1, favorite_id=100, favorite_obj=dict(sked_local=2.0))
+
+        self.assertDictEqual(await self.storage.get_favorites_all(user_id=1), {'100': dict(sked_local=1.0)})
+
+    async def test_remove_and_is_favorite(self):
+        await self.storage.add_favorite_one(user_id=1, favorite_id=100, favorite_obj={})
+        self.assertTrue(await self.storage.is_favorite(user_id=1, favorite_id=100))
+        self.assertFalse(await self.storage.is_favorite(user_id=2, favorite_id=100))
+
+        await self.storage.remove_favorite_one(user_id=1, favorite_id=100)
+        self.assertFalse(await self.storage.is_favorite(user_id=1, favorite_id=100))
+        self.assertDictEqual(await self.storage.get_favorites_all(user_id=1), {})
+
+
+class TestSqliteSubscriptionStorage(SqliteTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.storage = SqliteSubscriptionStorage(subscription_type='flight', database=self.database)
+
+    async def test_add_replaces_and_remove(self):
+        await self.storage.add_one(chat_id=1, message_id=10, subscription=dict(flight_id=100, changelog=False))
+        await self.storage.add_one(chat_id=1, message_id=10, subscription=dict(flight_id=100, changelog=True))
+        await self.storage.add_one(chat_id=2, message_id=10, subscription=dict(flight_id=200))
+
+        self.assertListEqual(await self.storage.get_all(), [dict(flight_id=100, changelog=True), dict(flight_id=200)])
+
+        await self.storage.remove_one(chat_id=1, message_id=10)
+        self.assertListEqual(await self.storage.get_all(), [dict(flight_id=200)])
@@ -0,0 +1,81 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from bot.database.write_behind import WriteBehindQueue
+
+
+class TestWriteBehindQueue(IsolatedAsyncioTestCase):
+    async def test_coalesce_writes_of_same_key(self):
+        flush = AsyncMock()
+        queue = WriteBehindQueue(name='test', flush=flush, interval=0.01)
+        queue.put('a', 1)
+        queue.put('b', 2)
+        queue.put('a', 3)
+
+        self.assertEqual(queue.get('a'), 3)
+        await asyncio.sleep(0.05)
+
+        flush.assert_awaited_once_with([('a', 3), ('b', 2)])
+        self.assertEqual(len(queue), 0)
+        await queue.close()
+
+    async def test_flush_in_batches_when_full(self):
+        flush = AsyncMock()
+        queue = WriteBehindQueue(name='test', flush=flush, interval=10, max_batch=2)
+        for key in range(3):
+            queue.put(key, key)
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(flush.await_count, 2)
+        await queue.close()
+
+    async def test_close_flushes_pending(self):
+        flush = AsyncMock()
+        queue = WriteBehindQueue(name='test', flush=flush, interval=10)
+        queue.put('a', 1)
+        await queue.close()
+
+        flush.assert_awaited_once_with([('a', 1)])
+
+    async def test_failed_flush_keeps_writes(self):
+        flush = AsyncMock(side_effect=[ConnectionError, None])
+        queue = WriteBehindQueue(name='test', flush=flush, interval=10)
+        queue.put('a', 1)
+        await queue.flush()
+        self.assertEqual(queue.get('a'), 1)
+
+        await queue.close()
+        self.assertEqual(len(queue), 0)
+
+    async def test_close_during_flush_keeps_batch(self):
+        started, release = asyncio.Event(), asyncio.Event()
+        flushed = []
+
+        async def flush(batch):
+            started.set()
+            await release.wait()
+            flushed.extend(batch)
+
+        queue = WriteBehindQueue(name='test', flush=flush, interval=0)
+        queue.put('a', 1)
+        await started.wait()
+        queue.put('b', 2)
+
+        close = asyncio.create_task(queue.close())
+        await asyncio.sleep(0.01)
+        release.set()
+        await close
+        self.assertEqual(flushed, [('a', 1), ('b', 2)])
+        self.assertEqual(len(queue), 0)
+
+    async def test_cancelled_flush_requeues_batch(self):
+        flush = AsyncMock(side_effect=[asyncio.CancelledError, None])
+        queue = WriteBehindQueue(name='test', flush=flush, interval=10)
+        queue.put('a', 1)
+        with self.assertRaises(asyncio.CancelledError):
+            await queue.flush()
+        self.assertEqual(queue.get('a'), 1)
+
+        await queue.close()
+        flush.assert_awaited_with([('a', 1)])
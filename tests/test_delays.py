@@ -0,0 +1,74 @@
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import TestCase
+
+from bot.constants import SVO_TIMEZONE
+from bot.delays import DelayStats
+from tests.samples import flight_payload
+
+
+class TestDelayStats(TestCase):
+    def setUp(self):
+        self.now = datetime.now(tz=SVO_TIMEZONE).replace(microsecond=0)
+        self.stats = DelayStats(path=None, on_time=15)
+
+    def payload(self, id: int, delay: int, days: int = 1, **overrides) -> dict:
+        sked_local = self.now - timedelta(days=days)
+        return flight_payload(
+            id=id,
+            sked_local=sked_local.isoformat(),
+            at_local=(sked_local + timedelta(minutes=delay)).isoformat(),
+            at_other=(sked_local + timedelta(minutes=delay + 90)).isoformat(),
+        ) | overrides
+
+    def test_summary_by_number(self):
+        self.stats.observe([self.payload(id, delay) for id, delay in enumerate((0, 5, 10, 20, 60), start=1)])
+        self.stats.compact()
+
+        summary = self.stats.summary(number='10', company='SU', direction='departure')
+        self.assertEqual(summary.count, 5)
+        self.assertEqual(summary.median, 10)
+        self.assertAlmostEqual(summary.on_time, 0.6)
+        self.assertIsNone(self.stats.summary(number='11'))
+        self.assertIsNone(self.stats.summary(direction='arrival'))
+
+    def test_incomplete_and_repeated_flights_ignored(self):
+        self.stats.observe([self.payload(1, 30), self.payload(1, 30), self.payload(2, 0, at_other=None)])
+        self.stats.compact()
+        self.stats.observe([self.payload(1, 30)])
+
+        self.assertEqual(self.stats.compact(), 0)
+        self.assertEqual(len(self.stats), 1)
+
+    def test_old_flights_pruned(self):
+        self.stats.history = 30
+        self.stats.observe([self.payload(1, 0, days=40), self.payload(2, 0)])
+        self.stats.compact()
+
+        self.assertEqual(self.stats.ids.tolist(), [2])
+
+    def test_rank_companies(self):
+        self.stats.observe([
+            self.payload(1, 0), self.payload(2, 30),
+            self.payload(3, 0, company={'iata': 'FV'}),
+        ])
+        self.stats.compact()
+
+        self.assertEqual(self.stats.rank('company', airport='LED'), [('SU', 2, 0.5, 15.0), ('FV', 1, 1.0, 0.0)])
+        self.assertEqual(self.stats.rank('company', min_count=2), [('SU', 2, 0.5, 15.0)])
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'delays.npz'
+            self.stats.path = path
+            self.stats.observe([self.payload(1, 40), self.payload(2, 0, company={'iata': 'FV'})])
+            self.stats.compact()
+            self.stats.save(self.stats.snapshot())
+
+            stats = DelayStats(path=path)
+            stats.load()
+            self.assertEqual(stats.summary(company='FV').count, 1)
+            self.assertEqual(stats.summary(company='SU').median, 40)
+            stats.observe([self.payload(1, 40)])
+            self.assertEqual(stats.compact(), 0)
@@ -4,6 +4,7 @@ from unittest import TestCase
 from unittest.mock import Mock, patch
 
 from bot.filters import SearchFlightFilter
+from bot.settings import settings
 
 
 class TestSearchFlightFilter(TestCase):
@@ -41,6 +42,14 @@ class TestSearchFlightFilter(TestCase):
                 number='010'
             ))
 
+    def test_prepare_search_result_range_limited(self):
+        date = datetime(2024, 12, 1, tzinfo=timezone(timedelta(hours=3)))
+        search_result = dict(date=date, date_end=date + timedelta(days=60))
+        self.filter._prepare_search_result(search_result)
+
+        self.assertEqual(search_result['date_end'] - search_result['date_start'],
+                         timedelta(days=settings.SEARCH_MAX_RANGE_DAYS))
+
     def test_prepare_search_result_multiple_destination(self):
         search_result = dict(country_airport_iata=['LED', 'KHV', 'EVN'])
         self.filter._prepare_search_result(search_result)
@@ -54,6 +63,10 @@ class TestSearchFlightFilter(TestCase):
         self.assertEqual(search_result['company'], 'SU')
         self.assertEqual(search_result['number'], '1712')
 
+    def test_dunder_call_date_given(self):
+        self.assertFalse(asyncio.run(self.filter(Mock(query='SU 1712')))['date_given'])
+        self.assertTrue(asyncio.run(self.filter(Mock(query='SU 1712 20.12')))['date_given'])
+
     def test_dunder_call_return_none(self):
         search_result = asyncio.run(self.filter(Mock(query='')))
 
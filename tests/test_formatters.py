@@ -28,3 +28,8 @@ class TestFormatters(TestCase):
     def test_fdate(self):
         date = datetime(year=2024, month=7, day=3)
         self.assertEqual(formatters.fdate(date), '03.07.2024')
+
+    def test_digest(self):
+        self.assertEqual(formatters.digest('text', 1, True), formatters.digest('text', 1, True))
+        self.assertNotEqual(formatters.digest('text', 1, True), formatters.digest('text', 1, False))
+        self.assertRegex(formatters.digest('text'), r'^[A-Za-z0-9_-]{8}$')
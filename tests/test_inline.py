@@ -0,0 +1,42 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from bot.api.schemas import FlightSchema
+from bot.constants import EMOJI
+from bot.delays import DelayStats
+from bot.inline import InlineResultRenderer
+from tests.samples import flight_payload
+
+
+class TestInlineResultRenderer(TestCase):
+    def setUp(self):
+        self.renderer = InlineResultRenderer(maxsize=10)
+        self.flight = FlightSchema.model_validate(flight_payload())
+
+    def test_render_cached_by_flight_version(self):
+        first = self.renderer.render(self.flight, is_favorite=False, sender=False)
+
+        self.assertIs(self.renderer.render(self.flight, is_favorite=False, sender=False), first)
+        changed = FlightSchema.model_validate(flight_payload(gate_id='99'))
+        self.assertIsNot(self.renderer.render(changed, is_favorite=False, sender=False), first)
+
+    def test_rendered_again_when_delay_stats_change(self):
+        stats = DelayStats(path=None)
+        with patch('bot.inline.delay_stats', stats):
+            first = self.renderer.render(self.flight, is_favorite=False, sender=False)
+            stats.generation += 1
+            self.assertIsNot(self.renderer.render(self.flight, is_favorite=False, sender=False), first)
+
+    def test_favorite_mark_is_personal(self):
+        favorite = self.renderer.render(self.flight, is_favorite=True, sender=False)
+        shared = self.renderer.render(self.flight, is_favorite=False, sender=False)
+
+        self.assertTrue(favorite.title.endswith(EMOJI.red_heart))
+        self.assertFalse(shared.title.endswith(EMOJI.red_heart))
+        self.assertEqual(favorite.input_message_content, shared.input_message_content)
+
+    def test_sender_message(self):
+        result = self.renderer.render(self.flight, is_favorite=False, sender=True)
+
+        self.assertEqual(result.input_message_content.message_text, f'/flight {self.flight.id}')
+        self.assertIsNone(result.reply_markup)
@@ -0,0 +1,94 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, Mock
+
+from bot.metrics import metrics
+from bot.middleware import InlineQuerySupersedeMiddleware, UpdateConcurrencyMiddleware
+
+
+def inline_query(user_id: int) -> Mock:
+    return Mock(from_user=Mock(id=user_id))
+
+
+def update(event_type: str, user_id: int) -> tuple[Mock, dict]:
+    event = Mock(event_type=event_type, callback_query=Mock(answer=AsyncMock()))
+    return event, dict(event_from_user=Mock(id=user_id))
+
+
+class TestInlineQuerySupersedeMiddleware(IsolatedAsyncioTestCase):
+    async def test_newer_query_cancels_older(self):
+        middleware = InlineQuerySupersedeMiddleware()
+        handled = []
+
+        async def handler(event, data):
+            await asyncio.sleep(0.05)
+            handled.append(data['query'])
+            return data['query']
+
+        cancelled = metrics.counters['inline.cancelled']
+        older = asyncio.create_task(middleware(handler, inline_query(1), dict(query='s')))
+        await asyncio.sleep(0.01)
+        newer = asyncio.create_task(middleware(handler, inline_query(1), dict(query='su')))
+        other_user = asyncio.create_task(middleware(handler, inline_query(2), dict(query='led')))
+
+        self.assertEqual(await asyncio.gather(older, newer, other_user), [None, 'su', 'led'])
+        self.assertCountEqual(handled, ['su', 'led'])
+        self.assertEqual(metrics.counters['inline.cancelled'], cancelled + 1)
+
+    async def test_debounced_query_is_not_handled(self):
+        middleware = InlineQuerySupersedeMiddleware(debounce=0.05)
+        handled = []
+
+        async def handler(event, data):
+            handled.append(data['query'])
+
+        debounced = metrics.counters['inline.debounced']
+        older = asyncio.create_task(middleware(handler, inline_query(1), dict(query='s')))
+        await asyncio.sleep(0.01)
+        await middleware(handler, inline_query(1), dict(query='su'))
+        await older
+
+        self.assertEqual(handled, ['su'])
+        self.assertEqual(metrics.counters['inline.debounced'], debounced + 1)
+
+
+class TestUpdateConcurrencyMiddleware(IsolatedAsyncioTestCase):
+    async def test_updates_of_one_user_are_serialized(self):
+        middleware = UpdateConcurrencyMiddleware(limit=10)
+        running = []
+        overlapped = []
+
+        async def handler(event, data):
+            user_id = data['event_from_user'].id
+            overlapped.append(user_id in running)
+            running.append(user_id)
+            await asyncio.sleep(0.01)
+            running.remove(user_id)
+
+        await asyncio.gather(*(middleware(handler, *update('callback_query', user_id)) for user_id in (1, 1, 2, 2)))
+        self.assertEqual(overlapped, [False, False, False, False])
+
+        # inline queries of one user aren't serialized, the newer one supersedes the older
+        await asyncio.gather(*(middleware(handler, *update('inline_query', 1)) for _ in range(2)))
+        self.assertIn(True, overlapped[4:])
+
+    async def test_load_is_shed_when_queue_is_full(self):
+        middleware = UpdateConcurrencyMiddleware(limit=1, max_pending=1)
+        release = asyncio.Event()
+
+        async def handler(event, data):
+            await release.wait()
+            return 'handled'
+
+        shed = metrics.counters['updates.shed']
+        active = asyncio.create_task(middleware(handler, *update('message', 1)))
+        queued = asyncio.create_task(middleware(handler, *update('message', 2)))
+        await asyncio.sleep(0)
+        event, data = update('callback_query', 3)
+
+        self.assertIsNone(await middleware(handler, event, data))
+        event.callback_query.answer.assert_awaited_once()
+        self.assertEqual(metrics.counters['updates.shed'], shed + 1)
+
+        release.set()
+        self.assertEqual(await asyncio.gather(active, queued), ['handled', 'handled'])
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, call, patch
+
+from bot.api import TruncatedResponse
+from bot.constants import SVO_TIMEZONE
+from bot.number_index import FlightNumberIndex, sweep_flights
+from bot.services.services import FlightQueryService
+from tests.samples import flight_payload
+
+
+class TestFlightNumberIndex(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = datetime.now(tz=SVO_TIMEZONE)
+        self.listeners = []
+        self.index = FlightNumberIndex(sweep=AsyncMock(), listeners=self.listeners, past=timedelta(days=1),
+                                       ahead=timedelta(days=2))
+
+    def payload(self, id: int, hours: float, **overrides) -> dict:
+        sked_local = (self.now + timedelta(hours=hours)).isoformat()
+        return flight_payload(id=id, sked_local=sked_local, **overrides)
+
+    def test_nearest_occurrences_ordered_by_date(self):
+        self.index.observe([self.payload(1, -20), self.payload(2, 3), self.payload(3, 27), self.payload(4, 40)])
+
+        self.assertEqual([id for _, id in self.index.nearest('010', company='SU', n=3)], [1, 2, 3])
+        self.assertEqual([id for _, id in self.index.nearest('10', n=1)], [2])
+
+    def test_other_company_and_outside_window_ignored(self):
+        self.index.observe([
+            self.payload(1, 3, company={'iata': 'FV'}),
+            self.payload(2, 24 * 5),
+            dict(id=3, number=None),
+        ])
+
+        self.assertEqual(self.index.nearest('0010', company='SU'), [])
+        self.assertEqual([id for _, id in self.index.nearest('0010')], [1])
+
+    async def test_sweep_prunes_old_flights(self):
+        self.index.observe([self.payload(1, 3)])
+        self.index.prune(now=self.now + timedelta(days=3))
+        self.assertEqual(len(self.index), 0)
+
+        await self.index.sweep()
+        self.index._sweep.assert_awaited_once()
+
+    async def test_sweep_without_fetch_only_prunes(self):
+        index = FlightNumberIndex(sweep=None, listeners=self.listeners)
+        index.observe([self.payload(1, 3)])
+
+        with patch('bot.number_index.datetime') as mock_datetime:
+            mock_datetime.now.return_value = self.now + timedelta(days=3)
+            await index.sweep()
+        self.assertEqual(len(index), 0)
+
+    async def test_listener_registered_while_running(self):
+        await self.index.start()
+        self.assertEqual(self.listeners, [self.index.observe])
+
+        await self.index.stop()
+        self.assertEqual(self.listeners, [])
+
+
+class TestSweepFlights(IsolatedAsyncioTestCase):
+    async def test_window_swept_day_by_day(self):
+        date_start = datetime(2024, 2, 1, tzinfo=SVO_TIMEZONE)
+        get_raw_items = AsyncMock(side_effect=[[], TruncatedResponse(total=9000, fetched=5000), []])
+
+        with patch.object(FlightQueryService, 'get_raw_items', get_raw_items):
+            await sweep_flights(date_start, date_start + timedelta(days=1, hours=12))
+
+        day = dict(date_start=date_start, date_end=date_start + timedelta(days=1), max_pages=50)
+        last = dict(date_start=day['date_end'], date_end=date_start + timedelta(days=1, hours=12), max_pages=50)
+        # a truncated day is fetched again without the check, so the pages that fit are indexed
+        self.assertEqual(get_raw_items.await_args_list,
+                         [call(**day, strict=True), call(**last, strict=True), call(**last)])
@@ -0,0 +1,67 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, Mock
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, EditMessageReplyMarkup, EditMessageText, SendMessage
+
+from bot.outbound import OutboundScheduler, background
+
+
+class TestOutboundScheduler(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.bot = Mock()
+        self.make_request = AsyncMock(side_effect=lambda bot, method: method)
+
+    async def test_superseded_edit_is_not_sent(self):
+        scheduler = OutboundScheduler(chat_rate=20, chat_burst=1)
+        await scheduler(self.make_request, self.bot, SendMessage(chat_id=1, text='search'))
+
+        older = asyncio.create_task(scheduler(self.make_request, self.bot,
+                                              EditMessageText(chat_id=1, message_id=10, text='old')))
+        await asyncio.sleep(0)
+        newer = EditMessageText(chat_id=1, message_id=10, text='new')
+
+        self.assertEqual(await asyncio.gather(older, scheduler(self.make_request, self.bot, newer)), [newer, newer])
+        self.assertEqual(self.make_request.await_count, 2)
+
+    async def test_edits_of_other_kind_are_sent(self):
+        scheduler = OutboundScheduler(chat_rate=20, chat_burst=1)
+        await scheduler(self.make_request, self.bot, SendMessage(chat_id=1, text='search'))
+
+        text = EditMessageText(chat_id=1, message_id=10, text='new')
+        markup = EditMessageReplyMarkup(chat_id=1, message_id=10)
+        edit_text = asyncio.create_task(scheduler(self.make_request, self.bot, text))
+        await asyncio.sleep(0)
+
+        self.assertEqual(await asyncio.gather(edit_text, scheduler(self.make_request, self.bot, markup)),
+                         [text, markup])
+        self.assertEqual(self.make_request.await_count, 3)
+
+    async def test_retry_after_is_honoured(self):
+        method = SendMessage(chat_id=1, text='text')
+        self.make_request.side_effect = [TelegramRetryAfter(method, message='flood', retry_after=0), 'sent']
+
+        self.assertEqual(await OutboundScheduler()(self.make_request, self.bot, method), 'sent')
+        self.assertEqual(self.make_request.await_count, 2)
+
+    async def test_background_yields_to_interactive(self):
+        scheduler = OutboundScheduler(rate=5, reserve=4)
+        await scheduler(self.make_request, self.bot, SendMessage(chat_id=1, text='reply'))
+
+        async def notify():
+            with background():
+                return await scheduler(self.make_request, self.bot, SendMessage(chat_id=2, text='notify'))
+
+        notification = asyncio.create_task(notify())
+        await asyncio.sleep(0.05)
+        self.assertFalse(notification.done())
+        await asyncio.wait_for(scheduler(self.make_request, self.bot, SendMessage(chat_id=3, text='reply')), 0.05)
+        await notification
+
+    async def test_not_limited_methods_pass_through(self):
+        scheduler = OutboundScheduler(rate=1, chat_burst=1)
+        method = AnswerCallbackQuery(callback_query_id='1')
+
+        for _ in range(3):
+            await asyncio.wait_for(scheduler(self.make_request, self.bot, method), 0.05)
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import AsyncMock
+
+from bot.analytics import WindowedTopK
+from bot.api.schemas import FlightCountResponse, PagedFlightResponse
+from bot.constants import SVO_TIMEZONE
+from bot.metrics import metrics
+from bot.prefetch import SearchPrefetcher, follow_up_queries
+from bot.warming import QueryWarmer
+
+
+DATE = datetime(2024, 12, 20, tzinfo=SVO_TIMEZONE)
+QUERY = dict(direction='departure', destination='LED', date_start=DATE, date_end=DATE + timedelta(days=1))
+
+
+class TestFollowUpQueries(TestCase):
+    def test_counter_direction_and_adjacent_days(self):
+        queries = follow_up_queries(QUERY)
+
+        self.assertEqual(queries[0]['direction'], 'arrival')
+        self.assertListEqual([q['date_start'] for q in queries[1:]], [DATE - timedelta(days=1), DATE + timedelta(days=1)])
+
+    def test_number_search_has_no_direction_variant(self):
+        self.assertEqual(len(follow_up_queries(QUERY | dict(direction=None, number='0010'))), 2)
+
+
+class TestSearchPrefetcher(IsolatedAsyncioTestCase):
+    async def test_follow_up_click_served_from_prefetched_answer(self):
+        fetch = AsyncMock(side_effect=lambda **query: PagedFlightResponse())
+        frequencies = WindowedTopK()
+        warmer = QueryWarmer(fetch=fetch, frequencies=frequencies)
+        prefetcher = SearchPrefetcher(warmer=warmer)
+
+        prefetcher.schedule(QUERY)
+        while len(prefetcher):
+            await asyncio.sleep(0)
+        self.assertEqual(fetch.await_count, 3)
+        self.assertListEqual(frequencies.top(), [])
+
+        hits = metrics.counters['prefetch.hit']
+        await warmer.get_many(QUERY | dict(direction='arrival'))
+        self.assertEqual(fetch.await_count, 3)
+        self.assertEqual(metrics.counters['prefetch.hit'], hits + 1)
+
+    async def test_summary_follow_ups_prefetch_only_counts(self):
+        fetch = AsyncMock(side_effect=lambda **query: PagedFlightResponse())
+        count = AsyncMock(side_effect=lambda **query: FlightCountResponse(total=7))
+        warmer = QueryWarmer(fetch=fetch, count=count, frequencies=WindowedTopK())
+        prefetcher = SearchPrefetcher(warmer=warmer)
+
+        prefetcher.schedule(QUERY, summary=True)
+        while len(prefetcher):
+            await asyncio.sleep(0)
+        self.assertEqual((fetch.await_count, count.await_count), (0, 3))
+
+        self.assertEqual((await warmer.get_count(QUERY | dict(direction='arrival'))).total, 7)
+        self.assertEqual(count.await_count, 3)
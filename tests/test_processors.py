@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, Mock, patch
+
+from bot import callback_data as cd, processors, tracking
+from bot.api.schemas import FlightCountResponse, FlightSchema
+from bot.constants import SVO_TIMEZONE
+from bot.delays import DelayStats
+from bot.services import services
+from tests.samples import flight_payload
+
+
+class TestFlightProcessor(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.get_one_by_id = AsyncMock(return_value=None)
+        # like the sqlite storage, which converts the id to int
+        self.is_favorite = AsyncMock(side_effect=lambda user_id, favorite_id: bool(int(favorite_id)) and False)
+        for patcher in (patch.object(services.FlightQueryService, 'get_one_by_id', self.get_one_by_id),
+                        patch.object(services.FlightFavoriteService, 'is_favorite', self.is_favorite)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.message = AsyncMock(from_user=SimpleNamespace(id=1))
+
+    async def test_non_numeric_id_not_found(self):
+        for args in ('abc', None):
+            with self.subTest(args=args):
+                await processors.FlightProcessor().process_message(self.message, SimpleNamespace(args=args))
+
+                self.message.answer.assert_awaited_with(text='Рейс не найден')
+        self.get_one_by_id.assert_not_awaited()
+        self.is_favorite.assert_not_awaited()
+
+    async def test_numeric_id_fetched(self):
+        await processors.FlightProcessor().process_message(self.message, SimpleNamespace(args='1000'))
+
+        self.get_one_by_id.assert_awaited_once_with(id=1000)
+        self.is_favorite.assert_awaited_once_with(user_id=1, favorite_id=1000)
+        self.message.answer.assert_awaited_with(text='Рейс не найден')
+
+    async def test_tracking_unknown_flight_not_found(self):
+        callback = AsyncMock(from_user=SimpleNamespace(id=1))
+        callback_data = cd.FlightCD(id=1000, changelog=False, action=cd.FlightAction.toggle_tracking, digest='')
+
+        with patch.object(tracking.tracker, 'subscribe', AsyncMock()) as subscribe:
+            await processors.FlightProcessor().toggle_tracking_cb(callback=callback, callback_data=callback_data)
+
+        callback.answer.assert_awaited_once_with('Рейс не найден')
+        callback.message.edit_text.assert_not_awaited()
+        subscribe.assert_not_awaited()
+
+
+class TestSuppressedEdits(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.flight = FlightSchema.model_validate(flight_payload())
+        self.is_favorite = AsyncMock(return_value=False)
+        for patcher in (
+                patch.object(services.FlightQueryService, 'get_one_by_id', AsyncMock(return_value=self.flight)),
+                patch.object(services.FlightFavoriteService, 'is_favorite', self.is_favorite),
+                patch.object(services.FlightFavoriteService, 'add_one', AsyncMock()),
+                patch.object(tracking.tracker, 'is_tracking', Mock(return_value=False)),
+                patch.object(tracking.tracker, 'subscribe', AsyncMock()),
+                patch.object(tracking.tracker, 'update', AsyncMock()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.callback = AsyncMock(from_user=SimpleNamespace(id=1))
+        self.callback.message = AsyncMock(chat=SimpleNamespace(id=1), message_id=10)
+
+    def callback_data(self, action: cd.FlightAction, **state) -> cd.FlightCD:
+        """ Данные кнопки сообщения, построенного для `state` """
+        template = processors.FlightProcessor().init_template(
+            self.flight, **dict(is_favorite=False, changelog=False, is_tracking=False) | state)
+        return cd.FlightCD(id=self.flight.id, changelog=False, action=action, digest=template.digest)
+
+    async def test_unchanged_flight_not_edited(self):
+        await processors.FlightProcessor().update_cb(callback=self.callback,
+                                                     callback_data=self.callback_data(cd.FlightAction.update))
+
+        self.callback.message.edit_text.assert_not_awaited()
+        self.callback.answer.assert_awaited_once_with('Обновлено')
+
+    async def test_changed_flight_edited(self):
+        callback_data = self.callback_data(cd.FlightAction.update, is_favorite=True)
+        await processors.FlightProcessor().update_cb(callback=self.callback, callback_data=callback_data)
+
+        self.callback.message.edit_text.assert_awaited_once()
+
+    async def test_changed_delay_stats_edited(self):
+        stats = DelayStats(path=None, on_time=15)
+        sked_local = datetime.now(tz=SVO_TIMEZONE).replace(microsecond=0) - timedelta(days=1)
+        stats.observe([flight_payload(
+            id=id,
+            sked_local=sked_local.isoformat(),
+            at_local=sked_local.isoformat(),
+            at_other=(sked_local + timedelta(minutes=90)).isoformat(),
+        ) for id in range(100, 105)])
+
+        with patch('bot.templates.delay_stats', stats):
+            callback_data = self.callback_data(cd.FlightAction.update)
+            stats.compact()
+            await processors.FlightProcessor().update_cb(callback=self.callback, callback_data=callback_data)
+
+        self.callback.message.edit_text.assert_awaited_once()
+        self.assertIn('100%', self.callback.message.edit_text.await_args.kwargs['text'])
+
+    async def test_favorite_toggle_edited(self):
+        await processors.FlightProcessor().toggle_favorite_cb(
+            callback=self.callback, callback_data=self.callback_data(cd.FlightAction.toggle_favorite))
+
+        self.callback.message.edit_text.assert_awaited_once()
+        self.callback.answer.assert_awaited_once_with('Добавлено в избранное')
+
+    async def test_tracking_toggle_edited(self):
+        await processors.FlightProcessor().toggle_tracking_cb(
+            callback=self.callback, callback_data=self.callback_data(cd.FlightAction.toggle_tracking))
+
+        self.callback.message.edit_text.assert_awaited_once()
+        tracking.tracker.subscribe.assert_awaited_once()
+
+    async def test_search_text_unchanged_only_keyboard_edited(self):
+        processor = processors.SearchFlightProcessor()
+        query = dict(date_start=datetime(2024, 12, 20, tzinfo=SVO_TIMEZONE), direction='departure', company='SU')
+        template = processor.init_template(response=FlightCountResponse(total=3), query=query)
+        processor.text_digests.set((1, 10), template.text_digest)
+
+        await processor.edit_message(message=self.callback.message, template=template)
+        self.callback.message.edit_reply_markup.assert_awaited_once()
+        self.callback.message.edit_text.assert_not_awaited()
+
+        changed = processor.init_template(response=FlightCountResponse(total=4), query=query)
+        await processor.edit_message(message=self.callback.message, template=changed)
+        self.callback.message.edit_text.assert_awaited_once()
+
+
+class TestSearchInline(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.response = SimpleNamespace(count=1, items=[FlightSchema.model_validate(flight_payload())])
+        for patcher in (
+                patch.object(processors.SearchFlightProcessor, 'get_response', AsyncMock(return_value=self.response)),
+                patch.object(services.FlightFavoriteService, 'get_paged_ids', AsyncMock(return_value=dict(items=[]))),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_answer_without_favorites_not_shared(self):
+        for chat_type in ('sender', 'group'):
+            with self.subTest(chat_type=chat_type):
+                inline_query = AsyncMock(offset='', chat_type=chat_type, from_user=SimpleNamespace(id=1))
+                await processors.SearchFlightProcessor().process_inline(inline_query, search_params={})
+
+                self.assertIs(inline_query.answer.await_args.kwargs['is_personal'], True)
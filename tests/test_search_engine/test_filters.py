@@ -69,3 +69,17 @@ class TestFilters(TestCase):
             filters.AirportNameFilter()(['пулково']),
             dict(airport_iata='LED'),
         )
+
+    def test_date_range_filter_valid(self):
+        result = filters.DateRangeFilter()(['20.12.24-25.12.24'])
+        self.assertEqual((result['date'].day, result['date_end'] - result['date']), (20, timedelta(days=6)))
+
+        result = filters.DateRangeFilter()(['28.12.24-03.01.25'])
+        self.assertEqual((result['date'].year, result['date_end'].date()), (2024, datetime(2025, 1, 4).date()))
+
+    def test_date_range_filter_reversed_range(self):
+        self.assertIsNone(filters.DateRangeFilter()(['25.12.24-20.12.24'])['date'])
+
+    def test_date_range_word_filter_valid(self):
+        result = filters.DateRangeWordFilter()(['неделя'])
+        self.assertEqual(result['date_end'] - result['date'], timedelta(days=7))
@@ -42,6 +42,16 @@ class TestParamSearch(TestCase):
 
         self.assertDictEqual(self.search(' '.join(words)), result_dict)
 
+    def test_spaced_date_range(self):
+        date = datetime.now(tz=timezone(timedelta(hours=3))).replace(day=20, month=12, hour=0, minute=0, second=0,
+                                                                     microsecond=0)
+        for input_text in ('AER 20.12 - 25.12', 'AER 20.12 -25.12', 'AER 20.12-25.12'):
+            with self.subTest(input_text=input_text):
+                self.assertDictEqual(
+                    self.search(input_text),
+                    dict(airport_iata='AER', date=date, date_end=date + timedelta(days=6)),
+                )
+
 
 class TestSearchFunc(TestCase):
     def test_get_company_name(self):
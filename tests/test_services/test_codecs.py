@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from bot.constants import SVO_TIMEZONE
+from bot.services.codecs import SearchStateCodec
+from bot.services.quieries import SaveFlightServiceQuery
+
+
+class TestSearchStateCodec(TestCase):
+    def setUp(self):
+        self.codec = SearchStateCodec()
+        self.date = datetime.now(tz=SVO_TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def query(self, **params) -> dict:
+        params = dict(date_start=self.date, date_end=self.date + timedelta(days=1)) | params
+        return SaveFlightServiceQuery(**params).model_dump()
+
+    def test_roundtrip(self):
+        queries = [
+            self.query(direction='departure', destination='LED', company='SU'),
+            self.query(direction='arrival', country_name='Армения', destination='EVN'),
+            self.query(company='SU', number='1152', date_end=self.date + timedelta(days=3)),
+            self.query(direction='departure', destination='XXX', company='Q9'),
+        ]
+        for query in queries:
+            with self.subTest(query=query):
+                self.assertDictEqual(self.codec.decode(self.codec.encode(query)), query)
+
+    def test_state_is_compact(self):
+        state = self.codec.encode(self.query(direction='departure', destination='LED', company='SU'))
+        self.assertLessEqual(len(state), 12)
+
+    def test_encode_too_long_return_none(self):
+        query = self.query(destination=','.join(sorted(self.codec.airports)[:40]))
+        self.assertIsNotNone(self.codec.encode(query))
+        self.assertIsNone(self.codec.encode(query, max_length=48))
+
+    def test_encode_non_default_params_return_none(self):
+        self.assertIsNone(self.codec.encode(self.query(page=1)))
+
+    def test_decode_invalid_return_none(self):
+        self.assertIsNone(self.codec.decode('!!!'))
+        self.assertIsNone(self.codec.decode(''))
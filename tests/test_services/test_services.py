@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, patch
+
+from requests import ConnectionError
+
+from bot.api import TruncatedResponse
+from bot.api.schemas import FlightCountResponse, FlightSchema, PagedFlightResponse
+from bot.constants import SVO_TIMEZONE
+from bot.services.services import FlightFavoriteService, FlightQueryService
+from bot.snapshot import ScheduleSnapshot
+from tests.samples import flight_payload
+
+
+class FakeEndpoint:
+    """ По `totals[day]` рейсов в каждом дне, id рейса кодирует день и его позицию """
+    def __init__(self, date_start: datetime, totals: list[int]):
+        self.date_start = date_start
+        self.totals = totals
+        self.pages = []
+
+    def day(self, query) -> int:
+        return (query.date_start - self.date_start).days
+
+    async def count(self, query) -> FlightCountResponse:
+        return FlightCountResponse(total=self.totals[self.day(query)])
+
+    async def get_many(self, query) -> PagedFlightResponse:
+        day = self.day(query)
+        self.pages.append((day, query.page))
+        ids = [day * 100 + i for i in range(self.totals[day])][query.page * query.limit:(query.page + 1) * query.limit]
+        items = [FlightSchema.model_validate(flight_payload(id=id)) for id in ids]
+        return PagedFlightResponse(items=items, count=len(items), total=self.totals[day])
+
+
+class TestRangeSearch(IsolatedAsyncioTestCase):
+    def setUp(self):
+        FlightQueryService.counts.clear()
+        self.date_start = datetime(2024, 12, 20, tzinfo=SVO_TIMEZONE)
+        self.api = FakeEndpoint(self.date_start, totals=[3, 0, 4, 2])
+        patcher = patch.object(FlightQueryService, 'api', self.api)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def query(self, **params) -> dict:
+        return dict(date_start=self.date_start, date_end=self.date_start + timedelta(days=4), limit=3) | params
+
+    async def test_pages_merged_across_days(self):
+        pages = [await FlightQueryService.get_many(**self.query(page=page)) for page in range(3)]
+
+        self.assertEqual([[flight.id for flight in page.items] for page in pages],
+                         [[0, 1, 2], [200, 201, 202], [203, 300, 301]])
+        self.assertEqual({(page.total, page.total_pages) for page in pages}, {(9, 3)})
+        self.assertNotIn(1, {day for day, _ in self.api.pages})
+
+    async def test_range_count_sums_days(self):
+        self.assertEqual((await FlightQueryService.count(**self.query())).total, 9)
+
+    async def test_single_day_not_split(self):
+        response = await FlightQueryService.get_many(**self.query(date_end=self.date_start + timedelta(days=1)))
+
+        self.assertEqual(response.total, 3)
+        self.assertEqual(self.api.pages, [(0, 0)])
+
+
+class TestMonthCounts(IsolatedAsyncioTestCase):
+    def setUp(self):
+        FlightQueryService.counts.clear()
+        self.api = AsyncMock()
+        for patcher in (patch.object(FlightQueryService, 'api', self.api),
+                        patch.object(FlightQueryService, 'archive', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_truncated_month_counted_by_day(self):
+        self.api.count_by_day.side_effect = TruncatedResponse(total=5000, fetched=1000)
+        self.api.count.side_effect = lambda query: FlightCountResponse(total=query.date_start.day % 3)
+
+        counts = await FlightQueryService.count_by_month(2024, 2, direction='departure')
+        self.assertEqual(self.api.count.await_count, 29)
+        self.assertEqual(counts, {day: day % 3 for day in range(1, 30) if day % 3})
+
+
+class TestSnapshotFallback(IsolatedAsyncioTestCase):
+    def setUp(self):
+        FlightQueryService.counts.clear()
+        self.date_start = datetime.now(tz=SVO_TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.snapshot = ScheduleSnapshot(path=None, retry=30)
+        self.snapshot.replace(
+            [flight_payload(id=1, date=self.date_start.isoformat(), sked_local=self.date_start.isoformat())],
+            created_at=self.date_start,
+            window=(self.date_start, self.date_start + timedelta(days=2)),
+        )
+        self.api = AsyncMock()
+        for patcher in (patch.object(FlightQueryService, 'api', self.api),
+                        patch.object(FlightQueryService, 'snapshot', self.snapshot),
+                        patch.object(FlightQueryService, 'archive', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def query(self, **params) -> dict:
+        return dict(date_start=self.date_start, date_end=self.date_start + timedelta(days=1)) | params
+
+    async def test_unavailable_api_served_from_snapshot(self):
+        self.api.get_many.side_effect = ConnectionError()
+        self.api.count.side_effect = ConnectionError()
+
+        response = await FlightQueryService.get_many(**self.query())
+        self.assertEqual([flight.id for flight in response.items], [1])
+        self.assertEqual(response.snapshot_at, self.date_start)
+        self.assertEqual((await FlightQueryService.count(**self.query())).snapshot_at, self.date_start)
+        self.assertEqual((await FlightQueryService.get_one_by_id(1)).snapshot_at, self.date_start)
+        # after the first failure the api is not asked until the retry interval passes
+        self.assertEqual(self.api.get_many.await_count, 1)
+        self.assertEqual(self.api.get_one_by_id.await_count, 0)
+        self.assertNotIn(FlightQueryService.count_key(**self.query()), FlightQueryService.counts)
+
+    async def test_other_errors_and_uncovered_queries_raised(self):
+        self.api.get_many.side_effect = ValueError()
+        with self.assertRaises(ValueError):
+            await FlightQueryService.get_many(**self.query())
+
+        self.api.get_many.side_effect = ConnectionError()
+        with self.assertRaises(ConnectionError):
+            await FlightQueryService.get_many(**self.query(date_start=self.date_start + timedelta(days=5),
+                                                            date_end=self.date_start + timedelta(days=6)))
+
+
+class TestFavoritesPartialFetch(IsolatedAsyncioTestCase):
+    def setUp(self):
+        FlightQueryService.flights.clear()
+        self.storage = AsyncMock()
+        self.storage.get_favorites_all.return_value = {
+            str(id): dict(sked_local=f'2024-12-20T{hour:02}:00:00+03:00') for id, hour in ((1, 9), (2, 10), (3, 11))
+        }
+        self.api = AsyncMock()
+        self.api.get_many_by_id.side_effect = lambda ids: [self.flight(int(id)) for id in ids]
+        for patcher in (patch.object(FlightFavoriteService, 'storage', self.storage),
+                        patch.object(FlightFavoriteService, 'api', self.api),
+                        patch.object(FlightQueryService, 'archive', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def flight(id: int) -> FlightSchema:
+        # scheduled in the reverse order of ids, the api order must not matter
+        return FlightSchema.model_validate(flight_payload(id=id, sked_local=f'2024-12-20T{20 - id:02}:00:00+03:00'))
+
+    async def test_only_missing_flights_fetched(self):
+        FlightQueryService.remember([self.flight(2)])
+
+        response = await FlightFavoriteService.get_many(user_id=1, per_page=3, sort_by='sked_local')
+        self.assertEqual([flight.id for flight in response.items], [3, 2, 1])
+        self.assertEqual(self.api.get_many_by_id.await_args.kwargs['ids'], ['1', '3'])
+
+        await FlightFavoriteService.get_many(user_id=1, per_page=3, sort_by='sked_local')
+        self.assertEqual(self.api.get_many_by_id.await_count, 1)
+
+    async def test_snapshot_flights_not_cached(self):
+        FlightQueryService.remember([self.flight(1).model_copy(update=dict(snapshot_at=datetime.now(tz=SVO_TIMEZONE)))])
+
+        await FlightFavoriteService.get_many(user_id=1, per_page=1, sort_by='sked_local')
+        self.assertEqual(self.api.get_many_by_id.await_args.kwargs['ids'], ['1'])
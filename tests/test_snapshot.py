@@ -0,0 +1,101 @@
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from bot.api import TruncatedResponse
+from bot.api.quieries import FlightsQuery
+from bot.api.schemas import FlightSchema
+from bot.constants import SVO_TIMEZONE
+from bot.snapshot import ScheduleSnapshot
+from tests.samples import flight_payload
+
+
+class TestScheduleSnapshot(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = Path(self.tmp_dir.name) / 'snapshot.bin'
+        self.today = datetime.now(tz=SVO_TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.items = [
+            self.payload(1, hours=12),
+            self.payload(2, hours=9, number='1152'),
+            self.payload(3, hours=10, company={'iata': 'FV', 'name': 'Россия'}),
+            self.payload(4, hours=24 + 10),
+        ]
+        self.snapshot = ScheduleSnapshot(path=self.path, fetch=AsyncMock(side_effect=self.fetch))
+
+    async def fetch(self, date_start: datetime, date_end: datetime) -> list[dict]:
+        return [item for item in self.items if date_start <= datetime.fromisoformat(item['date']) < date_end]
+
+    def payload(self, id: int, hours: float, **overrides) -> dict:
+        sked_local = self.today + timedelta(hours=hours)
+        date = sked_local.replace(hour=0)
+        return flight_payload(id=id, date=date.isoformat(), sked_local=sked_local.isoformat(), **overrides)
+
+    def query(self, days: int = 0, **params) -> FlightsQuery:
+        date_start = self.today + timedelta(days=days)
+        return FlightsQuery(date_start=date_start, date_end=date_start + timedelta(days=1), **params)
+
+    async def test_search_ordered_and_stamped(self):
+        await self.snapshot.sync()
+
+        response = self.snapshot.get_many(self.query(limit=2))
+        self.assertEqual([flight.id for flight in response.items], [2, 3])
+        self.assertEqual((response.total, response.total_pages), (3, 2))
+        self.assertEqual(response.snapshot_at, self.snapshot.created_at)
+        self.assertEqual({flight.snapshot_at for flight in response.items}, {self.snapshot.created_at})
+        self.assertEqual(self.snapshot.count(self.query(number='1152')).id, 2)
+        self.assertEqual(self.snapshot.count(self.query(company='FV,SU', days=1)).total, 1)
+
+    async def test_queries_outside_window_not_answered(self):
+        await self.snapshot.sync()
+
+        self.assertIsNone(self.snapshot.get_many(self.query(days=5)))
+        self.assertIsNone(self.snapshot.count(self.query(days=-3)))
+
+    async def test_warm_start_from_disk(self):
+        await self.snapshot.sync()
+
+        snapshot = ScheduleSnapshot(path=self.path, fetch=None)
+        await snapshot.start()
+        self.assertEqual(len(snapshot), 4)
+        self.assertEqual(snapshot.created_at, self.snapshot.created_at)
+        self.assertEqual(snapshot.get_one('4').number, '0010')
+        self.assertIsNone(snapshot.get_one('5'))
+
+    async def test_broken_file_ignored(self):
+        self.path.write_bytes(b'broken')
+
+        self.snapshot.load()
+        self.assertEqual(len(self.snapshot), 0)
+
+    async def test_snapshot_version_differs(self):
+        await self.snapshot.sync()
+
+        flight = self.snapshot.get_one(1)
+        self.assertNotEqual(flight.version, FlightSchema.model_validate(self.items[0]).version)
+        self.assertNotIn('snapshot_at', flight.model_dump())
+
+    async def test_window_ends_before_truncated_day(self):
+        async def fetch(date_start: datetime, date_end: datetime) -> list[dict]:
+            if date_start > self.today:
+                raise TruncatedResponse(total=6000, fetched=5000)
+            return await self.fetch(date_start, date_end)
+
+        self.snapshot._fetch.side_effect = fetch
+        await self.snapshot.sync()
+
+        self.assertEqual(self.snapshot.window[1], self.today + timedelta(days=1))
+        self.assertEqual(self.snapshot.get_many(self.query()).total, 3)
+        self.assertIsNone(self.snapshot.count(self.query(days=1)))
+        self.assertIsNone(self.snapshot.get_one(4))
+
+    async def test_previous_snapshot_kept_if_nothing_fetched(self):
+        await self.snapshot.sync()
+        created_at = self.snapshot.created_at
+
+        self.snapshot._fetch.side_effect = TruncatedResponse(total=6000, fetched=5000)
+        await self.snapshot.sync()
+        self.assertEqual((self.snapshot.created_at, len(self.snapshot)), (created_at, 4))
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from bot.api.schemas import FlightSchema
+from bot.constants import SVO_TIMEZONE
+from bot.delays import DelayStats
+from bot.metrics import Metrics
+from bot.templates import MetricsTemplate, get_flight_template
+from tests.samples import flight_payload
+
+
+class TestFlightTemplate(TestCase):
+    def setUp(self):
+        self.flight = FlightSchema.model_validate(flight_payload())
+        self.template = get_flight_template(self.flight)
+
+    def test_message_memoized_by_flight_version(self):
+        message = self.template(self.flight).get_message()
+
+        self.assertEqual(message, self.template(self.flight).render_message())
+        self.assertIs(self.template(self.flight, is_favorite=True, is_tracking=True).get_message(), message)
+        changed = FlightSchema.model_validate(flight_payload(gate_id='99'))
+        self.assertIsNot(self.template(changed).get_message(), message)
+
+    def test_changelog_rendered_separately(self):
+        self.assertNotEqual(self.template(self.flight, changelog=True).get_message(),
+                            self.template(self.flight).get_message())
+
+    def test_keyboard_cached_by_digest(self):
+        keyboard = self.template(self.flight).get_keyboard()
+
+        self.assertIs(self.template(self.flight).get_keyboard(), keyboard)
+        self.assertEqual(keyboard, self.template(self.flight).build_keyboard())
+        favorite = self.template(self.flight, is_favorite=True).get_keyboard()
+        self.assertIsNot(favorite, keyboard)
+        self.assertNotEqual(favorite.inline_keyboard[0][1].text, keyboard.inline_keyboard[0][1].text)
+
+    def test_message_rendered_again_when_delay_stats_change(self):
+        stats = DelayStats(path=None, on_time=15)
+        sked_local = datetime.now(tz=SVO_TIMEZONE).replace(microsecond=0) - timedelta(days=1)
+
+        def observe(delays: list[int], start: int) -> None:
+            stats.observe([flight_payload(
+                id=id,
+                sked_local=sked_local.isoformat(),
+                at_local=(sked_local + timedelta(minutes=delay)).isoformat(),
+                at_other=(sked_local + timedelta(minutes=delay + 90)).isoformat(),
+            ) for id, delay in enumerate(delays, start=start)])
+            stats.compact()
+
+        with patch('bot.templates.delay_stats', stats):
+            observe([0] * 5, start=100)
+            self.assertIn('100%', self.template(self.flight).get_message())
+
+            observe([60] * 5, start=200)
+            self.assertIn('50%', self.template(self.flight).get_message())
+
+
+class TestMetricsTemplate(TestCase):
+    def test_hit_rates_and_timings_shown(self):
+        metrics = Metrics()
+        metrics.incr('calendar.hit', 3)
+        metrics.incr('calendar.miss')
+        metrics.gauge('favorites.depth', 12)
+        metrics.observe('favorites.flush_latency', 0.25)
+
+        message = MetricsTemplate(snapshot=metrics.snapshot()).get_message()
+        self.assertIn('<b>75%</b>    calendar', message)
+        self.assertIn('<b>12</b>    favorites.depth', message)
+        self.assertIn('<b>250 / 250 / 250</b>    favorites.flush_latency', message)
@@ -0,0 +1,90 @@
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import AsyncMock
+
+from bot.api.schemas import FlightSchema
+from bot.tracking import FlightTracker, Subscription, poll_interval
+from tests.samples import flight_payload
+
+
+def flight(**overrides) -> FlightSchema:
+    return FlightSchema.model_validate(flight_payload(**overrides))
+
+
+class MemorySubscriptionService:
+    def __init__(self, *subscriptions: dict):
+        self.stored = {(s['chat_id'], s['message_id']): s for s in subscriptions}
+
+    async def add_one(self, chat_id: int, message_id: int, **data) -> None:
+        self.stored[(chat_id, message_id)] = dict(chat_id=chat_id, message_id=message_id, **data)
+
+    async def remove_one(self, chat_id: int, message_id: int) -> None:
+        self.stored.pop((chat_id, message_id), None)
+
+    async def get_all(self) -> list[dict]:
+        return list(self.stored.values())
+
+
+class TestPollInterval(TestCase):
+    def test_interval_follows_status(self):
+        self.assertEqual(poll_interval(flight()), 600)
+        self.assertEqual(poll_interval(flight(boarding_start='2024-12-20T09:20:00+03:00')), 60)
+        self.assertIsNone(poll_interval(flight(at_other='2024-12-20T11:30:00+03:00')))
+
+
+class TestFlightTracker(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.responses = [[flight()]]
+        self.fetch = AsyncMock(side_effect=lambda ids: self.responses.pop(0))
+        self.service = MemorySubscriptionService()
+        self.bot = AsyncMock()
+        self.tracker = FlightTracker(fetch=self.fetch, subscription_service=self.service, tick=3600)
+        await self.tracker.start(bot=self.bot)
+
+    async def asyncTearDown(self):
+        await self.tracker.stop()
+
+    async def subscribe(self, chat_id: int):
+        await self.tracker.subscribe(Subscription(flight_id=1000, chat_id=chat_id, message_id=10))
+
+    async def test_flight_fetched_once_for_all_subscribers(self):
+        await self.subscribe(chat_id=1)
+        await self.subscribe(chat_id=2)
+
+        await self.tracker.poll()
+
+        self.fetch.assert_awaited_once_with([1000])
+        self.assertEqual(self.bot.edit_message_text.await_count, 2)
+        self.bot.send_message.assert_not_awaited()
+
+    async def test_only_changed_flights_are_pushed(self):
+        await self.subscribe(chat_id=1)
+        await self.tracker.poll()
+        self.tracker._due[1000] = 0
+
+        self.responses.append([flight()])
+        await self.tracker.poll()
+        self.assertEqual(self.bot.edit_message_text.await_count, 1)
+
+        self.tracker._due[1000] = 0
+        self.responses.append([flight(gate_id='22')])
+        await self.tracker.poll()
+        self.assertEqual(self.bot.edit_message_text.await_count, 2)
+        self.assertIn('22', self.bot.send_message.await_args.kwargs['text'])
+
+    async def test_completed_flight_unsubscribes(self):
+        await self.subscribe(chat_id=1)
+        self.responses = [[flight(at_other='2024-12-20T11:30:00+03:00')]]
+
+        await self.tracker.poll()
+
+        self.bot.edit_message_text.assert_awaited_once()
+        self.assertEqual(len(self.tracker), 0)
+        self.assertDictEqual(self.service.stored, {})
+
+    async def test_subscriptions_restored_on_start(self):
+        await self.subscribe(chat_id=1)
+        restarted = FlightTracker(fetch=self.fetch, subscription_service=self.service, tick=3600)
+        await restarted.start(bot=self.bot)
+
+        self.assertTrue(restarted.is_tracking(chat_id=1, message_id=10))
+        await restarted.stop()
@@ -0,0 +1,60 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+from bot.analytics import WindowedTopK
+from bot.api.schemas import FlightCountResponse, FlightSchema, PagedFlightResponse
+from bot.metrics import metrics
+from bot.warming import QueryWarmer
+from tests.samples import flight_payload
+
+
+def response() -> PagedFlightResponse:
+    return PagedFlightResponse(items=[FlightSchema.model_validate(flight_payload())], count=1, total=1)
+
+
+class TestQueryWarmer(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.fetch = AsyncMock(side_effect=lambda **query: response())
+
+    async def test_repeated_query_served_from_memory(self):
+        warmer = QueryWarmer(fetch=self.fetch, frequencies=WindowedTopK())
+        hits = metrics.counters['warming.hit']
+
+        first = await warmer.get_many(dict(direction='departure', destination='LED'))
+        self.assertIs(await warmer.get_many(dict(destination='LED', direction='departure')), first)
+
+        self.fetch.assert_awaited_once()
+        self.assertEqual(metrics.counters['warming.hit'], hits + 1)
+
+    async def test_concurrent_misses_share_request(self):
+        warmer = QueryWarmer(fetch=self.fetch, frequencies=WindowedTopK())
+
+        await asyncio.gather(*(warmer.get_many(dict(destination='AER')) for _ in range(3)))
+        self.fetch.assert_awaited_once()
+
+    async def test_warm_refreshes_top_queries_within_budget(self):
+        warmer = QueryWarmer(fetch=self.fetch, frequencies=WindowedTopK(), top_k=2, ttl=60, interval=60, budget=1)
+        for destination, count in (('AER', 3), ('LED', 2), ('KGD', 1)):
+            for _ in range(count):
+                await warmer.get_many(dict(destination=destination))
+        self.fetch.reset_mock()
+
+        self.assertEqual(await warmer.warm(), 1)
+        self.assertEqual(self.fetch.await_args.kwargs['destination'], 'AER')
+
+    async def test_count_served_from_cached_response(self):
+        count = AsyncMock()
+        warmer = QueryWarmer(fetch=self.fetch, frequencies=WindowedTopK(), count=count)
+        await warmer.get_many(dict(destination='LED'))
+
+        summary = await warmer.get_count(dict(destination='LED'))
+        self.assertEqual((summary.total, summary.id), (1, flight_payload()['id']))
+        count.assert_not_awaited()
+
+    async def test_count_miss_doesnt_fetch_flights(self):
+        count = AsyncMock(return_value=FlightCountResponse(total=7))
+        warmer = QueryWarmer(fetch=self.fetch, frequencies=WindowedTopK(), count=count)
+
+        self.assertEqual((await warmer.get_count(dict(destination='LED'))).total, 7)
+        self.fetch.assert_not_awaited()